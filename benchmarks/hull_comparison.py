@@ -0,0 +1,68 @@
+""" Compares the service area hull methods in services.hulls for speed and area agreement against alphashape,
+the original method, on the Belfast libraries test data. Run from the root of the repository:
+
+    python benchmarks/hull_comparison.py --pbf testEnvironment/Data/belfast.osm.pbf
+
+The .pbf is not stored in the repository, see the README for how to obtain one.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import network_bands, hulls
+
+
+def compare_hulls(G, nearest_node_dict:dict, search_distances:list, alpha_value:float, methods:list, baseline:str = 'alphashape'):
+    """ Builds the service areas with each hull method and compares every polygon with the baseline method's.
+
+    Returns:
+    --------
+    Dictionary (dict) of method -> seconds taken, polygon count, total area, and the mean and minimum intersection over union
+    (IoU) of its polygons with the baseline's.
+    """
+    areas = {}
+    results = {}
+    for method in [baseline] + [method for method in methods if method != baseline]:
+        start = time.perf_counter()
+        areas[method] = network_bands.service_areas(nearest_node_dict, G, search_distances, alpha_value, 'length', hull_method=method)
+        results[method] = {'seconds': time.perf_counter() - start, 'polygons': len(areas[method]),
+                           'total_area': float(areas[method].area.sum())}
+
+    for method, gdf in areas.items():
+        base = areas[baseline].geometry.values
+        intersection = gdf.geometry.values.intersection(base).area
+        union = gdf.geometry.values.union(base).area
+        iou = pd.Series(intersection / union).fillna(1.0)
+        results[method].update(mean_iou=float(iou.mean()), min_iou=float(iou.min()),
+                               speedup=results[baseline]['seconds'] / results[method]['seconds'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pbf', default='testEnvironment/Data/belfast.osm.pbf')
+    parser.add_argument('--facilities', default='testEnvironment/Data/libraries_belfast_2024.csv')
+    parser.add_argument('--distances', type=int, nargs='+', default=[1000, 2000, 3000])
+    parser.add_argument('--alpha', type=float, default=500)
+    parser.add_argument('--methods', nargs='+', default=list(hulls.HULL_METHODS))
+    parser.add_argument('--output', help='Optional JSON file to write the results to.')
+    args = parser.parse_args()
+
+    G, nodes, edges = network_bands.load_osm_network(args.pbf, network_type='driving', graph_type='csr')
+    facilities = network_bands.csv_to_gdf(pd.read_csv(args.facilities), x_col='X COORDINATE', y_col='Y COORDINATE',
+                                          input_crs=29902, crs_conversion=4326)
+    nearest_node_dict = network_bands.nearest_node_and_name(G, facilities, location_name='Static Library Name')
+
+    results = compare_hulls(G, nearest_node_dict, args.distances, args.alpha, args.methods)
+    print(pd.DataFrame(results).T.to_string(float_format=lambda value: f'{value:.4g}'))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+""" Times the network_bands hot paths on synthetic road networks, so changes can be checked for speed and memory regressions
+without a .pbf file. Grid and random (Delaunay) road graphs of each size are generated around Belfast with synthetic facilities
+and households, each function is timed and then run again under tracemalloc for its peak memory. Run from the root of the repository:
+
+    python benchmarks/network_bands_benchmark.py --sizes 1000 10000 100000 1000000 --output benchmark.json
+    python benchmarks/network_bands_benchmark.py --sizes 1000 10000 --compare benchmark.json
+
+Peak memory is that of Python and numpy allocations (tracemalloc), memory allocated inside GEOS or scipy's C code is not included.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import networkx as nx
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from scipy.spatial import Delaunay
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services import network_bands, instrumentation
+from services.graph_arrays import csr_graph_from_frames
+
+# centre of the synthetic networks and metres per degree there, so coordinates are realistic lon/lat.
+ORIGIN_LON, ORIGIN_LAT = -5.93, 54.6
+METRES_PER_DEGREE_LAT = 111_320
+METRES_PER_DEGREE_LON = METRES_PER_DEGREE_LAT * np.cos(np.radians(ORIGIN_LAT))
+
+FUNCTIONS = ['nearest_node_and_name', 'service_areas', 'service_bands', 'network_partition_bands', 'shortest_path_iterator']
+
+
+def synthetic_network(n_nodes:int, kind:str = 'grid', spacing:float = 50, seed:int = 0):
+    """ Generates a two-way road network of about `n_nodes` nodes as pyrosm style nodes and edges frames. 'grid' is a jittered
+    square lattice, 'random' is the Delaunay triangulation of uniformly random nodes; both average `spacing` metres between nodes.
+
+    Returns:
+    --------
+    nodes (DataFrame) with id, lon and lat and edges (DataFrame) with u, v and length in metres.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_nodes)))
+    if kind == 'grid':
+        row, column = np.divmod(np.arange(side * side), side)
+        x = column * spacing + rng.normal(0, spacing / 10, side * side)
+        y = row * spacing + rng.normal(0, spacing / 10, side * side)
+        node = np.arange(side * side).reshape(side, side)
+        u = np.concatenate((node[:, :-1].ravel(), node[:-1, :].ravel()))
+        v = np.concatenate((node[:, 1:].ravel(), node[1:, :].ravel()))
+    elif kind == 'random':
+        x = rng.uniform(0, side * spacing, n_nodes)
+        y = rng.uniform(0, side * spacing, n_nodes)
+        simplices = Delaunay(np.column_stack((x, y))).simplices
+        pairs = np.sort(np.concatenate((simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [2, 0]])), axis=1)
+        u, v = np.unique(pairs, axis=0).T
+    else:
+        raise ValueError(f"Unknown network kind '{kind}', available kinds: ['grid', 'random']")
+
+    nodes = pd.DataFrame({'id': np.arange(len(x)), 'lon': ORIGIN_LON + x / METRES_PER_DEGREE_LON,
+                          'lat': ORIGIN_LAT + y / METRES_PER_DEGREE_LAT})
+    edges = pd.DataFrame({'u': u, 'v': v, 'length': np.hypot(x[u] - x[v], y[u] - y[v])})
+    return nodes, edges
+
+
+def synthetic_points(nodes:pd.DataFrame, n_points:int, seed:int = 1):
+    """ Uniformly random points over the extent of the network nodes, named point_{i}, in EPSG:4326."""
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(nodes['lon'].min(), nodes['lon'].max(), n_points)
+    lat = rng.uniform(nodes['lat'].min(), nodes['lat'].max(), n_points)
+    return gpd.GeoDataFrame({'name': [f'point_{i}' for i in range(n_points)]}, geometry=gpd.points_from_xy(lon, lat), crs=4326)
+
+
+def to_networkx(nodes:pd.DataFrame, edges:pd.DataFrame):
+    """ networkx MultiDiGraph of a synthetic network, with edges in both directions as pyrosm builds them."""
+    G = nx.MultiDiGraph(crs='EPSG:4326')
+    G.add_nodes_from((node, {'x': x, 'y': y}) for node, x, y in zip(nodes['id'].tolist(), nodes['lon'].tolist(), nodes['lat'].tolist()))
+    lengths = edges['length'].tolist()
+    G.add_edges_from((u, v, {'length': length}) for u, v, length in zip(edges['u'].tolist(), edges['v'].tolist(), lengths))
+    G.add_edges_from((v, u, {'length': length}) for u, v, length in zip(edges['u'].tolist(), edges['v'].tolist(), lengths))
+    return G
+
+
+def measure(function, repeat:int = 1, memory:bool = True):
+    """ Runs `function` `repeat` times and returns the fastest wall time in seconds and, if memory is True, the peak traced
+    memory in MB of one further run. Printing and progress bars from the function are switched off."""
+    times = []
+    with instrumentation.instrument(verbose=False):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        peak = None
+        if memory:
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+    return min(times), peak
+
+
+def benchmark_graph(G, facilities:gpd.GeoDataFrame, households:gpd.GeoDataFrame, search_distances:list, alpha_value:float,
+                    functions:list, repeat:int = 1, memory:bool = True):
+    """ Times each of `functions` on one graph. Returns a dictionary of function -> {'seconds', 'peak_memory_mb'}."""
+    nearest_node_dict = network_bands.nearest_node_and_name(G, facilities, location_name='name')
+    areas = None
+
+    def snap():
+        #clear the cached KD-tree so the index build is included, as on the first call in a session.
+        network_bands._node_index_cache.pop(G, None)
+        network_bands.nearest_node_and_name(G, households, location_name='name')
+
+    def run_service_areas():
+        nonlocal areas
+        areas = network_bands.service_areas(nearest_node_dict, G, search_distances, alpha_value, 'length')
+
+    benchmarks = {
+        'nearest_node_and_name': snap,
+        'service_areas': run_service_areas,
+        'service_bands': lambda: network_bands.service_bands(areas, dissolve_cat='distance'),
+        'network_partition_bands': lambda: network_bands.network_partition_bands(nearest_node_dict, G, search_distances,
+                                                                                 alpha_value, 'length'),
+        'shortest_path_iterator': lambda: network_bands.shortest_path_iterator(households.copy(), facilities, G,
+                                                                               destination_name='name'),
+    }
+    results = {}
+    for function in functions:
+        if function == 'service_bands' and areas is None:
+            with instrumentation.instrument(verbose=False):
+                run_service_areas()
+        seconds, peak = measure(benchmarks[function], repeat=repeat, memory=memory)
+        results[function] = {'seconds': seconds, 'peak_memory_mb': peak}
+    return results
+
+
+def run(sizes:list, kinds:list, graph_types:list, functions:list, n_facilities:int, n_households:int, search_distances:list,
+        alpha_value:float, repeat:int = 1, memory:bool = True, max_networkx_nodes:int = 100_000):
+    """ Benchmarks every combination of size, network kind and graph type. Returns a list of result rows."""
+    rows = []
+    for kind in kinds:
+        for size in sizes:
+            nodes, edges = synthetic_network(size, kind)
+            facilities = synthetic_points(nodes, n_facilities, seed=1)
+            households = synthetic_points(nodes, n_households, seed=2)
+            for graph_type in graph_types:
+                if graph_type == 'networkx' and len(nodes) > max_networkx_nodes:
+                    print(f'Skipping networkx {kind} graph of {len(nodes)} nodes, above --max-networkx-nodes')
+                    continue
+                start = time.perf_counter()
+                if graph_type == 'csr':
+                    G = csr_graph_from_frames(nodes, edges, network_type='driving')
+                else:
+                    G = to_networkx(nodes, edges)
+                build_seconds = time.perf_counter() - start
+                print(f'Benchmarking {graph_type} {kind} graph of {len(nodes)} nodes and {len(edges) * 2} edges')
+                results = benchmark_graph(G, facilities, households, search_distances, alpha_value, functions, repeat, memory)
+                for function, result in results.items():
+                    rows.append({'kind': kind, 'graph_type': graph_type, 'nodes': len(nodes), 'edges': len(edges) * 2,
+                                 'build_seconds': build_seconds, 'function': function, **result})
+                    print(f'    {function:<26}{result["seconds"]:>10.3f} s' +
+                          (f'{result["peak_memory_mb"]:>10.1f} MB' if result['peak_memory_mb'] is not None else ''))
+    return rows
+
+
+def compare(rows:list, baseline_rows:list):
+    """ Table of each result's time and peak memory relative to the matching baseline result, > 1 is slower / larger."""
+    key = ['kind', 'graph_type', 'nodes', 'function']
+    current = pd.DataFrame(rows).set_index(key)
+    baseline = pd.DataFrame(baseline_rows).set_index(key)
+    joined = current.join(baseline, rsuffix='_baseline', how='inner')
+    return pd.DataFrame({'seconds': joined['seconds'], 'seconds_baseline': joined['seconds_baseline'],
+                         'time_ratio': joined['seconds'] / joined['seconds_baseline'],
+                         'memory_ratio': joined['peak_memory_mb'] / joined['peak_memory_mb_baseline']})
+
+
+def _git_commit():
+    """ Current commit of the repository, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--kinds', nargs='+', choices=['grid', 'random'], default=['grid', 'random'])
+    parser.add_argument('--graph-types', nargs='+', choices=['csr', 'networkx'], default=['csr', 'networkx'])
+    parser.add_argument('--functions', nargs='+', choices=FUNCTIONS, default=FUNCTIONS)
+    parser.add_argument('--facilities', type=int, default=10, help='Number of synthetic facilities.')
+    parser.add_argument('--households', type=int, default=100_000, help='Number of synthetic households.')
+    parser.add_argument('--distances', type=int, nargs='+', default=[1000, 2000, 3000])
+    parser.add_argument('--alpha', type=float, default=500)
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per function, the fastest is kept.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc run measuring peak memory.')
+    parser.add_argument('--max-networkx-nodes', type=int, default=100_000, help='Largest graph to build as networkx.')
+    parser.add_argument('--output', help='Optional JSON file to write the results to.')
+    parser.add_argument('--compare', help='Optional JSON file from an earlier run to compare the results with.')
+    args = parser.parse_args()
+
+    rows = run(args.sizes, args.kinds, args.graph_types, args.functions, args.facilities, args.households, args.distances,
+               args.alpha, repeat=args.repeat, memory=not args.no_memory, max_networkx_nodes=args.max_networkx_nodes)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': _git_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                       'machine': platform.platform(), 'arguments': vars(args), 'results': rows}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f'Compared with commit {baseline.get("commit")}:')
+        print(compare(rows, baseline['results']).to_string(float_format=lambda value: f'{value:.3g}'))
+
+
+if __name__ == '__main__':
+    main()
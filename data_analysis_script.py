@@ -11,7 +11,7 @@ import json
 
 #project specific packages
 
-from services import network_bands, batch_csv, census_merge, pandas_aux as pdaux
+from services import network_bands, batch_csv, census_merge, zone_assign, pandas_aux as pdaux
 
 # %% [markdown]
 # ---------------------------------------------------SERVICE AREA AND BAND CREATION---------------------------------------------------
@@ -99,19 +99,19 @@ pointer.to_crs(4326, inplace=True)
 belfast_zones.to_crs(pointer.crs, inplace=True)
 
 # %% [markdown]
-# Spatial join the data zones with the pointer dataset to calculate how many households (points) within each data zone. 
+# Assign each household (point) in the pointer dataset to the data zone it falls in with <b>assign_zones()</b>, to calculate how many households are within each data zone. Households and zones rarely change, so the assignment is cached in <b>cache_dir</b> and reloaded on later runs with the same data.
 # 
 # Group by datazone and .count() the points, creating a new dataframe, merging this back to the data zone dataset.
 
 # %%
-# Perform a spatial join of pointer households and datazones in Belfast to calculate households in each datazone
-joined_gdf = gpd.sjoin(pointer, belfast_zones, how='left', predicate='intersects' )
+# Assign pointer households to datazones in Belfast to calculate households in each datazone, cached between runs.
+pointer['DZ2021_cd'] = zone_assign.assign_zones(pointer, belfast_zones, 'DZ2021_cd', cache_dir=f'{base_dir}\\testEnvironment\\Data\\cache')
 #number of points found within each datazone
-datazone_pointer_count = joined_gdf.groupby('DZ2021_cd')['DZ2021_cd'].count().rename('actual_households').reset_index()
+datazone_pointer_count = pointer.groupby('DZ2021_cd')['DZ2021_cd'].count().rename('actual_households').reset_index()
 belfast_zones = pd.merge(belfast_zones, datazone_pointer_count, how = 'left')
 
 # %% [markdown]
-# Load in census data, this can be batch loaded using the <b>batch_csv_read()</b> function. Once loaded, rename any columns before commencing further; it may also be necessary to ensure column names are all upper or lower case as this can help avoid any issues later down the line.
+# Load in census data, this can be batch loaded using the <b>batch_csv_read()</b> function, which can lower case all column names as they are read (<b>lower_case_columns = True</b>) to avoid any issues later down the line. Once loaded, rename any columns before commencing further.
 # 
 # 
 
@@ -122,20 +122,18 @@ file_paths = [
     '/testEnvironment/Data/census_data/ni-2021-households.csv',
     '/testEnvironment/Data/census_data/ni-2021-employment-deprivation.csv'
 ]
-#load all defined csvs
-loaded_csv = batch_csv.batch_csv_read(file_paths)
+#load all defined csvs. Data can have irregular capitalisation, some are 'Geography Code', 'geography Code' etc. so force lower case.
+loaded_csv = batch_csv.batch_csv_read(file_paths, lower_case_columns=True)
 
 #check data is loaded loaded
 print(loaded_csv.keys())
 
 #force rename to maintain consistency of important join value column.
-loaded_csv['ni-2021-employment-deprivation'].rename(columns={'Census 2021 Data Zone Code':'Geography code',
-                                                             'Count':'employment_deprivation_count'}, inplace=True)
-
-#Data can have irregular capitalisation, avoids this bug by forcing lower case. Some are 'Geography Code', 'geography Code' etc.
-# Need to incorporate this properly into function 
-for key, df in loaded_csv.items():
-    df.columns = df.columns.str.lower()
+loaded_csv['ni-2021-employment-deprivation'].rename(columns={'census 2021 data zone code':'geography code',
+                                                             'count':'employment_deprivation_count'}, inplace=True)
+#employment deprivation has a row per data zone for each of 'not deprived' (code 0) and 'deprived' (code 1), keep the deprived count only.
+employment_deprivation = loaded_csv['ni-2021-employment-deprivation']
+loaded_csv['ni-2021-employment-deprivation'] = employment_deprivation[employment_deprivation['household deprivation (employment) code'] == 1]
     
 
 # %% [markdown]
@@ -189,23 +187,19 @@ belfast_zones_census = gpd.GeoDataFrame(belfast_zones_census, crs = 4326)
 # 
 # This is similar to the step earlier which was used to calculate the number of points within each DataZone.
 # 
-# - Spatial join to identify which househould point is situated within each network_band.
-# - This data is then spatially joined with the DataZone data.
+# - Assign each household point to the network_band it is situated within using <b>assign_bands()</b>. Only this step needs rerunning when the service bands change, the DataZone of each household was assigned earlier.
 # - This is grouped by DataZone code and unstacked, which create separate columns. 
 # - The unstacked column names are then assigned a prefix, in this case, households_ using the <b>append_col_prefix()</b> function.
 # - Remove any NaN values with <b>fill_na_with_zero()</b> function.
+# - Add the exact network distance from each household to its nearest library with <b>network_distance()</b>, summarised per DataZone as the median with a plain groupby.
 # 
 
 # %%
-# Spatial join to find which network band each household falls into
-households_with_contour = gpd.sjoin(pointer, service_bands, how="left", predicate="within")
-households_with_contour = households_with_contour.drop(columns='index_right').reset_index(drop=True)
-
-# spatial to join data zone data to each household
-households_with_zones = gpd.sjoin(households_with_contour, belfast_zones_census, how="left", predicate="within").drop(columns='index_right').reset_index(drop=True)
+# Find which network band each household falls into, each household's datazone is already assigned.
+pointer['distance'] = zone_assign.assign_bands(pointer, service_bands, 'distance')
 
 # Group by census zone and distance and then count. Unstacks the distance columns to create separate columns for each distance.
-household_counts = households_with_zones.groupby(['DZ2021_cd', 'distance']).size().unstack(fill_value=0)
+household_counts = pointer.groupby(['DZ2021_cd', 'distance']).size().unstack(fill_value=0)
 
 #join this back to the belfast_census_zones to add the counts as new columns
 belfast_zones_census = belfast_zones_census.merge(household_counts, on='DZ2021_cd', how='left')
@@ -216,6 +210,12 @@ belfast_zones_census = pdaux.append_col_prefix(belfast_zones_census, [1000, 2000
 #replace NaNs with 0s
 pdaux.fill_na_with_zero(belfast_zones_census, ['households_1000','households_2000','households_3000'])
 
+# Exact network distance from every household to its nearest library, from one search and a lookup rather than polygon joins.
+pointer = network_bands.network_distance(locations=pointer, graph=G, nearest_node_dict=start_locations_nearest_node)
+#median distance to the nearest library of the households in each datazone
+median_distance = pointer.groupby('DZ2021_cd')['network_distance'].median().rename('median_network_distance')
+belfast_zones_census = belfast_zones_census.merge(median_distance, on='DZ2021_cd', how='left')
+
 
 # %% [markdown]
 # The data is plotted with folium, the calculated households within each network band per datazone is shown in a popup for each datazone. Datazones can be searched for in this example by DZ2021_cd and their Name.
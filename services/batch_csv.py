@@ -1,15 +1,27 @@
 import os
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 
-def batch_csv_read(file_paths:list):
+def batch_csv_read(file_paths:list, max_workers:int = None, engine:str = None, schemas:dict = None,
+                   lower_case_columns:bool = False, parquet_cache:bool = False):
     """ Function to read all CSVs and place into a dictionary of dataframes for subsequent analysis and joining.
     File paths should be from the parent folder onwards. Do not include C:/User etc.
-    
+    Files are read concurrently on a thread pool; pandas releases the GIL while parsing, more so with the pyarrow engine.
+
     Parameters:
     -----------
         file_paths (list): A list of file paths, each string should look like '/data/stored/here/mydata.csv'.
-        
+        max_workers (int): Optional; number of threads to read with. Defaults to one per file, up to the ThreadPoolExecutor default.
+        engine (str): Optional; pd.read_csv parser engine, e.g. 'pyarrow' for much faster parsing of large files. Defaults to pandas' default.
+        schemas (dict): Optional; per file read options keyed by file name without extension, passed to pd.read_csv, e.g.
+            {'ni-2021-households': {'usecols': ['Geography code', 'All households'], 'dtype': {'All households': 'Int64'}}}.
+        lower_case_columns (bool): If True, column names are lower cased as they are read, avoiding 'Geography Code' vs 'Geography code'.
+        parquet_cache (bool): If True, each CSV is saved as a Parquet sidecar next to it after it is first read, and later reads load the
+            sidecar instead of parsing the CSV. The sidecar is remade if the CSV is newer or the read options change.
+
     Example:
     --------
     >>> # Define file paths – relative path for each csv
@@ -20,13 +32,48 @@ def batch_csv_read(file_paths:list):
     >>> ]
     >>> load all defined csvs
     >>> loaded_csv = batch_csv.batch_csv_read(file_paths)
-    
+    >>> # or, typed and lower cased with repeat loads skipping csv parsing
+    >>> loaded_csv = batch_csv.batch_csv_read(file_paths, engine = 'pyarrow', lower_case_columns = True, parquet_cache = True)
+
     """
     base_dir = os.getcwd()
-    csv_loaded = {}
-    for file_path in file_paths:
-        filename = os.path.basename(file_path)
-        key = os.path.splitext(filename)[0]
-        csv_loaded[key] = pd.read_csv(base_dir+file_path)
+    schemas = schemas or {}
+    keys = [os.path.splitext(os.path.basename(file_path))[0] for file_path in file_paths]
+
+    def read(key, file_path):
+        return _read_csv(base_dir+file_path, schemas.get(key, {}), engine, lower_case_columns, parquet_cache)
+
+    #map keeps the results in the order of file_paths
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(read, keys, file_paths))
+    csv_loaded = dict(zip(keys, frames))
+
+    return csv_loaded
+
+
+def _read_csv(path:str, read_options:dict, engine:str, lower_case_columns:bool, parquet_cache:bool):
+    """ Reads one csv for batch_csv_read, via its Parquet sidecar if caching."""
+    if parquet_cache:
+        #the sidecar name carries a hash of the read options, so changing a schema never reads a stale sidecar.
+        options = json.dumps([read_options, lower_case_columns], sort_keys=True, default=str)
+        sidecar = f'{os.path.splitext(path)[0]}.{hashlib.sha256(options.encode()).hexdigest()[:12]}.parquet'
+        if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+            return pd.read_parquet(sidecar)
+
+    if engine:
+        df = pd.read_csv(path, engine=engine, **read_options)
+    else:
+        df = pd.read_csv(path, **read_options)
+    if lower_case_columns:
+        df.columns = df.columns.str.lower()
 
-    return csv_loaded
\ No newline at end of file
+    if parquet_cache:
+        #written to a temporary file and renamed into place, so an interrupted or concurrent run never leaves a truncated sidecar.
+        temp_sidecar = f'{sidecar}.tmp-{os.getpid()}'
+        try:
+            df.to_parquet(temp_sidecar)
+            os.replace(temp_sidecar, sidecar)
+        finally:
+            if os.path.exists(temp_sidecar):
+                os.remove(temp_sidecar)
+    return df
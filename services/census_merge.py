@@ -3,40 +3,72 @@ import pandas as pd
 ### Join census CSV data together, merging and dropping duplicate columns excluding the join_column
 
 def join_census_csv(dict_of_df:dict, join_column:str, drop:bool, join_type='left'):
-    """ Join census data by geographic code. Deletes duplicated. Ensure there are not any duplicate label names.
-    geography_code or whaterver the join column is should be returned as dropped from the right dataframe.
+    """ Join census data by geographic code in a single pass. Every dataframe is indexed on the join column once, aligned to the
+    same keys and concatenated side by side, rather than merged pair by pair. Each key must appear once per dataframe, duplicates
+    are reported with a ValueError rather than silently dropped; filter or aggregate such tables to one row per key first.
+    geography_code or whaterver the join column is appears once in the result.
     
     Parameters: 
     -----------
         dict_of_df (dict): dictionary of dataframes, a result of the mass_csv_read() function.
         join_column (str): column name to join by.
-        drop (bool): Drop duplicate columns if true, else keep them.
-        join_type (str): type of join - SQL-like, see pd.merge() docs. Recommended to use 'left' or 'inner' join where possible.
+        drop (bool): Drop duplicate columns if true (keeping the first dataframe's), else keep both with '_x' and '_y' suffixes.
+        join_type (str): type of join - SQL-like. 'left' keeps the keys of the first dataframe, 'right' the keys of the last, 
+            'inner' keys in every dataframe and 'outer' keys in any. Recommended to use 'left' or 'inner' join where possible.
 
     Example:
     --------
     >>> joined_census_data = census_merge.join_census_csv(loaded_csv, 'geography code',  
                                                           drop=True,join_type='left')
 """
-    joined_df = next(iter(dict_of_df.values()))
-    columns_dropped = []
+    if join_type not in ['left', 'right', 'inner', 'outer']:
+        raise ValueError(f"join_type must be 'left', 'right', 'inner' or 'outer', not '{join_type}'")
+    
+    #validate up front that every key is unique, a duplicated key would multiply rows in the join.
+    duplicates = {}
     for key, df in dict_of_df.items():
-        
-        if df is not joined_df: #ensure it doesn't join self
-            #clean the data first. using .drop_duplicated() producted awkward column names. This way is cleaner.
-            columns_to_drop = []
-            for column in df.columns:
-                if column in joined_df.columns and column != join_column:
-                    columns_to_drop.append(column)
-            #ensures data join happens regardless of if dropping columns happens or not
-            df_to_join = df 
-            if drop == True:
-                df_to_join = df.drop(columns=columns_to_drop)
-                
+        duplicated_keys = df.loc[df[join_column].duplicated(), join_column].unique()
+        if len(duplicated_keys):
+            duplicates[key] = f'{len(duplicated_keys)} duplicated, e.g. {list(duplicated_keys[:3])}'
+    if duplicates:
+        raise ValueError(f"'{join_column}' values must be unique within each dataframe to join, found duplicates in: {duplicates}")
+    
+    join_column_position = next(iter(dict_of_df.values())).columns.get_loc(join_column)
+    indexed = {key: df.set_index(join_column) for key, df in dict_of_df.items()}
+    frames = list(indexed.values())
+    if join_type == 'left':
+        keys = frames[0].index
+    elif join_type == 'right':
+        keys = frames[-1].index
+    else:
+        keys = frames[0].index
+        for df in frames[1:]:
+            keys = keys.intersection(df.index, sort=False) if join_type == 'inner' else keys.union(df.index, sort=False)
+    
+    #resolve duplicate column names, with drop the first dataframe's columns take precedence, otherwise both are kept
+    #with pd.merge's '_x' and '_y' suffixes so drop_dupe_cols() can still be used on the result.
+    columns_dropped = []
+    to_join = []
+    owner = {}
+    for index, df in enumerate(frames):
+        columns_to_drop = [column for column in df.columns if column in owner]
+        if index > 0:
             columns_dropped.append(columns_to_drop)
-            joined_df = pd.merge(joined_df, df_to_join, on=join_column, how=join_type)
-    #without this the dataframe can be doubled in length dependiung on what's joined.           
-    joined_df.drop_duplicates(subset=join_column, inplace=True)
+            if drop:
+                df = df.drop(columns=columns_to_drop)
+            else:
+                for column in columns_to_drop:
+                    to_join[owner[column]] = to_join[owner[column]].rename(columns={column: f'{column}_x'})
+                    del owner[column]
+                df = df.rename(columns={column: f'{column}_y' for column in columns_to_drop})
+        owner.update({column: index for column in df.columns})
+        to_join.append(df.reindex(keys))
+    
+    joined_df = pd.concat(to_join, axis=1)
+    joined_df.index.name = join_column
+    joined_df = joined_df.reset_index()
+    #return the join column to where it was in the first dataframe, as pd.merge does.
+    joined_df.insert(join_column_position, join_column, joined_df.pop(join_column))
     
     if drop:
         print(f'The following columns were duplicates from the right join and were dropped: {columns_dropped}')
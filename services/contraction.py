@@ -0,0 +1,264 @@
+import heapq
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from services.graph_arrays import CSRGraph, csr_graph_from_networkx
+from services.instrumentation import echo, progress, stage
+
+### Contraction hierarchy routing index for repeated origin-destination queries on the same graph. Preprocessing contracts
+### the nodes one at a time in order of importance, adding shortcut edges which preserve shortest distances. A query then only
+### searches upwards (towards more important nodes) from the origin and from the destination, exploring a few hundred nodes
+### rather than the whole graph.
+
+class ContractionHierarchy:
+    """ Preprocessed routing index answering exact shortest distance queries in a fraction of the time of a Dijkstra search.
+    Holds the upward graph (edges from each node to more important ones, including shortcuts) for searches from origins and
+    the reverse upward graph for searches from destinations. Build with `build_contraction_hierarchy`, save it with `save` and
+    reload it with `ContractionHierarchy.load`, it does not need the original graph to answer queries.
+
+    Parameters:
+    -----------
+        node_ids (np.ndarray): Sorted node ids of the graph the index was built from.
+        rank (np.ndarray): Contraction order of each node, higher is more important.
+        forward (tuple): (indptr, indices, weights) CSR arrays of the upward graph.
+        backward (tuple): (indptr, indices, weights) CSR arrays of the reverse upward graph.
+        weight (str): The edge weight the index was built with, e.g. 'length'.
+
+    Example:
+    --------
+    >>> G, nodes, edges = services.network_bands.load_osm_network(roads, network_type = 'driving', graph_type = 'csr')
+    >>> ch = services.contraction.build_contraction_hierarchy(G, weight = 'length')
+    >>> ch.save('belfast_driving_length.npz')
+    >>> ch.query(475085580, 73250694)
+    >>> 5123.4
+    """
+    def __init__(self, node_ids, rank, forward:tuple, backward:tuple, weight:str = 'length'):
+        self.node_ids = node_ids
+        self.rank = rank
+        self.weight = weight
+        n = len(node_ids)
+        self._forward = csr_matrix((forward[2], forward[1], forward[0]), shape=(n, n))
+        self._backward = csr_matrix((backward[2], backward[1], backward[0]), shape=(n, n))
+
+    def __repr__(self):
+        return (f'ContractionHierarchy of {len(self.node_ids)} nodes with {self._forward.nnz + self._backward.nnz} upward edges, '
+                f'weight: {self.weight}')
+
+    def positions(self, node_ids):
+        """ Converts node ids into positions in the index. Raises a KeyError if any id was not on the graph."""
+        node_ids = np.asarray(node_ids)
+        positions = np.minimum(np.searchsorted(self.node_ids, node_ids), len(self.node_ids) - 1)
+        missing = self.node_ids[positions] != node_ids
+        if np.any(missing):
+            raise KeyError(f'Nodes not in the routing index: {np.atleast_1d(node_ids)[np.atleast_1d(missing)][:10].tolist()}')
+        return positions
+
+    def query(self, source, target):
+        """ Shortest distance from node `source` to node `target`, inf if there is no path. Runs scipy's Dijkstra upwards from the
+        source and from the destination, each searching only the few hundred nodes above it in the hierarchy, and returns the
+        shortest meeting. For many pairs `distance_matrix` is quicker."""
+        source, target = self.positions(source), self.positions(target)
+        forward = dijkstra(self._forward, indices=source)
+        backward = dijkstra(self._backward, indices=target)
+        return float(np.min(forward + backward))
+
+    def distance_matrix(self, sources, targets, chunksize:int = 64):
+        """ Shortest distances from every node in `sources` to every node in `targets`, in one batch. Upward searches are run once per
+        source and once per target, then the distance of each pair is the minimum over the nodes where their searches meet, the
+        bucket method for many-to-many queries. Memory is bounded by `chunksize`.
+
+        Returns:
+        --------
+        numpy array of shape (len(sources), len(targets)), inf where there is no path.
+
+        Example:
+        --------
+        >>> distances = ch.distance_matrix(household_nodes, library_nodes)
+        """
+        source_positions = self.positions(np.asarray(sources).reshape(-1))
+        target_positions = self.positions(np.asarray(targets).reshape(-1))
+        result = np.full((len(source_positions), len(target_positions)), np.inf)
+
+        for target_start in range(0, len(target_positions), chunksize):
+            #backward search spaces of this chunk of targets, as a dense array over the nodes they reach.
+            backward = dijkstra(self._backward, indices=target_positions[target_start:target_start + chunksize])
+            reached = np.flatnonzero(np.isfinite(backward).any(axis=0))
+            backward = backward[:, reached]
+            column_of_node = np.full(len(self.node_ids), -1)
+            column_of_node[reached] = np.arange(len(reached))
+
+            for source_start in range(0, len(source_positions), chunksize):
+                forward = dijkstra(self._forward, indices=source_positions[source_start:source_start + chunksize])
+                row, node = np.nonzero(np.isfinite(forward))
+                column = column_of_node[node]
+                meets = column >= 0
+                row, node, column = row[meets], node[meets], column[meets]
+                if len(row) == 0:
+                    continue
+                #distance through every meeting node to every target, then the minimum per source.
+                through = forward[row, node][:, None] + backward[:, column].T
+                run_start = np.flatnonzero(np.r_[True, row[1:] != row[:-1]])
+                result[source_start + row[run_start], target_start:target_start + backward.shape[0]] = np.minimum.reduceat(
+                    through, run_start, axis=0)
+        return result
+
+    def save(self, file_path:str):
+        """ Saves the index to a .npz file, reload it with `ContractionHierarchy.load`."""
+        np.savez(file_path, node_ids=self.node_ids, rank=self.rank, weight=np.array(self.weight),
+                 forward_indptr=self._forward.indptr, forward_indices=self._forward.indices, forward_weights=self._forward.data,
+                 backward_indptr=self._backward.indptr, backward_indices=self._backward.indices, backward_weights=self._backward.data)
+
+    @classmethod
+    def load(cls, file_path:str):
+        """ Loads an index saved with `save`."""
+        with np.load(file_path) as saved:
+            return cls(saved['node_ids'], saved['rank'],
+                       (saved['forward_indptr'], saved['forward_indices'], saved['forward_weights']),
+                       (saved['backward_indptr'], saved['backward_indices'], saved['backward_weights']),
+                       weight=str(saved['weight']))
+
+
+def build_contraction_hierarchy(graph, weight:str = 'length', max_settled:int = 500, priority_settled:int = 5):
+    """ Builds a contraction hierarchy of the graph, a one off cost after which point to point queries search a few hundred nodes
+    rather than the whole graph. Every node is contracted, in order of edge difference (shortcuts added minus edges removed) plus
+    the number of neighbours already contracted and their depth in the hierarchy. Priorities are updated lazily: a node's is
+    checked again when it reaches the front of the queue, and it goes back in if it is no longer the least important.
+
+    Build time grows faster than linearly with the number of nodes and depends on how hierarchical the network is: around a
+    minute and a half for a 200k node road network, but on grid-like or triangulated networks 0.9s for 1k nodes, 8s for 4k and
+    40s for 10k. Build once, `save` the result and reuse it.
+
+    Returns:
+    --------
+    ContractionHierarchy of the graph.
+
+    Parameters:
+    -----------
+        graph (networkx.Graph or CSRGraph): The graph representing the network, e.g. from `load_osm_network`.
+        weight (str): The edge attribute to use as a weight. Defaults to 'length'.
+        max_settled (int): Nodes each witness search may settle when contracting a node before giving up. Lower is faster to
+            build but adds more (unneeded, never incorrect) shortcuts. Defaults to 500.
+        priority_settled (int): As max_settled, for the witness searches estimating each node's priority. Defaults to 5.
+
+    Example:
+    --------
+    >>> ch = services.contraction.build_contraction_hierarchy(G, weight = 'length')
+    >>> ch.save('belfast_driving_length.npz')
+    """
+    if not isinstance(graph, CSRGraph):
+        graph = csr_graph_from_networkx(graph, weights=[weight])
+    n = graph.number_of_nodes()
+    echo(f'Building a contraction hierarchy of {n} nodes')
+
+    with stage('build_contraction_hierarchy', nodes=n) as record:
+        #remaining graph as adjacency dictionaries, parallel edges and self loops were removed when the CSRGraph was built.
+        out_edges = [dict() for _ in range(n)]
+        in_edges = [dict() for _ in range(n)]
+        source = np.repeat(np.arange(n), np.diff(graph.indptr)).tolist()
+        for u, v, w in zip(source, graph.indices.tolist(), np.asarray(graph.weights[weight], dtype=float).tolist()):
+            if u != v and np.isfinite(w):
+                out_edges[u][v] = w
+                in_edges[v][u] = w
+
+        contracted_neighbours = [0] * n
+        level = [0] * n
+
+        def priority(v):
+            shortcuts = _shortcuts(v, out_edges, in_edges, priority_settled)
+            return len(shortcuts) - len(in_edges[v]) - len(out_edges[v]) + contracted_neighbours[v] + level[v]
+
+        queue = [(priority(v), v) for v in progress(range(n), desc='Ordering nodes')]
+        heapq.heapify(queue)
+        rank = np.zeros(n, dtype=np.int64)
+        forward_edges = []
+        backward_edges = []
+        shortcut_count = 0
+
+        with progress(None, total=n, desc='Contracting nodes') as bar:
+            next_rank = 0
+            while queue:
+                _, v = heapq.heappop(queue)
+                #priorities change as the graph is contracted, so contract v only if it is still the least important.
+                current = priority(v)
+                if queue and current > queue[0][0]:
+                    heapq.heappush(queue, (current, v))
+                    continue
+
+                shortcuts = _shortcuts(v, out_edges, in_edges, max_settled)
+                #the remaining edges of v all lead to nodes contracted later, i.e. more important ones.
+                rank[v] = next_rank
+                next_rank += 1
+                forward_edges.extend((v, x, w) for x, w in out_edges[v].items())
+                backward_edges.extend((v, u, w) for u, w in in_edges[v].items())
+                for x in set(out_edges[v]) | set(in_edges[v]):
+                    contracted_neighbours[x] += 1
+                    level[x] = max(level[x], level[v] + 1)
+                for x in out_edges[v]:
+                    del in_edges[x][v]
+                for u in in_edges[v]:
+                    del out_edges[u][v]
+                out_edges[v] = {}
+                in_edges[v] = {}
+                for u, x, w in shortcuts:
+                    if w < out_edges[u].get(x, np.inf):
+                        out_edges[u][x] = w
+                        in_edges[x][u] = w
+                shortcut_count += len(shortcuts)
+                bar.update()
+        record.update(shortcuts=shortcut_count)
+
+    echo(f'Contraction hierarchy built with {shortcut_count} shortcuts')
+    return ContractionHierarchy(graph.node_ids, rank, _edge_list_csr(forward_edges, n), _edge_list_csr(backward_edges, n), weight)
+
+
+def _shortcuts(v:int, out_edges:list, in_edges:list, max_settled:int):
+    """ Shortcuts (u, x, distance) needed to keep shortest distances if v is removed: one for each path u -> v -> x with no
+    witness path from u to x avoiding v which is as short, found by a Dijkstra search from u limited to `max_settled` nodes."""
+    shortcuts = []
+    outs = out_edges[v]
+    if not outs:
+        return shortcuts
+    for u, weight_uv in in_edges[v].items():
+        via_v = {x: weight_uv + weight_vx for x, weight_vx in outs.items() if x != u}
+        if via_v:
+            shortcuts.extend((u, x, via_v[x]) for x in _witness_search(u, v, via_v, max_settled, out_edges))
+    return shortcuts
+
+
+def _witness_search(source:int, excluded:int, via_v:dict, max_settled:int, out_edges:list):
+    """ Targets of `via_v` (target -> distance through the excluded node) with no path from source as short which avoids
+    `excluded`. A Dijkstra search of the remaining graph which stops once every target has a witness, beyond the longest distance
+    through the excluded node or after `max_settled` nodes; a target is only dropped on finding a real path, so giving up early
+    only adds unneeded shortcuts."""
+    pending = dict(via_v)
+    max_distance = max(pending.values())
+    distances = {source: 0.0}
+    heap = [(0.0, source)]
+    settled = 0
+    while heap and pending:
+        distance, node = heapq.heappop(heap)
+        if distance > distances[node]:
+            continue
+        if settled >= max_settled:
+            break
+        settled += 1
+        for neighbour, weight in out_edges[node].items():
+            new_distance = distance + weight
+            if neighbour == excluded or new_distance > max_distance or new_distance >= distances.get(neighbour, np.inf):
+                continue
+            distances[neighbour] = new_distance
+            if new_distance <= pending.get(neighbour, -1.0):
+                del pending[neighbour]
+            heapq.heappush(heap, (new_distance, neighbour))
+    return list(pending)
+
+
+def _edge_list_csr(edge_list:list, n:int):
+    """ (indptr, indices, weights) CSR arrays of a list of (source, target, weight) edges on n nodes."""
+    if not edge_list:
+        return np.zeros(n + 1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0)
+    source, target, weights = (np.array(column) for column in zip(*edge_list))
+    order = np.lexsort((target, source))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=n), out=indptr[1:])
+    return indptr, target[order].astype(np.int32), weights[order].astype(float)
@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+# oneway tag values, matching pyrosm. '-1' and 'T' mean the way may only be travelled against its digitised direction.
+ONEWAY_VALUES = ['yes', 'true', '1', '-1', 'T', 'F']
+AGAINST_VALUES = ['-1', 'T']
+# network types pyrosm makes two-way whatever their oneway tags, and the OSMnx names pyrosm also accepts.
+TWO_WAY_NETWORKS = ['walking', 'all', 'all_public']
+NETWORK_TYPE_ALIASES = {'drive': 'driving', 'drive_service': 'driving+service', 'walk': 'walking', 'bike': 'cycling'}
+
+
+class CSRGraph:
+    """ Compact, array-backed directed graph for routing. Adjacency is stored in compressed sparse row (CSR) form:
+    the outgoing edges of the node at position i are `indices[indptr[i]:indptr[i+1]]` with one weight array per
+    weight attribute. Nodes are held in ascending id order so ids map to positions with a binary search.
+    Uses a fraction of the memory of a networkx graph and is searched with scipy's compiled, heap-based Dijkstra.
+    Build with `csr_graph_from_frames` or `csr_graph_from_networkx` rather than directly.
+
+    Parameters:
+    -----------
+        node_ids (np.ndarray): Sorted, unique node ids (e.g. OSM ids).
+        x (np.ndarray): x coordinate (longitude) of each node.
+        y (np.ndarray): y coordinate (latitude) of each node.
+        indptr (np.ndarray): CSR row offsets, length number of nodes + 1.
+        indices (np.ndarray): Target node position of each edge.
+        weights (dict): Weight attribute name -> np.ndarray with a weight per edge, e.g. {'length': array}.
+        crs (str or int): Coordinate reference system of the node coordinates. Defaults to 'EPSG:4326'.
+
+    Example:
+    --------
+    >>> G, nodes, edges = services.network_bands.load_osm_network(file_path = roads, network_type = 'driving', graph_type = 'csr')
+    >>> print(G)
+    >>> 'CSRGraph with 225125 nodes and 440792 edges, weights: ['length'] (14.2 MB)'
+    """
+    def __init__(self, node_ids, x, y, indptr, indices, weights:dict, crs = 'EPSG:4326'):
+        self.node_ids = node_ids
+        self.x = x
+        self.y = y
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.crs = crs
+        self._matrices = {}
+
+    def __repr__(self):
+        return (f'CSRGraph with {self.number_of_nodes()} nodes and {self.number_of_edges()} edges, '
+                f'weights: {list(self.weights)} ({self.nbytes / 1e6:.1f} MB)')
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        """ Total size in bytes of the arrays backing the graph."""
+        arrays = [self.node_ids, self.x, self.y, self.indptr, self.indices, *self.weights.values()]
+        return sum(array.nbytes for array in arrays)
+
+    def positions(self, node_ids):
+        """ Converts node ids into positions in the graph's arrays. Raises a KeyError if any id is not on the graph."""
+        node_ids = np.asarray(node_ids)
+        positions = np.searchsorted(self.node_ids, node_ids)
+        positions = np.minimum(positions, len(self.node_ids) - 1)
+        missing = self.node_ids[positions] != node_ids
+        if np.any(missing):
+            raise KeyError(f'Nodes not on the graph: {np.asarray(node_ids)[missing][:10].tolist()}')
+        return positions
+
+    def edge_mask(self, weight:str):
+        """ Boolean array of the edges which can be travelled under `weight`, i.e. have a finite weight. On a multi-modal
+        graph from `csr_graph_from_modes` this is the mask of edges open to a mode, e.g. edge_mask('length_cycling')."""
+        if weight not in self.weights:
+            raise KeyError(f"'{weight}' is not a weight on this graph, available weights: {list(self.weights)}")
+        return np.isfinite(self.weights[weight])
+
+    def subgraph(self, keep):
+        """ CSRGraph of only the nodes where the boolean array `keep` is True and the edges between them, e.g. a study area.
+
+        Example:
+        --------
+        >>> inside = (G.x >= min_lon) & (G.x <= max_lon) & (G.y >= min_lat) & (G.y <= max_lat)
+        >>> G_area = G.subgraph(inside)
+        """
+        keep = np.asarray(keep, dtype=bool)
+        source = np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+        kept_edges = keep[source] & keep[self.indices]
+        #positions only ever shift down, so the kept edges stay sorted by (source, target).
+        new_position = np.cumsum(keep) - 1
+        n = int(keep.sum())
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(new_position[source[kept_edges]], minlength=n), out=indptr[1:])
+        return CSRGraph(self.node_ids[keep], self.x[keep], self.y[keep], indptr, new_position[self.indices[kept_edges]].astype(np.int32),
+                        {weight: values[kept_edges] for weight, values in self.weights.items()}, self.crs)
+
+    def matrix(self, weight:str, reverse:bool = False):
+        """ Returns the graph as a scipy sparse matrix of `weight`, for use with scipy.sparse.csgraph. Edges with an infinite
+        weight (closed to a mode) are left out. If reverse is True, returns the transpose so searches follow edges backwards.
+        Matrices are cached."""
+        key = (weight, reverse)
+        if key not in self._matrices:
+            n = self.number_of_nodes()
+            mask = self.edge_mask(weight)
+            if mask.all():
+                matrix = csr_matrix((self.weights[weight], self.indices, self.indptr), shape=(n, n))
+            else:
+                #row offsets counting only the open edges.
+                indptr = np.r_[0, np.cumsum(mask)][self.indptr]
+                matrix = csr_matrix((self.weights[weight][mask], self.indices[mask], indptr), shape=(n, n))
+            if reverse:
+                matrix = matrix.transpose().tocsr()
+            self._matrices[key] = matrix
+        return self._matrices[key]
+
+
+def csr_graph_from_frames(nodes:pd.DataFrame, edges:pd.DataFrame, network_type:str, weights:list = ['length'],
+                          crs = 'EPSG:4326'):
+    """ Builds a CSRGraph directly from the pyrosm nodes and edges GeoDataFrames without creating a networkx graph.
+    Edges are made directed following the OSM 'oneway' rules pyrosm uses (walking, all and all_public networks are always
+    two-way, cycling networks honour 'oneway:bicycle') and parallel edges are collapsed to the shortest per weight attribute.
+    Unlike pyrosm's graph export, every connected component is retained.
+
+    Returns:
+    --------
+    CSRGraph of the network.
+
+    Parameters:
+    -----------
+        nodes (GeoDataFrame): Network nodes from pyrosm, with 'id', 'lon' and 'lat' columns.
+        edges (GeoDataFrame): Network edges from pyrosm, with 'u', 'v', 'oneway' and the weight columns.
+        network_type (str): Type of transport the network was extracted for, e.g. driving, walking, cycling.
+        weights (list): Edge columns to store as weights. Defaults to ['length'].
+        crs (str or int): Coordinate reference system of the node coordinates. Defaults to 'EPSG:4326'.
+
+    Example:
+    --------
+    >>> nodes, edges = OSM(roads).get_network(network_type = 'driving', nodes = True)
+    >>> G = services.graph_arrays.csr_graph_from_frames(nodes, edges, network_type = 'driving')
+    """
+    source, target, edge_weights = _directed_edges(edges, network_type, weights)
+
+    node_ids = nodes['id'].to_numpy(dtype=np.int64)
+    order = np.argsort(node_ids)
+    x = nodes['lon'].to_numpy(dtype=float)[order]
+    y = nodes['lat'].to_numpy(dtype=float)[order]
+
+    return _build_csr(node_ids[order], x, y, source, target, edge_weights, crs)
+
+
+def csr_graph_from_modes(networks:dict, weights:list = ['length'], crs = 'EPSG:4326'):
+    """ Builds one CSRGraph serving several modes of transport, e.g. driving, walking and cycling, from the pyrosm nodes and edges
+    of each. The modes share a single node set and edge list, each weight is stored once per mode as '{weight}_{mode}'
+    (e.g. 'length_walking', 'travel_time_driving') and is infinite on edges the mode cannot use, so searching with a mode's
+    weight only follows that mode's edges. Edge directions follow the same rules as `csr_graph_from_frames` for each mode.
+
+    Returns:
+    --------
+    CSRGraph of all the modes.
+
+    Parameters:
+    -----------
+        networks (dict): network type -> (nodes, edges) from pyrosm, e.g. {'driving': (nodes, edges), 'walking': (nodes, edges)}.
+        weights (list): Edge columns to store as weights for every mode. Defaults to ['length'].
+        crs (str or int): Coordinate reference system of the node coordinates. Defaults to 'EPSG:4326'.
+
+    Example:
+    --------
+    >>> networks = {mode: OSM(roads).get_network(network_type = mode, nodes = True) for mode in ['driving', 'walking']}
+    >>> G = services.graph_arrays.csr_graph_from_modes(networks, weights = ['length'])
+    >>> G.edge_mask('length_walking').sum()
+    """
+    sources, targets = [], []
+    edge_weights = {f'{weight}_{mode}': [] for mode in networks for weight in weights}
+    for mode, (_, edges) in networks.items():
+        source, target, mode_weights = _directed_edges(edges, mode, weights)
+        sources.append(source)
+        targets.append(target)
+        for other_mode in networks:
+            for weight in weights:
+                values = mode_weights[weight] if other_mode == mode else np.full(len(source), np.inf)
+                edge_weights[f'{weight}_{other_mode}'].append(values)
+    edge_weights = {weight: np.concatenate(values) for weight, values in edge_weights.items()}
+
+    nodes = pd.concat([mode_nodes[['id', 'lon', 'lat']] for mode_nodes, _ in networks.values()]).drop_duplicates('id')
+    nodes = nodes.sort_values('id')
+    return _build_csr(nodes['id'].to_numpy(dtype=np.int64), nodes['lon'].to_numpy(dtype=float), nodes['lat'].to_numpy(dtype=float),
+                      np.concatenate(sources), np.concatenate(targets), edge_weights, crs)
+
+
+def _directed_edges(edges:pd.DataFrame, network_type:str, weights:list):
+    """ Source and target node ids and weight arrays of every direction the pyrosm `edges` can be travelled in, by the same rules
+    as pyrosm's graph export: walking, all and all_public networks are two-way, others follow 'oneway' (and roundabouts), with
+    'oneway:bicycle' taking precedence where it is set on cycling networks, e.g. contraflow cycling on one-way streets."""
+    u = edges['u'].to_numpy(dtype=np.int64)
+    v = edges['v'].to_numpy(dtype=np.int64)
+    network_type = network_type.lower().strip()
+    network_type = NETWORK_TYPE_ALIASES.get(network_type, network_type)
+
+    #work out which direction(s) each edge can be travelled in.
+    if network_type in TWO_WAY_NETWORKS or 'oneway' not in edges.columns:
+        forward = np.ones(len(edges), dtype=bool)
+        backward = forward
+    else:
+        direction = edges['oneway']
+        if network_type == 'cycling' and 'oneway:bicycle' in edges.columns:
+            direction = edges['oneway:bicycle'].where(edges['oneway:bicycle'].notna(), direction)
+        oneway = direction.isin(ONEWAY_VALUES).to_numpy()
+        if 'junction' in edges.columns:
+            oneway = oneway | (edges['junction'] == 'roundabout').to_numpy()
+        against = oneway & direction.isin(AGAINST_VALUES).to_numpy()
+        forward = ~against
+        backward = ~oneway | against
+
+    source = np.concatenate((u[forward], v[backward]))
+    target = np.concatenate((v[forward], u[backward]))
+    edge_weights = {}
+    for weight in weights:
+        values = edges[weight].to_numpy(dtype=float)
+        edge_weights[weight] = np.concatenate((values[forward], values[backward]))
+    return source, target, edge_weights
+
+
+def csr_graph_from_networkx(graph, weights:list = ['length']):
+    """ Converts a networkx graph (e.g. from `load_osm_network` with graph_type = 'networkx') into a CSRGraph.
+    Nodes must have 'x' and 'y' attributes. Edges missing a weight attribute get a weight of 1, as in networkx.
+
+    Returns:
+    --------
+    CSRGraph of the network.
+
+    Parameters:
+    -----------
+        graph (networkx.Graph): The graph representing the network.
+        weights (list): Edge attributes to store as weights. Defaults to ['length'].
+
+    Example:
+    --------
+    >>> G_csr = services.graph_arrays.csr_graph_from_networkx(G, weights = ['length'])
+    """
+    node_ids = np.array(list(graph.nodes), dtype=np.int64)
+    x = np.fromiter((data['x'] for _, data in graph.nodes(data=True)), dtype=float, count=len(node_ids))
+    y = np.fromiter((data['y'] for _, data in graph.nodes(data=True)), dtype=float, count=len(node_ids))
+    order = np.argsort(node_ids)
+
+    edge_list = list(graph.edges(data=True))
+    if not graph.is_directed():
+        #an undirected edge can be travelled both ways
+        edge_list += [(v, u, data) for u, v, data in edge_list]
+    source = np.array([u for u, _, _ in edge_list], dtype=np.int64)
+    target = np.array([v for _, v, _ in edge_list], dtype=np.int64)
+    edge_weights = {weight: np.array([data.get(weight, 1) for _, _, data in edge_list], dtype=float)
+                    for weight in weights}
+
+    return _build_csr(node_ids[order], x[order], y[order], source, target, edge_weights,
+                      graph.graph.get('crs', 'EPSG:4326'))
+
+
+def _build_csr(node_ids, x, y, source, target, edge_weights:dict, crs):
+    """ Assembles a CSRGraph from sorted node ids and an edge list of node ids, keeping the shortest of any parallel edges."""
+    n = len(node_ids)
+    source_pos = np.minimum(np.searchsorted(node_ids, source), n - 1)
+    target_pos = np.minimum(np.searchsorted(node_ids, target), n - 1)
+    #drop edges referencing nodes which are not in the node table
+    valid = (node_ids[source_pos] == source) & (node_ids[target_pos] == target)
+    source_pos = source_pos[valid]
+    target_pos = target_pos[valid]
+    edge_weights = {weight: values[valid] for weight, values in edge_weights.items()}
+
+    #sort edges by (source, target) so parallel edges are adjacent, then keep the minimum weight of each run.
+    order = np.lexsort((target_pos, source_pos))
+    source_pos = source_pos[order]
+    target_pos = target_pos[order]
+    run_start = np.flatnonzero(np.r_[True, (np.diff(source_pos) != 0) | (np.diff(target_pos) != 0)])[:len(source_pos)]
+    weights = {}
+    for weight, values in edge_weights.items():
+        weights[weight] = np.minimum.reduceat(values[order], run_start) if len(run_start) else values
+    source_pos = source_pos[run_start]
+    target_pos = target_pos[run_start].astype(np.int32)
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source_pos, minlength=n), out=indptr[1:])
+
+    return CSRGraph(node_ids, x, y, indptr, target_pos, weights, crs)
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import geopandas as gpd
+import numpy as np
+from services.graph_arrays import CSRGraph
+
+# bump when the layout of a cache entry changes so old entries are ignored.
+CACHE_VERSION = 2
+
+
+def file_hash(file_path:str, chunk_size:int = 1 << 20):
+    """ sha256 hex digest of a file's contents, read in chunks so large .pbf files are not held in memory."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(file_path:str, **options):
+    """ Key of a cached network: the content hash of the source file plus every option used to build the network from it.
+    Any change to the file contents or options gives a new key, so stale entries are never read.
+
+    Example:
+    --------
+    >>> services.graph_cache.cache_key('belfast.osm.pbf', network_type = 'driving', graph_type = 'csr')
+    >>> '1f0c...e9a2'
+    """
+    options = json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha256(f'{CACHE_VERSION}|{file_hash(file_path)}|{options}'.encode()).hexdigest()
+
+
+def load_network(cache_dir:str, key:str):
+    """ Loads a network saved by `save_network`. Returns (G, nodes, edges), or None if there is no entry for the key.
+    CSRGraph arrays are memory-mapped rather than read, so they are only paged in from disk as searches touch them."""
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    with open(os.path.join(entry, 'meta.json')) as f:
+        meta = json.load(f)
+
+    nodes = _from_json_columns(gpd.read_parquet(os.path.join(entry, 'nodes.parquet')), meta['json_columns']['nodes'])
+    edges = _from_json_columns(gpd.read_parquet(os.path.join(entry, 'edges.parquet')), meta['json_columns']['edges'])
+    if meta['graph_format'] == 'csr':
+        arrays = {name: np.load(os.path.join(entry, f'{name}.npy'), mmap_mode='r')
+                  for name in ['node_ids', 'x', 'y', 'indptr', 'indices']}
+        weights = {weight: np.load(os.path.join(entry, f'weight_{i}.npy'), mmap_mode='r')
+                   for i, weight in enumerate(meta['weights'])}
+        G = CSRGraph(weights=weights, crs=meta['crs'], **arrays)
+    else:
+        with open(os.path.join(entry, 'graph.pkl'), 'rb') as f:
+            G = pickle.load(f)
+    return G, nodes, edges
+
+
+def save_network(cache_dir:str, key:str, G, nodes:gpd.GeoDataFrame, edges:gpd.GeoDataFrame):
+    """ Saves a network to `cache_dir` under `key`: nodes and edges as GeoParquet, a CSRGraph as .npy arrays and any other
+    graph pickled. The entry is written to a temporary folder and renamed into place, so a half-written entry is never read."""
+    entry = os.path.join(cache_dir, key)
+    temp_entry = f'{entry}.tmp-{os.getpid()}'
+    os.makedirs(temp_entry, exist_ok=True)
+    try:
+        nodes, node_json_columns = _to_json_columns(nodes)
+        edges, edge_json_columns = _to_json_columns(edges)
+        nodes.to_parquet(os.path.join(temp_entry, 'nodes.parquet'))
+        edges.to_parquet(os.path.join(temp_entry, 'edges.parquet'))
+        if isinstance(G, CSRGraph):
+            meta = {'graph_format': 'csr', 'weights': list(G.weights), 'crs': str(G.crs)}
+            for name in ['node_ids', 'x', 'y', 'indptr', 'indices']:
+                np.save(os.path.join(temp_entry, f'{name}.npy'), getattr(G, name))
+            for i, weight in enumerate(G.weights):
+                np.save(os.path.join(temp_entry, f'weight_{i}.npy'), G.weights[weight])
+        else:
+            meta = {'graph_format': 'pickle'}
+            with open(os.path.join(temp_entry, 'graph.pkl'), 'wb') as f:
+                pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+        meta['json_columns'] = {'nodes': node_json_columns, 'edges': edge_json_columns}
+        with open(os.path.join(temp_entry, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_entry, entry)
+    except OSError:
+        #another process may have written the same entry first, theirs is identical so keep it.
+        if not os.path.isdir(entry):
+            raise
+    finally:
+        shutil.rmtree(temp_entry, ignore_errors=True)
+
+
+def _to_json_columns(df:gpd.GeoDataFrame):
+    """ Copy of `df` with its dictionary and list columns, e.g. pyrosm's node 'tags', as JSON strings, and their names. Parquet
+    would store them as structs, which come back with every key of the column on every row."""
+    columns = [column for column in df.columns if df[column].dtype == object and column != df.geometry.name
+               and df[column].map(lambda value: isinstance(value, (dict, list))).any()]
+    if not columns:
+        return df, columns
+    df = df.copy()
+    for column in columns:
+        df[column] = df[column].map(lambda value: json.dumps(value) if isinstance(value, (dict, list, str)) else value)
+    return df, columns
+
+
+def _from_json_columns(df:gpd.GeoDataFrame, columns:list):
+    """ Reverses `_to_json_columns`."""
+    for column in columns:
+        df[column] = df[column].map(lambda value: json.loads(value) if isinstance(value, str) else value)
+    return df
@@ -0,0 +1,254 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from services import network_bands, zone_assign
+from services.graph_arrays import CSRGraph
+from services.instrumentation import echo, progress, stage
+
+### Streaming pipeline for scoring households at national scale. Households are read, snapped, given their network distance
+### to the nearest location and aggregated per data zone one chunk at a time, so peak memory depends on the chunk size
+### (plus the graph), never on the number of households.
+
+def read_chunks(file_path:str, chunksize:int = 100_000, columns:list = None):
+    """ Reads a point dataset a chunk at a time. GeoParquet is streamed by record batch with pyarrow, anything GDAL can read
+    (shapefile, GeoPackage etc.) is streamed in batches from one open reader with pyogrio, so each row is read once.
+
+    Returns:
+    --------
+    Generator of GeoDataFrames of up to `chunksize` rows each.
+
+    Parameters:
+    -----------
+        file_path (str): Path of the dataset, e.g. 'testEnvironment/Data/pointer_randomised.shp'.
+        chunksize (int): Rows per chunk. Defaults to 100,000.
+        columns (list): Optional; columns to read besides the geometry. Defaults to all.
+
+    Example:
+    --------
+    >>> for chunk in services.household_scoring.read_chunks('pointer.gpkg', chunksize = 50_000, columns = ['uuid']):
+    >>>     print(len(chunk))
+    """
+    if file_path.lower().endswith(('.parquet', '.geoparquet')):
+        yield from _read_parquet_chunks(file_path, chunksize, columns)
+        return
+
+    yield from _read_ogr_chunks(file_path, chunksize, columns)
+
+
+def _read_ogr_chunks(file_path:str, chunksize:int, columns:list):
+    """ Streams a GDAL readable file by Arrow record batch through a single pyogrio reader, decoding each batch's WKB geometry."""
+    from pyogrio.raw import open_arrow
+    with open_arrow(file_path, columns=columns, batch_size=chunksize, use_pyarrow=True) as (meta, reader):
+        #drivers without a named geometry column (e.g. shapefiles) return it as wkb_geometry.
+        geometry_column = meta['geometry_name'] or 'wkb_geometry'
+        for batch in reader:
+            if batch.num_rows:
+                yield _batch_to_gdf(batch, geometry_column, meta['crs'])
+
+
+def _read_parquet_chunks(file_path:str, chunksize:int, columns:list):
+    """ Streams a GeoParquet file by record batch, decoding the WKB geometry column of each batch with the CRS in the file's metadata."""
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(file_path)
+    geo = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+    geometry_column = geo['primary_column']
+    #a missing crs means OGC:CRS84 (lon/lat) in the GeoParquet specification
+    crs = geo['columns'][geometry_column].get('crs', 'OGC:CRS84')
+    read_columns = None if columns is None else list(columns) + [geometry_column]
+
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=read_columns):
+        yield _batch_to_gdf(batch, geometry_column, crs)
+
+
+def _batch_to_gdf(batch, geometry_column:str, crs):
+    """ GeoDataFrame of an Arrow record batch with a WKB geometry column."""
+    df = batch.to_pandas()
+    geometry = gpd.GeoSeries.from_wkb(df.pop(geometry_column), crs=crs)
+    return gpd.GeoDataFrame(df, geometry=geometry.values, crs=crs)
+
+
+def score_chunks(chunks, graph, nearest_node_dict:dict, zones:gpd.GeoDataFrame = None, zone_column:str = None,
+                 weight:str = 'length', cutoff:float = None, include_snap_distance:bool = False):
+    """ Adds the network distance to, and name of, the nearest location and optionally the zone to each chunk of households.
+    The multi-source search is run once up front, each chunk is then only snapped to the graph and looked up in the result.
+
+    Returns:
+    --------
+    Generator of GeoDataFrames, each chunk in the graph's CRS with 'network_distance' (NaN if unreachable), 'nearest_location'
+    and `zone_column` (if zones are given) added.
+
+    Parameters:
+    -----------
+        chunks (iterable): GeoDataFrames of households, e.g. from `read_chunks`.
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        nearest_node_dict (dict): Locations to measure to, an output from `network_bands.nearest_node_and_name`.
+        zones (GeoDataFrame): Optional; zone polygons to assign each household to, e.g. data zones.
+        zone_column (str): Column of `zones` identifying each zone, e.g. 'DZ2021_cd'. Required with zones.
+        weight (str): The edge attribute in the graph to use as a weight. Defaults to 'length'.
+        cutoff (float): Optional; maximum distance to search to. Defaults to None (whole graph).
+        include_snap_distance (bool): If True, adds the snap distances of households and locations to their nodes,
+            as in `network_bands.network_distance`. Defaults to False.
+
+    Example:
+    --------
+    >>> chunks = services.household_scoring.read_chunks('pointer.gpkg')
+    >>> for scored in services.household_scoring.score_chunks(chunks, G, libraries, zones = data_zones, zone_column = 'DZ2021_cd'):
+    >>>     scored.drop(columns='geometry').to_csv('scored.csv', mode = 'a')
+    """
+    crs = graph.crs if isinstance(graph, CSRGraph) else graph.graph.get('crs', 4326)
+    with stage('dijkstra', locations=len(nearest_node_dict)) as record:
+        node_ids, distances, location_index, names = network_bands.nearest_location_arrays(graph, nearest_node_dict, weight, cutoff)
+        record['nodes'] = len(node_ids)
+    names = np.array(names + [None], dtype=object)
+    if include_snap_distance:
+        location_snap = np.array([node_info.get('snap_distance', 0) for node_info in nearest_node_dict.values()] + [np.nan])
+    if zones is not None:
+        zones = zones[[zone_column, 'geometry']].to_crs(crs)
+
+    for chunk in chunks:
+        #the stage ends before the chunk is yielded, so it times this chunk's scoring only.
+        with stage('score_chunk', households=len(chunk)):
+            chunk = chunk.to_crs(crs)
+            household_nodes, snap_distances = network_bands.nearest_nodes_batch(graph, chunk.geometry.x.values, chunk.geometry.y.values,
+                                                                                 weight)
+
+            #look up each household's node in the search result, nodes the search never reached get -1 (no location).
+            positions = np.minimum(np.searchsorted(node_ids, household_nodes), len(node_ids) - 1)
+            found = node_ids[positions] == household_nodes
+            household_distances = np.where(found, distances[positions], np.nan)
+            household_locations = np.where(found, location_index[positions], -1)
+            if include_snap_distance:
+                household_distances = household_distances + snap_distances + location_snap[household_locations]
+
+            chunk['network_distance'] = household_distances
+            chunk['nearest_location'] = names[household_locations]
+            if zones is not None:
+                with stage('assign_zones'):
+                    chunk[zone_column] = zone_assign.assign_zones(chunk, zones, zone_column)
+        yield chunk
+
+
+def aggregate_zones(scored_chunks, zone_column:str, bands:list = None):
+    """ Summarises scored households per zone incrementally, holding only running totals between chunks.
+
+    Returns:
+    --------
+    DataFrame (pd.DataFrame) with a row per zone of 'households', 'households_reached' (with a network distance),
+    'mean_network_distance', 'max_network_distance' and, if bands are given, 'households_{band}' counts of households further
+    than the previous band and no further than this one, matching the rings of `network_bands.service_bands`. Households outside
+    every zone are kept in a row with a null zone, and their count is reported.
+
+    Parameters:
+    -----------
+        scored_chunks (iterable): GeoDataFrames with 'network_distance' and `zone_column`, e.g. from `score_chunks`.
+        zone_column (str): Column identifying each household's zone, e.g. 'DZ2021_cd'.
+        bands (list): Optional; upper distance of each band, e.g. [1000, 2000, 3000].
+
+    Example:
+    --------
+    >>> zone_stats = services.household_scoring.aggregate_zones(scored, 'DZ2021_cd', bands = [1000, 2000, 3000])
+    """
+    bands = sorted(bands) if bands else []
+    band_columns = [f'households_{band}' for band in bands]
+    sums = None
+    maxima = None
+    for chunk in scored_chunks:
+        chunk_stats = pd.DataFrame({zone_column: chunk[zone_column].to_numpy(), 'households': 1,
+                                    'households_reached': chunk['network_distance'].notna().to_numpy(dtype=int),
+                                    'distance_sum': chunk['network_distance'].fillna(0).to_numpy()})
+        if bands:
+            band_index = np.searchsorted(bands, chunk['network_distance'].to_numpy(), side='left')
+            for i, column in enumerate(band_columns):
+                chunk_stats[column] = (band_index == i).astype(int)
+        #dropna=False keeps households outside every zone as a group of their own.
+        chunk_sums = chunk_stats.groupby(zone_column, dropna=False).sum()
+        chunk_maxima = chunk['network_distance'].groupby(chunk[zone_column].to_numpy(), dropna=False).max()
+
+        sums = chunk_sums if sums is None else sums.add(chunk_sums, fill_value=0)
+        maxima = chunk_maxima if maxima is None else pd.concat([maxima, chunk_maxima]).groupby(level=0, dropna=False).max()
+
+    if sums is None:
+        return pd.DataFrame(columns=[zone_column, 'households', 'households_reached', 'mean_network_distance',
+                                     'max_network_distance'] + band_columns)
+    summary = sums.astype({column: int for column in ['households', 'households_reached'] + band_columns})
+    summary['mean_network_distance'] = summary.pop('distance_sum') / summary['households_reached'].replace(0, np.nan)
+    summary['max_network_distance'] = maxima.reindex(summary.index)
+    summary.index.name = zone_column
+    outside = int(summary.loc[summary.index.isna(), 'households'].sum())
+    if outside:
+        echo(f'{outside} households are outside every zone, kept in a row with a null {zone_column}.')
+    return summary[['households', 'households_reached', 'mean_network_distance', 'max_network_distance'] + band_columns].reset_index()
+
+
+def score_households(file_path:str, graph, nearest_node_dict:dict, zones:gpd.GeoDataFrame, zone_column:str, bands:list = None,
+                     weight:str = 'length', cutoff:float = None, chunksize:int = 100_000, columns:list = None,
+                     output_path:str = None):
+    """ Pipeline entry point: reads households a chunk at a time, snaps them, looks up their network distance to the nearest
+    location, assigns their zone and aggregates per zone, holding one chunk in memory at a time. Replaces loading every household
+    into one GeoDataFrame for national scale datasets.
+
+    Returns:
+    --------
+    DataFrame (pd.DataFrame) of per zone statistics, see `aggregate_zones`.
+
+    Parameters:
+    -----------
+        file_path (str): Households dataset, GeoParquet, shapefile, GeoPackage or anything else geopandas can read.
+        graph (networkx.Graph or CSRGraph): The graph representing the network, a CSRGraph is recommended at this scale.
+        nearest_node_dict (dict): Locations to measure to, an output from `network_bands.nearest_node_and_name`.
+        zones (GeoDataFrame): Zone polygons to aggregate by, e.g. data zones.
+        zone_column (str): Column of `zones` identifying each zone, e.g. 'DZ2021_cd'.
+        bands (list): Optional; distance bands to count households in, e.g. [1000, 2000, 3000].
+        weight (str): The edge attribute in the graph to use as a weight. Defaults to 'length'.
+        cutoff (float): Optional; maximum distance to search to. Defaults to None (whole graph).
+        chunksize (int): Households per chunk, sets the peak memory use. Defaults to 100,000.
+        columns (list): Optional; household columns to carry through to `output_path`, e.g. ['uuid']. Defaults to None (none).
+        output_path (str): Optional; Parquet file each chunk's household results (without geometry) are appended to as they are scored.
+
+    Example:
+    --------
+    >>> G, nodes, edges = services.network_bands.load_osm_network('ireland.osm.pbf', 'driving', graph_type = 'csr', cache_dir = 'cache')
+    >>> libraries = services.network_bands.nearest_node_and_name(G, libraries_gdf, location_name = 'name')
+    >>> zone_stats = services.household_scoring.score_households('pointer.parquet', G, libraries, data_zones, 'DZ2021_cd',
+    >>>                                                          bands = [1000, 2000, 3000], output_path = 'pointer_scored.parquet')
+    """
+    #read only the geometry unless columns are asked for.
+    columns = [] if columns is None else list(columns)
+    chunks = read_chunks(file_path, chunksize=chunksize, columns=columns)
+    scored = score_chunks(chunks, graph, nearest_node_dict, zones=zones, zone_column=zone_column, weight=weight, cutoff=cutoff)
+    scored = progress(scored, desc=f'Scoring households ({chunksize} per chunk)', unit='chunk')
+    if output_path:
+        scored = _write_chunks(scored, output_path, columns + ['network_distance', 'nearest_location', zone_column])
+
+    zone_stats = aggregate_zones(scored, zone_column, bands=bands)
+    echo(f'{int(zone_stats["households"].sum())} households scored across {len(zone_stats)} zones.')
+    return zone_stats
+
+
+def _write_chunks(scored_chunks, output_path:str, columns:list):
+    """ Passes scored chunks through unchanged, appending `columns` of each to a Parquet file as it goes."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    temp_path = f'{output_path}.tmp-{os.getpid()}'
+    try:
+        for chunk in scored_chunks:
+            table = pa.Table.from_pandas(pd.DataFrame(chunk[columns]), preserve_index=False)
+            if writer is None:
+                #a column with no values in the first chunk (e.g. no household reached a location) would be typed null, use strings.
+                schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema])
+                writer = pq.ParquetWriter(temp_path, schema)
+            writer.write_table(table.cast(writer.schema))
+            yield chunk
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(temp_path, output_path)
+            echo(f'Scored households saved to {output_path}')
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
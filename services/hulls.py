@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.geometry import MultiPoint
+from scipy.spatial import Delaunay
+from scipy.spatial import QhullError
+import alphashape
+from services.graph_arrays import CSRGraph
+
+### Polygon (hull) builders for service areas. Each takes x and y arrays of the reachable nodes and the alpha value and
+### returns a shapely geometry. service_areas picks one by name from HULL_METHODS, or takes any function with the same signature.
+
+def delaunay_hull(x, y, alpha_value:float, allow_holes:bool = False):
+    """ Alpha shape of the points built with vectorised numpy/shapely operations. Uses the same rule as alphashape, keeping
+    every Delaunay triangle whose circumradius is less than 1 / alpha_value, but filters all triangles at once and unions them
+    in one coverage union rather than looping over triangles in Python. Like alphashape, holes are filled unless `allow_holes` is True,
+    so the output matches alphashape's for the same alpha value. Falls back to the convex hull for fewer than 4 points,
+    collinear points, or where no triangle passes the filter, so a location always gets a usable polygon.
+
+    Returns:
+    --------
+    Polygon or MultiPolygon (shapely geometry).
+
+    Parameters:
+    -----------
+        x (array-like): x coordinates of the points.
+        y (array-like): y coordinates of the points.
+        alpha_value (float): The alpha value, larger values give tighter (more concave) shapes. 0 gives the convex hull.
+        allow_holes (bool): If True, keeps holes where no triangle passes the filter, e.g. large parks or lakes. Defaults to False.
+
+    Example:
+    --------
+    >>> polygon = services.hulls.delaunay_hull(node_x, node_y, alpha_value = 500)
+    """
+    coords = np.column_stack((np.asarray(x, dtype=float), np.asarray(y, dtype=float)))
+    if len(coords) < 4 or alpha_value <= 0:
+        return convex_hull(x, y)
+    try:
+        triangles = coords[Delaunay(coords).simplices]
+    except QhullError:
+        return convex_hull(x, y)
+
+    #circumradius R = abc / 4 * area, for every triangle at once.
+    a = np.linalg.norm(triangles[:, 1] - triangles[:, 0], axis=1)
+    b = np.linalg.norm(triangles[:, 2] - triangles[:, 1], axis=1)
+    c = np.linalg.norm(triangles[:, 0] - triangles[:, 2], axis=1)
+    edge_1 = triangles[:, 1] - triangles[:, 0]
+    edge_2 = triangles[:, 2] - triangles[:, 0]
+    area = np.abs(edge_1[:, 0] * edge_2[:, 1] - edge_1[:, 1] * edge_2[:, 0]) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        circumradius = (a * b * c) / (4 * area)
+    kept = triangles[circumradius < 1.0 / alpha_value]
+    if len(kept) == 0:
+        return convex_hull(x, y)
+
+    #Delaunay triangles share edges exactly, so the much faster coverage union can be used.
+    polygons = shapely.polygons(np.concatenate((kept, kept[:, :1]), axis=1))
+    hull = shapely.coverage_union_all(polygons)
+    if not allow_holes:
+        hull = shapely.union_all(shapely.polygons(shapely.get_exterior_ring(shapely.get_parts(hull))))
+    return hull
+
+
+def alphashape_hull(x, y, alpha_value:float):
+    """ Alpha shape of the points using the alphashape package, the original service area method. Much slower than `delaunay_hull`."""
+    return alphashape.alphashape(list(zip(np.asarray(x).tolist(), np.asarray(y).tolist())), alpha_value)
+
+
+def convex_hull(x, y, alpha_value:float = None):
+    """ Convex hull of the points, alpha_value is ignored."""
+    return MultiPoint(np.column_stack((x, y))).convex_hull
+
+
+HULL_METHODS = {
+    'delaunay': delaunay_hull,
+    'alphashape': alphashape_hull,
+    'convex': convex_hull,
+}
+
+
+def get_hull_method(hull_method):
+    """ Returns the hull function for a name in HULL_METHODS, or `hull_method` itself if it is already a function."""
+    if callable(hull_method):
+        return hull_method
+    try:
+        return HULL_METHODS[hull_method]
+    except KeyError:
+        raise ValueError(f"Unknown hull_method '{hull_method}', available methods: {list(HULL_METHODS)}") from None
+
+
+### Edge based isochrones. Rather than hulling reachable nodes, the road edges reached are clipped at the exact distance
+### remaining and buffered, so partially reachable edges count and cost scales with the edges reached.
+
+def prepare_edges(edges:gpd.GeoDataFrame, weight:str = 'length', graph = None):
+    """ Reduces the edges GeoDataFrame from `load_osm_network` to the columns `edge_isochrone` needs, projected to a metric (UTM) CRS
+    so buffers are in metres. Do this once and reuse the result for every location and distance.
+    The edges must join the nodes the searches reach. A networkx graph from `load_osm_network` is simplified by pyrosm, so most of
+    the frame's edge ends are not nodes of it; pass the graph and its own (merged) edges are used instead. A CSRGraph is built from
+    the frame itself, so its edges are used and checked against the graph's nodes.
+
+    Returns:
+    --------
+    GeoDataFrame of u, v, weight (the cost of each edge) and geometry in a UTM CRS.
+
+    Parameters:
+    -----------
+        edges (GeoDataFrame): Network edges with 'u', 'v', the weight and line geometries, e.g. from `load_osm_network`. Not used
+            when `graph` is a networkx graph.
+        weight (str): The edge attribute the searches use, e.g. 'length' or 'travel_time'. Defaults to 'length'.
+        graph (networkx.Graph or CSRGraph): Optional; the graph the searches run on. Raises a ValueError if an edge has an end
+            which is not one of its nodes.
+
+    Example:
+    --------
+    >>> prepared = services.hulls.prepare_edges(edges, 'length', graph = G)
+    """
+    if graph is not None and not isinstance(graph, CSRGraph):
+        edges = _graph_edges(graph, weight)
+    elif edges is None:
+        raise ValueError("hull_method 'edges' requires the edges GeoDataFrame from load_osm_network")
+    elif weight not in edges.columns and 'network_type' in edges.columns:
+        #a mode's weight on a multi-modal network, e.g. 'travel_time_walking', is the 'travel_time' of that mode's edges.
+        weight, _, mode = weight.rpartition('_')
+        edges = edges[edges['network_type'] == mode]
+
+    if isinstance(graph, CSRGraph):
+        on_graph = np.isin(edges['u'].to_numpy(), graph.node_ids) & np.isin(edges['v'].to_numpy(), graph.node_ids)
+        if not on_graph.all():
+            raise ValueError(f'{int((~on_graph).sum())} of {len(edges)} edges have an end which is not a node of the graph, '
+                             'use the edges loaded with it')
+    prepared = edges[['u', 'v', weight, 'geometry']].rename(columns={weight: 'weight'})
+    return prepared.to_crs(prepared.estimate_utm_crs())
+
+
+def _graph_edges(graph, weight:str):
+    """ Edges of a networkx graph as a GeoDataFrame of u, v, weight and geometry. Edges with no geometry, e.g. ones pyrosm did not
+    merge on a graph built elsewhere, get a straight line between their nodes."""
+    rows = list(graph.edges(data=True))
+    u = [edge[0] for edge in rows]
+    v = [edge[1] for edge in rows]
+    geometry = [edge[2].get('geometry') for edge in rows]
+    for index, line in enumerate(geometry):
+        if line is None:
+            start, end = graph.nodes[u[index]], graph.nodes[v[index]]
+            geometry[index] = shapely.LineString([(start['x'], start['y']), (end['x'], end['y'])])
+    return gpd.GeoDataFrame({'u': u, 'v': v, weight: [edge[2].get(weight, np.nan) for edge in rows]}, geometry=geometry,
+                            crs=graph.graph.get('crs', 4326))
+
+
+def edge_isochrone(prepared_edges:gpd.GeoDataFrame, node_ids, node_distances, cutoff:float, buffer_distance:float = 50,
+                   output_crs = 4326):
+    """ Isochrone polygon built from the road edges reachable within `cutoff`. Edges whose far end is within the cutoff are kept
+    whole, partially traversed edges are clipped at the exact distance remaining from whichever end(s) were reached. The kept 
+    line segments are buffered and unioned in one vectorised operation.
+
+    Returns:
+    --------
+    Polygon or MultiPolygon (shapely geometry) in `output_crs`.
+
+    Parameters:
+    -----------
+        prepared_edges (GeoDataFrame): Output of `prepare_edges`.
+        node_ids (array-like): Ids of the nodes reached by the search.
+        node_distances (array-like): Network distance to each of `node_ids`.
+        cutoff (float): Maximum distance of the isochrone, in the same units as the edge weights.
+        buffer_distance (float): Distance in metres to buffer the reached edges by. Defaults to 50.
+        output_crs (int or str): CRS of the returned polygon. Defaults to 4326.
+
+    Example:
+    --------
+    >>> prepared = services.hulls.prepare_edges(edges)
+    >>> polygon = services.hulls.edge_isochrone(prepared, node_ids, node_distances, cutoff = 1000, buffer_distance = 50)
+    """
+    reached = pd.Series(np.asarray(node_distances, dtype=float), index=np.asarray(node_ids))
+    distance_u = reached.reindex(prepared_edges['u'].to_numpy()).to_numpy()
+    distance_v = reached.reindex(prepared_edges['v'].to_numpy()).to_numpy()
+    length = prepared_edges['weight'].to_numpy(dtype=float)
+
+    #fraction of each edge reachable from its u end and from its v end, nan (unreached) becomes 0.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        from_u = np.nan_to_num(np.clip((cutoff - distance_u) / length, 0, 1))
+        from_v = np.nan_to_num(np.clip((cutoff - distance_v) / length, 0, 1))
+    #zero length edges at a reached node
+    from_u[(length == 0) & (distance_u <= cutoff)] = 1
+
+    whole = from_u + from_v >= 1
+    partial_u = ~whole & (from_u > 0)
+    partial_v = ~whole & (from_v > 0)
+    geometry = prepared_edges.geometry.values
+    lines = np.concatenate((
+        np.asarray(geometry[whole]),
+        _clip_lines(np.asarray(geometry[partial_u]), 0, from_u[partial_u]),
+        _clip_lines(np.asarray(geometry[partial_v]), 1 - from_v[partial_v], 1),
+    ))
+    if len(lines) == 0:
+        return shapely.Polygon()
+
+    isochrone = shapely.union_all(shapely.buffer(lines, buffer_distance))
+    return gpd.GeoSeries([isochrone], crs=prepared_edges.crs).to_crs(output_crs).iloc[0]
+
+
+def _clip_lines(lines, start, end):
+    """ Vectorised substring: the part of each line between the normalised positions start and end (0-1) along it."""
+    if len(lines) == 0:
+        return lines
+    coords, line_index = shapely.get_coordinates(lines, return_index=True)
+    segment_length = np.r_[0, np.hypot(*np.diff(coords, axis=0).T)]
+    #restart the cumulative distance at the first vertex of every line
+    first_vertex = np.r_[True, line_index[1:] != line_index[:-1]]
+    segment_length[first_vertex] = 0
+    cumulative = np.cumsum(segment_length)
+    cumulative -= np.maximum.accumulate(np.where(first_vertex, cumulative, 0))
+    total = np.bincount(line_index, weights=segment_length, minlength=len(lines))
+
+    start = np.broadcast_to(start, len(lines)) * total
+    end = np.broadcast_to(end, len(lines)) * total
+    start_points = shapely.get_coordinates(shapely.line_interpolate_point(lines, start))
+    end_points = shapely.get_coordinates(shapely.line_interpolate_point(lines, end))
+    interior = (cumulative > start[line_index]) & (cumulative < end[line_index])
+
+    #order the new end points and the kept vertices by line, then by distance along the line.
+    all_index = np.concatenate((np.arange(len(lines)), line_index[interior], np.arange(len(lines))))
+    all_position = np.concatenate((start, cumulative[interior], end))
+    all_coords = np.concatenate((start_points, coords[interior], end_points))
+    order = np.lexsort((all_position, all_index))
+    return shapely.linestrings(all_coords[order], indices=all_index[order])
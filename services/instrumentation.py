@@ -0,0 +1,193 @@
+import contextlib
+import contextvars
+import json
+import logging
+import sys
+import time
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows, peak memory is then not recorded.
+    resource = None
+
+### Opt-in timing and memory instrumentation for the stages of the network_bands workflow, plus a switch for its printing
+### and progress bars. Stages are only recorded while at least one sink is added, otherwise timing a stage costs two clock reads.
+
+_sinks = []
+_settings = {'verbose': True}
+# path of the stages currently running, e.g. ('service_areas', 'dijkstra'), so nested stages are recorded as 'service_areas/dijkstra'.
+_stage_path = contextvars.ContextVar('stage_path', default=())
+
+
+def set_verbose(verbose:bool):
+    """ Switches the printed messages and tqdm progress bars of network_bands on or off, e.g. off for headless batch runs.
+
+    Example:
+    --------
+    >>> services.instrumentation.set_verbose(False)
+    """
+    _settings['verbose'] = verbose
+
+
+def echo(message:str):
+    """ Prints `message` unless printing has been switched off with `set_verbose`."""
+    if _settings['verbose']:
+        print(message)
+
+
+def progress(iterable, **kwargs):
+    """ tqdm progress bar over `iterable`, hidden when printing has been switched off with `set_verbose`. kwargs are passed to tqdm."""
+    return tqdm(iterable, disable=not _settings['verbose'], **kwargs)
+
+
+def add_sink(sink):
+    """ Adds a sink which every stage record is passed to, any function taking the record dictionary, e.g. `logging_sink()`,
+    `json_lines_sink(path)` or your own callback. Stages are recorded while at least one sink is added.
+
+    Example:
+    --------
+    >>> records = []
+    >>> services.instrumentation.add_sink(records.append)
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """ Removes a sink added with `add_sink`."""
+    _sinks.remove(sink)
+
+
+@contextlib.contextmanager
+def instrument(*sinks, verbose:bool = None):
+    """ Records stages to `sinks` within the block only, optionally switching printing on or off for the block too.
+
+    Example:
+    --------
+    >>> records = []
+    >>> with services.instrumentation.instrument(records.append, json_lines_sink('stages.jsonl'), verbose = False):
+    >>>     service_areas = services.network_bands.service_areas(...)
+    """
+    previous_verbose = _settings['verbose']
+    if verbose is not None:
+        _settings['verbose'] = verbose
+    _sinks.extend(sinks)
+    try:
+        yield
+    finally:
+        for sink in sinks:
+            _sinks.remove(sink)
+        _settings['verbose'] = previous_verbose
+
+
+def recording():
+    """ True while at least one sink is added, i.e. while stages are being recorded."""
+    return bool(_sinks)
+
+
+@contextlib.contextmanager
+def capture():
+    """ Collects the stages recorded within the block into the yielded list instead of passing them to this process' sinks,
+    with paths relative to the block. Used by worker processes to send their records back to the parent, which passes them on
+    with `emit`.
+
+    Example:
+    --------
+    >>> with services.instrumentation.capture() as records:
+    >>>     rows = _location_service_areas(...)
+    >>> return rows, records
+    """
+    records = []
+    previous_sinks = _sinks[:]
+    _sinks[:] = [records.append]
+    token = _stage_path.set(())
+    try:
+        yield records
+    finally:
+        _stage_path.reset(token)
+        _sinks[:] = previous_sinks
+
+
+def emit(record:dict):
+    """ Passes a stage record collected with `capture`, e.g. in a worker process, to every sink, nested under the stages
+    currently running."""
+    record = {**record, 'stage': '/'.join(_stage_path.get() + (record['stage'],))}
+    for sink in list(_sinks):
+        sink(record)
+
+
+@contextlib.contextmanager
+def stage(name:str, **counts):
+    """ Times a stage of work. Use as a context manager, where the yielded record can be given counts (e.g. nodes reached),
+    or as a decorator. Each record holds the stage path, wall time in seconds, the process' peak RSS in MB at the end of the stage
+    and how much the stage raised it, any counts, and 'failed' if the stage raised an exception.
+    Stages run inside `service_areas` worker processes are sent back and recorded by the parent's sinks, with the worker's peak RSS.
+
+    Example:
+    --------
+    >>> with services.instrumentation.stage('dijkstra', source = node) as record:
+    >>>     distances = nx.single_source_dijkstra_path_length(G, node)
+    >>>     record['nodes'] = len(distances)
+    >>>
+    >>> @services.instrumentation.stage('save_output')
+    >>> def save(gdf): ...
+    """
+    path = _stage_path.get() + (name,)
+    token = _stage_path.set(path)
+    record = dict(counts)
+    recording = bool(_sinks)
+    peak_before = _peak_rss_mb() if recording else None
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record['failed'] = True
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _stage_path.reset(token)
+        if recording and _sinks:
+            peak_after = _peak_rss_mb()
+            record = {'stage': '/'.join(path), 'seconds': seconds, 'peak_rss_mb': peak_after,
+                      'peak_rss_increase_mb': None if peak_after is None else peak_after - peak_before, **record}
+            for sink in list(_sinks):
+                sink(record)
+
+
+def logging_sink(logger:logging.Logger = None, level:int = logging.INFO):
+    """ Sink writing each stage record as one log message, to the 'network_bands' logger by default.
+
+    Example:
+    --------
+    >>> logging.basicConfig(level = logging.INFO)
+    >>> services.instrumentation.add_sink(services.instrumentation.logging_sink())
+    """
+    logger = logger or logging.getLogger('network_bands')
+
+    def sink(record):
+        counts = ' '.join(f'{key}={value}' for key, value in record.items() if key not in ['stage', 'seconds'])
+        logger.log(level, f"{record['stage']} {record['seconds']:.3f}s {counts}")
+    return sink
+
+
+def json_lines_sink(file_path:str):
+    """ Sink appending each stage record to `file_path` as a line of JSON, for comparing runs or loading with pd.read_json(lines = True).
+
+    Example:
+    --------
+    >>> services.instrumentation.add_sink(services.instrumentation.json_lines_sink('stages.jsonl'))
+    """
+    def sink(record):
+        with open(file_path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+    return sink
+
+
+def _peak_rss_mb():
+    """ Peak resident memory of this process so far in MB, None where the resource module is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
@@ -1,19 +1,35 @@
-
 from pyrosm import OSM
 import geopandas as gpd
 import pandas as pd
 import networkx as nx
-import osmnx as ox
-from shapely.geometry import Point
 import matplotlib.pyplot as plt
-import alphashape
 from faker import Faker
-import time
-from tqdm import tqdm
-import uuid
-import warnings
+import argparse
+import json
+import heapq
+import itertools
+import weakref
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra
+from services.graph_arrays import CSRGraph, csr_graph_from_frames, csr_graph_from_modes
+from services import graph_cache, hulls, instrumentation, travel_time
+from services.instrumentation import echo, progress, stage
+
+# mean earth radius in metres, matching osmnx.
+EARTH_RADIUS_M = 6_371_009
 
-def load_osm_network(file_path:str, network_type:str, graph_type:str):
+# KD-tree node indexes built by build_node_index, dropped automatically when the graph is garbage collected.
+_node_index_cache = weakref.WeakKeyDictionary()
+
+@stage('load_network')
+def load_osm_network(file_path:str, network_type, graph_type:str, cache_dir:str = None, speeds:dict = None, bounding_box = None):
     """ Load an OSM file and extract the network (driving, walking etc) as a graph (e.g. networkx graph) along with its nodes and edges.
     G, nodes, edges = load_osm_network(args) to extract.
     
@@ -24,8 +40,18 @@ def load_osm_network(file_path:str, network_type:str, graph_type:str):
     Parameters:
     -----------
     - file_path (str): File path of OSM road data, a .pbf file.
-    - network_type (str): Type of transport, e.g. driving, walking, cycling.
-    - graph_type: Type of graph to create, available types: networkx, pandana, igraph. Likely choose networkx for use with rest of the methods.
+    - network_type (str or list): Type of transport, e.g. driving, walking, cycling. A list of types, e.g. ['driving', 'walking', 'cycling'],
+      loads every mode into one CSR graph sharing a single node set, see `graph_arrays.csr_graph_from_modes`. Its weights are named
+      '{weight}_{mode}', e.g. 'travel_time_walking', and are infinite on edges a mode cannot use.
+    - graph_type: Type of graph to create, available types: networkx, pandana, igraph, csr. Choose networkx or csr for use with rest of the methods.
+      csr builds a compact array-backed `graph_arrays.CSRGraph` straight from the nodes and edges, using far less memory and routing several times faster.
+    - cache_dir (str): Optional; folder to cache the parsed network in. The first load saves the nodes, edges and graph there and later loads
+      read them back instead of parsing the .pbf, CSR graphs are memory-mapped. The cache is keyed by the file's contents, network_type and 
+      graph_type, so editing or replacing the .pbf invalidates it automatically.
+    - speeds (dict): Optional; speed profile overrides by network type used for the 'travel_time' weight (seconds), which is derived
+      from the maxspeed and highway tags of each edge, e.g. {'driving': {'highway': {'residential': 25}}}. See `travel_time.speed_profile`.
+    - bounding_box (list): Optional; [min_lon, min_lat, max_lon, max_lat] to read from the .pbf, e.g. from `study_area_bbox`. Only the
+      network inside is parsed and built, so time and memory scale with the study area rather than the file. Defaults to None (everything).
     
     Example:
     ---------
@@ -36,28 +62,150 @@ def load_osm_network(file_path:str, network_type:str, graph_type:str):
     >>> 'MultiDiGraph named Made with Pyrosm library. with 222854 nodes and 440792 edges'
     >>> print(len(nodes), len(edges))
     >>> '225125 233911'
+    >>> # the second load with the same file and options is read from the cache.
+    >>> G, nodes, edges = services.network_bands.load_osm_network(file_path = roads, network_type = 'driving', graph_type = 'csr',
+    >>>                                                          cache_dir = 'network_cache')
+    >>> # one graph for every mode, search with e.g. weight = 'travel_time_cycling'.
+    >>> G, nodes, edges = services.network_bands.load_osm_network(file_path = roads, network_type = ['driving', 'walking', 'cycling'],
+    >>>                                                          graph_type = 'csr')
+    >>> # only the part of an all-island extract that searches of up to 3 km from the libraries can reach.
+    >>> bbox = services.network_bands.study_area_bbox(libraries_gdf, buffer_distance = 3000)
+    >>> G, nodes, edges = services.network_bands.load_osm_network(file_path = roads, network_type = 'driving', graph_type = 'csr',
+    >>>                                                          bounding_box = bbox)
     """
+    multi_modal = not isinstance(network_type, str)
+    if multi_modal and graph_type != 'csr':
+        raise ValueError(f"Multi-modal networks are only available with graph_type 'csr', not '{graph_type}'")
+    
+    if cache_dir:
+        with stage('read_cache'):
+            key = graph_cache.cache_key(file_path, network_type=network_type, graph_type=graph_type, speeds=speeds,
+                                        bounding_box=None if bounding_box is None else [round(float(value), 7) for value in bounding_box])
+            cached = graph_cache.load_network(cache_dir, key)
+        if cached is not None:
+            echo(f'Loaded {network_type} network from cache {os.path.join(cache_dir, key)}')
+            return cached
 
-    osm = OSM(file_path)
-    nodes, edges = osm.get_network(network_type=network_type, nodes=True)
-    G = osm.to_graph(nodes, edges, graph_type=graph_type)
+    network_types = list(network_type) if multi_modal else [network_type]
+    networks = {}
+    with stage('parse_pbf') as record:
+        osm = OSM(file_path, bounding_box=None if bounding_box is None else [float(value) for value in bounding_box])
+        for mode in network_types:
+            networks[mode] = osm.get_network(network_type=mode, nodes=True)
+        record.update(nodes=sum(len(nodes) for nodes, _ in networks.values()), edges=sum(len(edges) for _, edges in networks.values()))
+    
+    weights = ['length']
+    #travel times for every type with a speed profile, pyrosm's 'all' network has none.
+    if all(mode.split('+')[0] in travel_time.SPEED_PROFILES for mode in network_types):
+        weights.append('travel_time')
+        with stage('travel_times'):
+            for mode, (_, edges) in networks.items():
+                edges['travel_time'] = travel_time.travel_times(edges, mode, speeds)
+    
+    with stage('build_graph', graph_type=graph_type):
+        if multi_modal:
+            G = csr_graph_from_modes(networks, weights=weights)
+            nodes = pd.concat([mode_nodes for mode_nodes, _ in networks.values()]).drop_duplicates('id').reset_index(drop=True)
+            edges = pd.concat([mode_edges.assign(network_type=mode) for mode, (_, mode_edges) in networks.items()], ignore_index=True)
+        else:
+            nodes, edges = networks[network_type]
+            if graph_type == 'csr':
+                G = csr_graph_from_frames(nodes, edges, network_type=network_type, weights=weights)
+            else:
+                #edges merged by pyrosm's simplification sum their travel times as they do their lengths.
+                G = osm.to_graph(nodes, edges, graph_type=graph_type, simplify_kwargs={'length_cols': tuple(weights)})
+    
+    if cache_dir:
+        with stage('save_cache'):
+            graph_cache.save_network(cache_dir, key, G, nodes, edges)
     
     return G, nodes, edges
 
-def csv_to_gdf(csv, x_col:str, y_col:str, input_crs:int, crs_conversion:int = None):
+def study_area_bbox(locations:gpd.GeoDataFrame, buffer_distance:float):
+    """ Bounding box of `locations` (e.g. facilities and households) grown by `buffer_distance` metres on every side, in lon/lat.
+    A network distance is never shorter than the straight line, so every node a search of up to `buffer_distance` metres from
+    the locations can reach lies inside; pass max(search_distances) plus a margin for snapping. For travel time weights
+    convert the time to a distance first, e.g. seconds multiplied by the fastest speed in metres per second.
+    
+    Returns:
+    --------
+    List (list) of [min_lon, min_lat, max_lon, max_lat] for `load_osm_network` or `clip_network`.
+    
+    Parameters:
+    -----------
+        locations (GeoDataFrame): Locations in any CRS.
+        buffer_distance (float): Distance in metres to grow the box by.
+    
+    Example:
+    --------
+    >>> bbox = services.network_bands.study_area_bbox(libraries_gdf, buffer_distance = max(search_distances) + 1000)
+    >>> [-6.05, 54.53, -5.81, 54.67]
+    """
+    #grow the box in a metric CRS, then take the lon/lat bounds of the grown box.
+    utm = locations.estimate_utm_crs()
+    min_x, min_y, max_x, max_y = locations.to_crs(utm).total_bounds
+    box = shapely.box(min_x - buffer_distance, min_y - buffer_distance, max_x + buffer_distance, max_y + buffer_distance)
+    #densify so the curved edges of the box in lon/lat are covered.
+    box = shapely.segmentize(box, max(buffer_distance, 1))
+    return gpd.GeoSeries([box], crs=utm).to_crs(4326).total_bounds.tolist()
+
+
+def clip_network(graph, nodes:gpd.GeoDataFrame, edges:gpd.GeoDataFrame, bounding_box):
+    """ Prunes an already loaded network to a bounding box, e.g. a cached all-island network to the study area, keeping the
+    nodes inside and the edges between them.
+    
+    Returns:
+    --------
+    graph (MultiDiGraph or CSRGraph), nodes (gdf) and edges (gdf) of the study area.
+    
+    Parameters:
+    -----------
+        graph (networkx.Graph or CSRGraph): The graph representing the network, in lon/lat.
+        nodes (GeoDataFrame): Nodes from `load_osm_network`.
+        edges (GeoDataFrame): Edges from `load_osm_network`.
+        bounding_box (list): [min_lon, min_lat, max_lon, max_lat], e.g. from `study_area_bbox`.
+    
+    Example:
+    --------
+    >>> G, nodes, edges = services.network_bands.clip_network(G, nodes, edges, bbox)
+    """
+    min_lon, min_lat, max_lon, max_lat = bounding_box
+    with stage('clip_network') as record:
+        if isinstance(graph, CSRGraph):
+            graph = graph.subgraph((graph.x >= min_lon) & (graph.x <= max_lon) & (graph.y >= min_lat) & (graph.y <= max_lat))
+        else:
+            inside = [node for node, data in graph.nodes(data=True) 
+                      if min_lon <= data['x'] <= max_lon and min_lat <= data['y'] <= max_lat]
+            graph = graph.subgraph(inside).copy()
+        nodes = nodes[nodes['lon'].between(min_lon, max_lon) & nodes['lat'].between(min_lat, max_lat)]
+        kept_ids = nodes['id'].to_numpy()
+        edges = edges[edges['u'].isin(kept_ids) & edges['v'].isin(kept_ids)]
+        record.update(nodes=graph.number_of_nodes())
+    return graph, nodes, edges
+
+
+def csv_to_gdf(csv, x_col:str, y_col:str, input_crs:int, crs_conversion:int = None, id_type:str = 'uuid',
+               chunksize:int = None):
     """ function to convert csv to a gdf based off X, Y coordinates and input CRS, with an optional CRS conversion.
+    Points are built and reprojected as whole arrays and ids are generated in bulk, so millions of rows convert in seconds.
+    For CSVs too large to hold in memory at once, set `chunksize` to convert them a chunk at a time.
     
     Returns:
     --------
-    GeoDataFrame (Geopandas GeoDataFrame) of input locations.
+    GeoDataFrame (Geopandas GeoDataFrame) of input locations, or a generator of GeoDataFrames (one per chunk) if chunksize is set.
     
     Parameters:
     -----------
-    - csv: source data as csv with geom x and y column separate.
+    - csv: source data with geom x and y column separate, either a DataFrame (e.g. from pd.read_csv) or the file path of a csv.
     - x_col (str): column name for the x coordinate.
     - y_col (str): str, column name for the y coordinate.
     - input_crs (int): int, EPSG code for input coordinate reference system.
     - crs_conversion (int):optional EPSG code for converting CRS.
+    - id_type (str): id column to add, useful to avoid duplicates. 'uuid' (default) adds random version 4 UUID strings as 'uuid',
+      'int' adds a running integer 'id' (continuing across chunks) and 'hash' adds a deterministic 'id' hashed from the whole row and
+      its position in the file, which is the same on every run and for any chunksize, and differs between rows at the same
+      coordinates (e.g. flats in one building). None adds no id.
+    - chunksize (int): optional number of rows per chunk, returns a generator of GeoDataFrames rather than one GeoDataFrame.
     
     Example:
     --------
@@ -66,35 +214,203 @@ def csv_to_gdf(csv, x_col:str, y_col:str, input_crs:int, crs_conversion:int = No
     >>> locations = services.network_bands.csv_to_gdf(csv = csv_path, x_col = 'X', y_col = 'Y', 
     >>>                                               input_crs = 29902, crs_conversion = 4326)
     >>> locations.head()
-    >>> name     X      Y            geometry
-    >>> charlie  331131 376131 POINT (-5.97089 54.61635)
+    >>> name     X      Y            geometry                   uuid
+    >>> charlie  331131 376131 POINT (-5.97089 54.61635) 1aff6f20-f40a-425c-8f1c-87d053695429
+    >>>
+    >>> # convert a large csv 500,000 rows at a time
+    >>> for chunk in services.network_bands.csv_to_gdf(csv = csv_path, x_col = 'X', y_col = 'Y', input_crs = 29902, chunksize = 500_000):
+    >>>     chunk.to_file('locations.gpkg', mode = 'a')
     """
-    #create a list for each row of geom by zipping and turn into a point tuple
-    try:
-        csv['geometry'] = list(zip(csv[x_col], csv[y_col]))
-        csv['geometry'] = csv['geometry'].apply(Point)
-        # Convert to GeoDataFrame
-        gdf = gpd.GeoDataFrame(csv, geometry='geometry', crs=f'EPSG:{input_crs}')
-        #Only converts if specified
-        if crs_conversion:
-            gdf = gdf.to_crs(epsg=crs_conversion)
-            
-        #adds a uuid - useful to avoid duplicates.
-        uuid_list = []
-        for i in range(len(gdf)):
-            new_uuid = uuid.uuid4()
-            uuid_list.append(new_uuid)
-        gdf['uuid'] = uuid_list
+    if id_type not in ID_TYPES:
+        raise ValueError(f"Unknown id_type '{id_type}', available types: {ID_TYPES}")
+    if chunksize:
+        return _iter_csv_to_gdf(csv, x_col, y_col, input_crs, crs_conversion, id_type, chunksize)
+    if isinstance(csv, str):
+        csv = pd.read_csv(csv)
+    return _frame_to_gdf(csv, x_col, y_col, input_crs, crs_conversion, id_type)
+
+
+# id columns which csv_to_gdf can add.
+ID_TYPES = ['uuid', 'int', 'hash', None]
+
+def _iter_csv_to_gdf(csv, x_col:str, y_col:str, input_crs:int, crs_conversion:int, id_type:str, chunksize:int):
+    """ Generator behind csv_to_gdf's chunked mode, reads the csv file (or slices the DataFrame) chunksize rows at a time."""
+    if isinstance(csv, str):
+        chunks = pd.read_csv(csv, chunksize=chunksize)
+    else:
+        chunks = (csv.iloc[start:start + chunksize] for start in range(0, len(csv), chunksize))
+    
+    rows_done = 0
+    for chunk in chunks:
+        yield _frame_to_gdf(chunk, x_col, y_col, input_crs, crs_conversion, id_type, id_start=rows_done)
+        rows_done += len(chunk)
+
+
+def _frame_to_gdf(df:pd.DataFrame, x_col:str, y_col:str, input_crs:int, crs_conversion:int, id_type:str, id_start:int = 0):
+    """ Converts one DataFrame to a GeoDataFrame of points, see csv_to_gdf."""
+    x = df[x_col].to_numpy(dtype=float)
+    y = df[y_col].to_numpy(dtype=float)
+    crs = f'EPSG:{input_crs}'
+    #Only converts if specified, transforming the coordinate arrays before any points are built.
+    if crs_conversion:
+        x, y = Transformer.from_crs(crs, f'EPSG:{crs_conversion}', always_xy=True).transform(x, y)
+        crs = f'EPSG:{crs_conversion}'
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(x, y, crs=crs))
+    
+    if id_type == 'uuid':
+        gdf['uuid'] = bulk_uuid4(len(gdf))
+    elif id_type == 'int':
+        gdf['id'] = np.arange(id_start, id_start + len(gdf), dtype=np.int64)
+    elif id_type == 'hash':
+        #the row's position keeps ids unique for co-located, or even identical, rows.
+        row_hashes = pd.DataFrame({'row': pd.util.hash_pandas_object(df, index=False).to_numpy(),
+                                   'position': np.arange(id_start, id_start + len(df), dtype=np.int64)})
+        gdf['id'] = pd.util.hash_pandas_object(row_hashes, index=False).to_numpy()
+    return gdf
+
+
+def bulk_uuid4(n:int):
+    """ Generates n random (version 4) UUIDs as strings from a single os.urandom buffer, formatted with array operations
+    instead of calling uuid.uuid4() per row.
+    
+    Returns:
+    --------
+    numpy array of n UUID strings, e.g. '1aff6f20-f40a-425c-8f1c-87d053695429'.
+    
+    Example:
+    --------
+    >>> services.network_bands.bulk_uuid4(2)
+    >>> array(['1aff6f20-f40a-425c-8f1c-87d053695429', '77561c47-be49-43f0-a0cf-d762b2cab9bf'], dtype=object)
+    """
+    raw = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16).copy()
+    #set the version (4) and variant (RFC 4122) bits as uuid.uuid4 does
+    raw[:, 6] = raw[:, 6] & 0x0F | 0x40
+    raw[:, 8] = raw[:, 8] & 0x3F | 0x80
+    
+    hex_digits = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+    digits = np.empty((n, 32), dtype=np.uint8)
+    digits[:, 0::2] = hex_digits[raw >> 4]
+    digits[:, 1::2] = hex_digits[raw & 0x0F]
+    #8-4-4-4-12 groups separated by dashes
+    formatted = np.full((n, 36), ord('-'), dtype=np.uint8)
+    for start, end, digit in [(0, 8, 0), (9, 13, 8), (14, 18, 12), (19, 23, 16), (24, 36, 20)]:
+        formatted[:, start:end] = digits[:, digit:digit + end - start]
+    return formatted.view('S36').ravel().astype(str).astype(object)
         
-        return gdf
-    except Exception:
-        print(f'Exception error: {Exception}')
         
+def build_node_index(graph, weight:str = None):
+    """ Builds a KD-tree over the x/y coordinates of every node on the graph, used to snap locations to their nearest node.
+    The index is built once per graph and cached, later calls with the same graph return the cached index. Geographic
+    (lon/lat) graphs are indexed on the unit sphere so that nearest nodes and snap distances are exact great-circle ones.
+    With a `weight` that is infinite on some edges of a CSRGraph, e.g. a mode's weight on a multi-modal graph, only nodes with
+    an edge open under that weight are indexed, so locations are not snapped to nodes the mode cannot reach.
+    
+    Returns:
+    --------
+    Tuple of (scipy.spatial.cKDTree, numpy array of node ids, bool which is True if the graph is geographic).
+    
+    Parameters:
+    -----------
+        graph (networkx.Graph or CSRGraph): The graph representing the network, networkx nodes must have 'x' and 'y' attributes.
+        weight (str): Optional; the weight searches will use, e.g. 'length_walking'. Defaults to None (every node).
         
+    Example:
+    --------
+    >>> tree, node_ids, geographic = services.network_bands.build_node_index(graph = G)
+    >>> len(node_ids)
+    >>> 222854
+    """
+    if not isinstance(graph, CSRGraph):
+        weight = None
+    indexes = _node_index_cache.setdefault(graph, {})
+    cached = indexes.get(weight)
+    if cached is not None and (weight is not None or len(cached[1]) == graph.number_of_nodes()):
+        return cached
+    
+    open_nodes = None
+    if weight is not None:
+        mask = graph.edge_mask(weight)
+        if mask.all():
+            #every node is open under the weight, share the index of the whole graph.
+            indexes[weight] = build_node_index(graph)
+            return indexes[weight]
+        #nodes at either end of an open edge
+        source = np.repeat(np.arange(graph.number_of_nodes()), np.diff(graph.indptr))
+        open_nodes = np.zeros(graph.number_of_nodes(), dtype=bool)
+        open_nodes[source[mask]] = True
+        open_nodes[graph.indices[mask]] = True
+    
+    with stage('build_node_index', nodes=graph.number_of_nodes()):
+        if isinstance(graph, CSRGraph):
+            node_ids, node_x, node_y, crs = graph.node_ids, graph.x, graph.y, graph.crs
+            if open_nodes is not None:
+                node_ids, node_x, node_y = node_ids[open_nodes], node_x[open_nodes], node_y[open_nodes]
+        else:
+            node_ids = np.array(list(graph.nodes))
+            node_x = np.fromiter((data['x'] for _, data in graph.nodes(data=True)), dtype=float, count=len(node_ids))
+            node_y = np.fromiter((data['y'] for _, data in graph.nodes(data=True)), dtype=float, count=len(node_ids))
+            # pyrosm graphs are in EPSG:4326 unless projected.
+            crs = graph.graph.get('crs', 4326)
+        geographic = CRS.from_user_input(crs).is_geographic
+        
+        if geographic:
+            tree = cKDTree(_unit_sphere_xyz(node_x, node_y))
+        else:
+            tree = cKDTree(np.column_stack((node_x, node_y)))
+        
+    indexes[weight] = (tree, node_ids, geographic)
+    return indexes[weight]
+
+
+def nearest_nodes_batch(graph, x, y, weight:str = None):
+    """ Snaps many locations to their nearest node on the graph in one call, using the KD-tree from `build_node_index`.
+    
+    Returns:
+    --------
+    nearest_nodes (numpy array) of node ids and snap_distances (numpy array) of the distance from each location to its node,
+    in metres for geographic graphs, otherwise in the graph's CRS units.
+    
+    Parameters:
+    -----------
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        x (array-like): x coordinates (longitude for geographic graphs) of the locations.
+        y (array-like): y coordinates (latitude for geographic graphs) of the locations.
+        weight (str): Optional; only snap to nodes open under this weight, see `build_node_index`. Defaults to None (every node).
+    
+    Example:
+    --------
+    >>> nodes, snap_dist = services.network_bands.nearest_nodes_batch(graph = G, x = gdf.geometry.x.values, y = gdf.geometry.y.values)
+    >>> nodes[:3], snap_dist[:3]
+    >>> (array([475085580, 73250694, 4513699587]), array([12.4, 3.1, 27.9]))
+    """
+    tree, node_ids, geographic = build_node_index(graph, weight)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    
+    with stage('snap', points=len(x)):
+        if geographic:
+            chord, index = tree.query(_unit_sphere_xyz(x, y))
+            #chord length on the unit sphere to great-circle distance
+            snap_distances = 2 * EARTH_RADIUS_M * np.arcsin(np.clip(chord / 2, 0, 1))
+        else:
+            snap_distances, index = tree.query(np.column_stack((x, y)))
+        
+    return node_ids[index], snap_distances
+
+
+def _unit_sphere_xyz(lon, lat):
+    """ Converts lon/lat in degrees to x, y, z on the unit sphere, where euclidean nearest neighbours are great-circle ones."""
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
 def nearest_node_and_name(graph, locations: gpd.GeoDataFrame, location_name: str = None, 
-                          anon_name: bool = False):
-    """ Creates a dictionary of location names and nearest node on Graph. If no location name column specified, creates a list.
+                          anon_name: bool = False, weight:str = None):
+    """ Creates a dictionary of location names and nearest node on Graph. If no location name column specified, names are location_{index}.
     Anonymised naming can be enabled by not inputting location_name and anon_name = True. This also forces a dictionary type if you only have point data.
+    All locations are snapped in one call with `nearest_nodes_batch`, the distance from each location to its node is kept as 'snap_distance'.
     
     Returns:
     --------
@@ -102,10 +418,12 @@ def nearest_node_and_name(graph, locations: gpd.GeoDataFrame, location_name: str
     
     Parameters:
     -----------
-        graph (networkx.Graph): The graph representing the network.
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
         locations (GeoDataFrame): Geopandas GeoDataFrame of start locations.
         location_name (str): Optional; column storing name of location, if no column name do not specify.
         anon_name (bool): If True, generates fake names, location_name doesn't have to be specified.
+        weight (str): Optional; on a multi-modal graph the mode's weight, e.g. 'length_walking', so locations are only snapped
+            to nodes open to that mode. Defaults to None (every node).
         
     Example:
     --------
@@ -114,14 +432,11 @@ def nearest_node_and_name(graph, locations: gpd.GeoDataFrame, location_name: str
     >>> node_dict = services.network_bands.nearest_node_and_name(graph = G, locations = gdf, location_name = name
     >>>                                                          anon_name = False)
     >>> print(node_dict)
-    >>>  {'Ardoyne Library': {'nearest_node': 475085580},
-    >>> 'Ballyhackamore Library': {'nearest_node': 73250694},
-    >>> 'Belfast Central Library': {'nearest_node': 4513699587}}
+    >>>  {'Ardoyne Library': {'nearest_node': 475085580, 'snap_distance': 12.4},
+    >>> 'Ballyhackamore Library': {'nearest_node': 73250694, 'snap_distance': 3.1},
+    >>> 'Belfast Central Library': {'nearest_node': 4513699587, 'snap_distance': 27.9}}
     
     """   
-    # Initialise service_xy based on the presence of location_name
-    service_xy = {}
-    
     # Generate fake names if required. Anonymised naming. Also forces a workaround forcing dictionary if no name data, 
     # could just use uuid though. Bit experimental
     if location_name is None and anon_name:
@@ -134,30 +449,32 @@ def nearest_node_and_name(graph, locations: gpd.GeoDataFrame, location_name: str
         locations['Fake Name'] = fake_names
         location_name = 'Fake Name' 
         
-    # Calculate the nearest note for each location
-    for index, row in tqdm(locations.iterrows(), total=locations.shape[0], desc="Processing start locations"):
-        location_x = row['geometry'].x
-        location_y = row['geometry'].y
-        nearest_node = ox.distance.nearest_nodes(graph, location_x, location_y)
-        
-        # Add nearest node name to service_xy, no location name specified, location_{index} is the name
-        if location_name:
-            name = row[location_name]
-            service_xy[name] = {'nearest_node': nearest_node}        
-        else:
-            name = f"location_{index}"
-        
-        service_xy[name] = {'nearest_node': nearest_node}
+    # Calculate the nearest node for every location at once
+    nearest_nodes, snap_distances = nearest_nodes_batch(graph, locations.geometry.x.values, locations.geometry.y.values, weight)
+    
+    # no location name specified, location_{index} is the name
+    if location_name:
+        names = locations[location_name].tolist()
+    else:
+        names = [f"location_{index}" for index in locations.index]
+    
+    service_xy = {}
+    for name, nearest_node, snap_distance in zip(names, nearest_nodes.tolist(), snap_distances.tolist()):
+        service_xy[name] = {'nearest_node': nearest_node, 'snap_distance': snap_distance}
 
     return service_xy
 
 
 
+@stage('service_areas')
 def service_areas(nearest_node_dict:dict, graph, search_distances:list, alpha_value:int, weight:str, 
-                  save_output:bool = False):
+                  save_output:bool = False, n_jobs:int = 1, hull_method = 'delaunay', edges:gpd.GeoDataFrame = None,
+                  buffer_distance:float = 50, search_cache = None):
     """
     Generates a GeoDataFramecontaining polygons of service areas calculated using Dijkstra's shortest path algorithm within a networkx graph. 
-    Each polygon represents a service area contour defined by a maximum distance from a source node.
+    Each polygon represents a service area contour defined by a maximum distance from a source node. A single search is run per location
+    out to the largest of `search_distances` and the reachable nodes are bucketed by each distance, so extra distance bands are cheap.
+    Locations can be processed in parallel worker processes with `n_jobs`, the output is identical and in the same order as when run serially.
 
     Returns:
     --------
@@ -166,60 +483,139 @@ def service_areas(nearest_node_dict:dict, graph, search_distances:list, alpha_va
     Parameters:
     -----------
         nearest_node_dict (dict): A dictionary with names as keys and the nearest node on the graph as values. This is an output from the `nearest_node_and_name` function.
-        graph (networkx.Graph): The graph representing the network, often designated as `G` in networkx.
+        graph (networkx.Graph or CSRGraph): The graph representing the network, often designated as `G` in networkx.
         cutoffs (list of int): Distances in meters that define the bounds of each service area.
-        alpha_value (int): The alpha value used to create non-convex polygons via the alphashape method.
+        alpha_value (int): The alpha value used to create non-convex polygons via the alpha shape method.
         weight (str): The edge attribute in the graph to use as a weight, e.g. 'length', 'speed' etc.
         progress (bool): If True, will print progress of the function.
         save_output (bool): If True, will save output as `service_areas.gpkg` to root folder.
+        n_jobs (int): Number of worker processes, -1 uses every CPU. Defaults to 1 (no worker processes). The graph is sent to each 
+            worker once, on Linux/macOS workers are forked and share the parent's copy of the graph. A CSRGraph is much cheaper to share 
+            than a networkx graph. On Windows, call from within an `if __name__ == '__main__':` block.
+        hull_method (str or function): How each polygon is built from the reachable nodes, a name in `hulls.HULL_METHODS` or a function
+            taking (x, y, alpha_value). Defaults to 'delaunay', a vectorised alpha shape matching 'alphashape' (the original method) at a 
+            fraction of the cost. 'convex' gives convex hulls. 'edges' builds edge based isochrones instead of hulling nodes: the 
+            reached road edges, including partially reached ones clipped at the exact distance remaining, are buffered by `buffer_distance`
+            and unioned (see `hulls.edge_isochrone`). More accurate along long rural roads, and the cost scales with the edges reached.
+            alpha_value is not used by 'edges'.
+        edges (GeoDataFrame): The edges from `load_osm_network`, required when hull_method is 'edges' and the graph is a CSRGraph.
+        buffer_distance (float): Distance in metres to buffer reached edges by when hull_method is 'edges'. Defaults to 50.
+        search_cache (SearchCache): Optional; a `search_cache.SearchCache` memo of search results, so locations sharing a node and
+            later runs from the same nodes with equal or smaller distances reuse earlier searches.
     
     Example:
     --------
     >>> node_dict = services.network_bands.nearest_node_and_name(...)
     >>> dist_list = [1000, 2000, 3000]
     >>> polygon = services.network_bands.service_areas(nearest_node_dict = node_dict, graph = G, search_distances = dist_list
-                                                       alpha_value = 500, weight = 'length', progress = False, save_output = True)
+                                                       alpha_value = 500, weight = 'length', progress = False, save_output = True, n_jobs = -1)
     >>> 'service area polygons have been successfully saved to a geopackage'
     """
 
     data_for_gdf = []
 
-    print(f'Creating network service areas of sizes: {search_distances} metres')    
-    #For each start location [name] creates a polygon around the point.
-    for index, (name, node_info) in tqdm(enumerate(nearest_node_dict.items()), total=len(nearest_node_dict), desc='Processing nodes'):        
-        # print(f'Processing: location {index+1} of {len(nearest_node_dict)}: {name}. ')
-        #cycle through each distance in list supplied creating service areas for each
-        for distance in tqdm(search_distances, total=len(search_distances), desc=f'Processing: location {index+1} of {len(nearest_node_dict)}: {name} : '):
-            #Extract nearest node to the name (start location)
-            nearest_node = node_info['nearest_node']
-            subgraph = nx.single_source_dijkstra_path_length(graph, nearest_node, cutoff=distance, weight = weight)
-            
-            #Creates a list of all nodes which are reachable within the cutoff.
-            reachable_nodes = list(subgraph.keys())
-            node_points_list = []
-            for node in reachable_nodes:
-                x = graph.nodes[node]['x']
-                y = graph.nodes[node]['y']
-                node_points_list.append(Point(x, y))
-
-            # Makes the x,y values into just a list of tuples to be used to create alphashapes
-            node_point_series_tuples = (pd.Series(node_points_list)).apply(lambda point: (point.x, point.y))
-            node_point_tuple_list = node_point_series_tuples.tolist()
-            
-            #Create an alpha shape for each polygon and append to dataframe.
-            alpha_shape = alphashape.alphashape(node_point_tuple_list, alpha_value)
-            data_for_gdf.append({'name': name, 'distance':distance, 'geometry': alpha_shape})
-            # service_areas_dict[name] = alpha_shape #uncomment to check if function returns correct variables
+    echo(f'Creating network service areas of sizes: {search_distances} metres')    
+    names = list(nearest_node_dict)
+    nearest_nodes = [node_info['nearest_node'] for node_info in nearest_node_dict.values()]
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    prepared_edges = None
+    if hull_method == 'edges':
+        #project once, every location reuses it.
+        prepared_edges = hulls.prepare_edges(edges, weight, graph)
+    location_options = {'hull_method': hull_method, 'prepared_edges': prepared_edges, 'buffer_distance': buffer_distance,
+                    'search_cache': search_cache}
+    
+    if n_jobs == 1 or len(names) <= 1:
+        #For each start location [name] creates a polygon around the point.
+        for name, nearest_node in progress(zip(names, nearest_nodes), total=len(names), desc='Processing nodes'):        
+            data_for_gdf.extend(_location_service_areas(graph, name, nearest_node, search_distances, alpha_value, weight, **location_options))
+    else:
+        if isinstance(graph, CSRGraph):
+            #build the sparse matrix before forking so workers share it rather than each building their own.
+            graph.matrix(weight)
+        #fork shares the graph copy-on-write, other start methods pickle it once per worker via the initializer.
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = None
+        chunksize = max(1, len(names) // (n_jobs * 4))
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_service_area_worker,
+                                 initargs=(graph, search_distances, alpha_value, weight, location_options,
+                                           instrumentation.recording())) as executor:
+            #map returns results in submission order, keeping the output identical to the serial path.
+            results = executor.map(_service_area_worker, names, nearest_nodes, chunksize=chunksize)
+            for rows, records in progress(results, total=len(names), desc=f'Processing nodes ({n_jobs} processes)'):
+                data_for_gdf.extend(rows)
+                #the workers' stages are recorded by this process' sinks.
+                for record in records:
+                    instrumentation.emit(record)
 
     gdf_alpha = gpd.GeoDataFrame(data_for_gdf, crs= 4326)
     
     if save_output:
-        gdf_alpha.to_file('service_areas.gpkg')
-        print(f'service area polygons have been successfully saved to a geopackage')
+        with stage('save_output'):
+            gdf_alpha.to_file('service_areas.gpkg')
+        echo(f'service area polygons have been successfully saved to a geopackage')
      #return the geodataframe
     return gdf_alpha
 
 
+def _location_service_areas(graph, name, nearest_node, search_distances:list, alpha_value:int, weight:str, hull_method = 'delaunay',
+                            prepared_edges:gpd.GeoDataFrame = None, buffer_distance:float = 50, search_cache = None):
+    """ Service area polygons of every search distance for a single location, as rows for a GeoDataFrame."""
+    #one search per location out to the largest distance, smaller distances are subsets of it.
+    #Coordinates and distances of all nodes which are reachable within the largest cutoff.
+    with stage('dijkstra', location=name) as record:
+        search = search_cache.search if search_cache is not None else _single_source_search
+        node_ids, node_x, node_y, node_distances = search(graph, nearest_node, cutoff=max(search_distances), weight=weight)
+        record['nodes'] = len(node_ids)
+    
+    polygons = _service_area_polygons(name, node_ids, node_x, node_y, node_distances, search_distances, alpha_value, hull_method,
+                                      prepared_edges, buffer_distance)
+    return [{'name': name, 'distance': distance, 'geometry': polygon} for distance, polygon in zip(search_distances, polygons)]
+
+
+def _service_area_polygons(name, node_ids, node_x, node_y, node_distances, search_distances:list, alpha_value:int, 
+                           hull_method = 'delaunay', prepared_edges:gpd.GeoDataFrame = None, buffer_distance:float = 50):
+    """ Polygon of each search distance from the nodes one location's search reached."""
+    polygons = []
+    #cycle through each distance in list supplied creating service areas for each
+    for distance in search_distances:
+        #bucket the reachable nodes by this distance
+        within = node_distances <= distance
+        
+        #Create an alpha shape for each polygon.
+        with stage('hull', location=name, distance=distance, nodes=int(within.sum())):
+            if hull_method == 'edges':
+                alpha_shape = hulls.edge_isochrone(prepared_edges, node_ids[within], node_distances[within], distance, buffer_distance)
+            else:
+                alpha_shape = hulls.get_hull_method(hull_method)(node_x[within], node_y[within], alpha_value)
+        polygons.append(alpha_shape)
+    return polygons
+
+
+# graph and settings held by each service_areas worker process, set once per worker by _init_service_area_worker.
+_worker_state = {}
+
+def _init_service_area_worker(graph, search_distances:list, alpha_value:int, weight:str, location_options:dict,
+                              record_stages:bool = False):
+    _worker_state.update(graph=graph, search_distances=search_distances, alpha_value=alpha_value, weight=weight,
+                         location_options=location_options, record_stages=record_stages)
+
+
+def _service_area_worker(name, nearest_node):
+    """ Rows of one location's service areas, and the records of its stages if the parent is recording them."""
+    arguments = (_worker_state['graph'], name, nearest_node, _worker_state['search_distances'], _worker_state['alpha_value'],
+                 _worker_state['weight'])
+    if not _worker_state['record_stages']:
+        return _location_service_areas(*arguments, **_worker_state['location_options']), []
+    with instrumentation.capture() as records:
+        rows = _location_service_areas(*arguments, **_worker_state['location_options'])
+    return rows, records
+
+
+@stage('service_bands')
 def service_bands(geodataframe:gpd.GeoDataFrame, dissolve_cat:str, aggfunc:str ='first', 
                           show_graph:bool = False, save_output:bool = False):
     """ 
@@ -254,8 +650,9 @@ def service_bands(geodataframe:gpd.GeoDataFrame, dissolve_cat:str, aggfunc:str =
     #Subset dataframe by dissolve category then run dissolve, dissolving and then subsetting creates invalid geoms.
     search_distances = geodataframe[dissolve_cat].unique()
     for distance in search_distances:
-        filtered_data = geodataframe[geodataframe[dissolve_cat] == distance].reset_index(drop=True)
-        filtered_data_dissolved = filtered_data.dissolve(aggfunc=aggfunc)
+        with stage('dissolve', distance=distance, polygons=int((geodataframe[dissolve_cat] == distance).sum())):
+            filtered_data = geodataframe[geodataframe[dissolve_cat] == distance].reset_index(drop=True)
+            filtered_data_dissolved = filtered_data.dissolve(aggfunc=aggfunc)
         data_for_gdf.append(filtered_data_dissolved)
     #Create gdf for each dissolved category
     gdf_dissolve = gpd.GeoDataFrame(pd.concat(data_for_gdf, ignore_index=True), crs='EPSG:4326')
@@ -265,7 +662,8 @@ def service_bands(geodataframe:gpd.GeoDataFrame, dissolve_cat:str, aggfunc:str =
     #note to self: next step to make it work without dissolving prior.
     gdf_dissolve_sorted = gdf_dissolve.sort_values(by=dissolve_cat, ascending=False)
     for index in range(0,len(gdf_dissolve_sorted)-1):
-        differenced_part = gdf_dissolve_sorted.geometry.iloc[index].difference(gdf_dissolve_sorted.geometry.iloc[index+1])
+        with stage('difference', distance=gdf_dissolve_sorted.iloc[index][dissolve_cat]):
+            differenced_part = gdf_dissolve_sorted.geometry.iloc[index].difference(gdf_dissolve_sorted.geometry.iloc[index+1])
         differenced_geoms.append(differenced_part)
         category_values.append(gdf_dissolve_sorted.iloc[index][dissolve_cat])
 
@@ -275,77 +673,626 @@ def service_bands(geodataframe:gpd.GeoDataFrame, dissolve_cat:str, aggfunc:str =
     category_values.append(gdf_dissolve_sorted.iloc[final_index][dissolve_cat])
     #append geometry to geodataframe to return as final result
     differenced_gdf = gpd.GeoDataFrame({'geometry': differenced_geoms, dissolve_cat: category_values}, crs=geodataframe.crs)
-    print('Network areas have successfully been dissolved and differenced')
+    echo('Network areas have successfully been dissolved and differenced')
     #produces a quick and ready map for instant analysis.
     if show_graph:
-        fig, ax = plt.subplots(1, 1, figsize=(10, 8))
-        differenced_gdf.plot(column=dissolve_cat, cmap='cividis', alpha=0.8, ax=ax, legend=True,
-                                legend_kwds={'label': dissolve_cat, 'orientation': 'horizontal',
-                                            'fraction': 0.036})
-        plt.autoscale(enable=True, axis='both', tight=True)
-        plt.show()
-        print('A map showing network contours has been created.')
+        _plot_bands(differenced_gdf, dissolve_cat)
     
     if save_output:
-        differenced_gdf.to_file('service_bands.gpkg')
-        print(f'service area polygons have been successfully saved to a geopackage')    
+        with stage('save_output'):
+            differenced_gdf.to_file('service_bands.gpkg')
+        echo(f'service area polygons have been successfully saved to a geopackage')    
     return differenced_gdf
 
 
+@stage('network_partition_bands')
+def network_partition_bands(nearest_node_dict:dict, graph, search_distances:list, alpha_value:int, weight:str,
+                            by_location:bool = False, hull_method = 'delaunay', edges:gpd.GeoDataFrame = None,
+                            buffer_distance:float = 50, show_graph:bool = False, save_output:bool = False):
+    """
+    Creates service bands directly from a single multi-source search, instead of building a service area per location with 
+    `service_areas` and then dissolving and differencing them with `service_bands`. Every node is labelled with the distance to its 
+    nearest location, binned into the search distances and polygonised once per band, splitting the network Voronoi-style between 
+    locations. With `by_location` each band is also split by the location which "owns" it, i.e. the nearest one.
+    
+    Returns:
+    --------
+    Non-overlapping band polygons in a GeoDataFrame with a 'distance' column (and a 'name' column if by_location is True),
+    in the same layout as the output of `service_bands`.
+    
+    Parameters:
+    -----------
+        nearest_node_dict (dict): A dictionary with names as keys and the nearest node on the graph as values. This is an output from the `nearest_node_and_name` function.
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        search_distances (list of int): Distances in meters that define the bounds of each band.
+        alpha_value (int): The alpha value used to create non-convex polygons via the alpha shape method.
+        weight (str): The edge attribute in the graph to use as a weight, e.g. 'length'.
+        by_location (bool): If True, bands are split by the nearest location and named after it. Defaults to False.
+        hull_method (str or function): How each polygon is built, see `service_areas`. Defaults to 'delaunay'.
+        edges (GeoDataFrame): The edges from `load_osm_network`, required when hull_method is 'edges' and the graph is a CSRGraph.
+        buffer_distance (float): Distance in metres to buffer reached edges by when hull_method is 'edges'. Defaults to 50.
+        show_graph (bool): If true, will show a basic graph of output. Defaults to False.
+        save_output (bool): If True, will save output as `service_bands.gpkg` to root folder. Defaults to False.
+    
+    Example:
+    --------
+    >>> node_dict = services.network_bands.nearest_node_and_name(...)
+    >>> bands = services.network_bands.network_partition_bands(nearest_node_dict = node_dict, graph = G, search_distances = [1000, 2000, 3000],
+    >>>                                                        alpha_value = 500, weight = 'length', by_location = True)
+    >>> bands.head(2)
+    >>>    geometry                        distance  name
+    >>> 0  POLYGON ((-5.9612 54.6101, ...  3000      Ardoyne Library
+    >>> 1  POLYGON ((-5.9655 54.6120, ...  2000      Ardoyne Library
+    """
+    search_distances = sorted(search_distances)
+    echo(f'Creating network bands of sizes: {search_distances} metres from a single search')
+    #search outwards from the locations, as service_areas does.
+    with stage('dijkstra', locations=len(nearest_node_dict)) as record:
+        node_ids, node_x, node_y, node_distances, location_index, names = _multi_source_reached(
+            graph, nearest_node_dict, weight, cutoff=search_distances[-1], reverse=False)
+        record['nodes'] = len(node_ids)
+    
+    prepared_edges = None
+    if hull_method == 'edges':
+        prepared_edges = hulls.prepare_edges(edges, weight, graph)
+    
+    if by_location:
+        groups = [(names[i], location_index == i) for i in range(len(names))]
+    else:
+        groups = [(None, np.ones(len(node_ids), dtype=bool))]
+    
+    data_for_gdf = []
+    for name, in_group in progress(groups, total=len(groups), desc='Processing bands'):
+        inner_polygon = None
+        for distance in search_distances:
+            within = in_group & (node_distances <= distance)
+            with stage('hull', location=name, distance=distance, nodes=int(within.sum())):
+                if hull_method == 'edges':
+                    polygon = hulls.edge_isochrone(prepared_edges, node_ids[within], node_distances[within], distance, buffer_distance)
+                else:
+                    polygon = hulls.get_hull_method(hull_method)(node_x[within], node_y[within], alpha_value)
+            #each band is its cumulative polygon minus the one inside it, the smallest is kept whole.
+            band = polygon if inner_polygon is None else polygon.difference(inner_polygon)
+            inner_polygon = polygon
+            row = {'geometry': band, 'distance': distance}
+            if by_location:
+                row['name'] = name
+            data_for_gdf.append(row)
+    
+    #largest distance first, matching service_bands
+    bands = gpd.GeoDataFrame(data_for_gdf, crs=4326).iloc[::-1].reset_index(drop=True)
+    echo('Network bands have successfully been created')
+    if show_graph:
+        _plot_bands(bands, 'distance')
+    
+    if save_output:
+        with stage('save_output'):
+            bands.to_file('service_bands.gpkg')
+        echo(f'service band polygons have been successfully saved to a geopackage')    
+    return bands
+
+
+def _plot_bands(gdf:gpd.GeoDataFrame, column:str):
+    """ produces a quick and ready map of bands for instant analysis."""
+    fig, ax = plt.subplots(1, 1, figsize=(10, 8))
+    gdf.plot(column=column, cmap='cividis', alpha=0.8, ax=ax, legend=True,
+             legend_kwds={'label': column, 'orientation': 'horizontal', 'fraction': 0.036})
+    plt.autoscale(enable=True, axis='both', tight=True)
+    plt.show()
+    echo('A map showing network contours has been created.')
+
 
-def shortest_path_iterator(start_locations:gpd.GeoDataFrame, destination_locations:gpd.GeoDataFrame, networkx_graph):
-    """ Shortest distance to destination using dijkstra's algorithm. The function iterates over destination for 
-    each start location, returning a dataframe with the closest destination. 
+
+def multi_source_dijkstra(graph, nearest_node_dict:dict, weight:str = 'length', cutoff:float = None, 
+                          reverse:bool = True):
+    """ Runs a single Dijkstra search seeded from every location in `nearest_node_dict` at once, labelling each node
+    on the graph with the distance to its closest location and the name of that location. One search replaces a search per 
+    (start, destination) pair, so the cost is that of a single Dijkstra regardless of how many locations are supplied.
     
-    WARNING - TAKES A VERY LONG TIME - advised to not use!
+    Returns:
+    --------
+    distances (dict) of node id -> distance to the closest location and nearest_location (dict) of node id -> location name.
+    Nodes which cannot reach any location (or are further than `cutoff`) are not included.
+    
+    Parameters:
+    -----------
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        nearest_node_dict (dict): A dictionary with names as keys and the nearest node on the graph as values. This is an output from the `nearest_node_and_name` function.
+        weight (str): The edge attribute in the graph to use as a weight, e.g. 'length'. Defaults to 'length'.
+        cutoff (float): Optional; maximum distance to search to. Defaults to None (whole graph).
+        reverse (bool): If True (default), distances are measured from each node *to* the locations, i.e. following edges backwards
+            from the locations, matching the direction of travel of a start location heading to a destination on a directed graph.
+    
+    Example:
+    --------
+    >>> libraries = services.network_bands.nearest_node_and_name(graph = G, locations = libraries_gdf, location_name = 'name')
+    >>> distances, nearest_library = services.network_bands.multi_source_dijkstra(graph = G, nearest_node_dict = libraries)
+    >>> distances[475085580], nearest_library[475085580]
+    >>> (0, 'Ardoyne Library')
+    """
+    if isinstance(graph, CSRGraph):
+        distance_array, location_index, names = _multi_source_search(graph, nearest_node_dict, weight, cutoff, reverse)
+        reached = np.flatnonzero(location_index >= 0)
+        reached_ids = graph.node_ids[reached].tolist()
+        distances = dict(zip(reached_ids, distance_array[reached].tolist()))
+        nearest_location = dict(zip(reached_ids, [names[i] for i in location_index[reached]]))
+        return distances, nearest_location
+    
+    if reverse and graph.is_directed():
+        adjacency = graph.pred
+    else:
+        adjacency = graph.adj
+    is_multigraph = graph.is_multigraph()
+    
+    distances = {}
+    nearest_location = {}
+    seen = {}
+    heap = []
+    #the counter breaks ties in the heap so node ids and names never have to be compared.
+    counter = itertools.count()
+    for name, node_info in nearest_node_dict.items():
+        node = node_info['nearest_node']
+        if node not in seen:
+            seen[node] = 0
+            heapq.heappush(heap, (0, next(counter), node, name))
+    
+    while heap:
+        distance, _, node, name = heapq.heappop(heap)
+        if node in distances:
+            continue
+        distances[node] = distance
+        nearest_location[node] = name
+        
+        for neighbour, edge_data in adjacency[node].items():
+            if neighbour in distances:
+                continue
+            #parallel edges in a multigraph, only the shortest can be on a shortest path.
+            if is_multigraph:
+                edge_weight = min(attributes.get(weight, 1) for attributes in edge_data.values())
+            else:
+                edge_weight = edge_data.get(weight, 1)
+            new_distance = distance + edge_weight
+            if cutoff is not None and new_distance > cutoff:
+                continue
+            if neighbour not in seen or new_distance < seen[neighbour]:
+                seen[neighbour] = new_distance
+                heapq.heappush(heap, (new_distance, next(counter), neighbour, name))
+    
+    return distances, nearest_location
+
+
+@stage('network_distance')
+def network_distance(locations:gpd.GeoDataFrame, graph, nearest_node_dict:dict, weight:str = 'length', cutoff:float = None,
+                     include_snap_distance:bool = False, distance_column:str = 'network_distance', 
+                     location_column:str = 'nearest_location', routing_index = None):
+    """ Adds the network distance to the closest location in `nearest_node_dict` (e.g. libraries) to every row of `locations`
+    (e.g. households). Locations are snapped to the graph in one call, one multi-source search is run from all of `nearest_node_dict`
+    and each location's distance is an array lookup on its nearest node, so the cost barely grows with the number of locations.
+    The result is a plain numeric column, banding or per data zone statistics are then ordinary groupbys with no polygon joins.
+    
+    Returns:
+    --------
+    locations (GeoDataFrame) with `distance_column` (float, NaN where no location can be reached within the cutoff) and 
+    `location_column` (name of the closest location) added.
+    
+    Parameters:
+    -----------
+        locations (GeoDataFrame): Points to measure from, e.g. households, in the graph's CRS.
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        nearest_node_dict (dict): Locations to measure to, an output from the `nearest_node_and_name` function.
+        weight (str): The edge attribute in the graph to use as a weight. Defaults to 'length'.
+        cutoff (float): Optional; maximum distance to search to. Defaults to None (whole graph).
+        include_snap_distance (bool): If True, adds the distance from each point to its nearest node and from the closest location
+            to its node, only meaningful when weight is a length in metres. Defaults to False (node to node network distance).
+        distance_column (str): Name of the distance column to add. Defaults to 'network_distance'.
+        location_column (str): Name of the closest location column to add. Defaults to 'nearest_location'.
+        routing_index (ContractionHierarchy): Optional; a `contraction.build_contraction_hierarchy` index of the graph built with
+            `weight`. Distances are then many-to-many index queries between the distinct nearest nodes and the locations, faster than
+            the whole graph search when there are only a few hundred points. Defaults to None.
+    
+    Example:
+    --------
+    >>> libraries = services.network_bands.nearest_node_and_name(graph = G, locations = libraries_gdf, location_name = 'name')
+    >>> pointer = services.network_bands.network_distance(locations = pointer, graph = G, nearest_node_dict = libraries)
+    >>> pointer['distance_band'] = pd.cut(pointer['network_distance'], bins = [0, 1000, 2000, 3000])
+    >>> pointer.groupby('DZ2021_cd')['network_distance'].median()
+    """
+    echo(f'Calculating the nearest node on the network graph for {len(locations)} locations')
+    location_nodes, snap_distances = nearest_nodes_batch(graph, locations.geometry.x.values, locations.geometry.y.values, weight)
+    
+    #one search from all of nearest_node_dict, then look up the distance of each location's nearest node.
+    echo(f'Calculating the distance to the nearest of {len(nearest_node_dict)} locations for every node on the network graph')
+    with stage('dijkstra', locations=len(nearest_node_dict)):
+        distances, nearest_location = _nearest_location_lookup(graph, nearest_node_dict, location_nodes, weight=weight, cutoff=cutoff,
+                                                               routing_index=routing_index)
+    
+    if include_snap_distance:
+        location_snap = {name: node_info.get('snap_distance', 0) for name, node_info in nearest_node_dict.items()}
+        distances = distances + snap_distances + np.array([location_snap.get(name, np.nan) for name in nearest_location], dtype=float)
+    distances[~np.isfinite(distances)] = np.nan
+    
+    locations[distance_column] = distances
+    locations[location_column] = nearest_location
+    return locations
+
+
+def nearest_location_arrays(graph, nearest_node_dict:dict, weight:str = 'length', cutoff:float = None):
+    """ Runs one multi-source search from every location in `nearest_node_dict` and returns the result as sorted arrays, so the
+    distance for any number of nodes can later be looked up with `np.searchsorted` without searching again, e.g. chunk by chunk.
+    Memory use depends on the size of the graph only.
+    
+    Returns:
+    --------
+    node_ids (numpy array, ascending) of every node reached, distances (numpy array) of each to its closest location, 
+    location_index (numpy array) of the position of that location in names and names (list) of the locations.
+    
+    Parameters:
+    -----------
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        nearest_node_dict (dict): Locations to measure to, an output from the `nearest_node_and_name` function.
+        weight (str): The edge attribute in the graph to use as a weight. Defaults to 'length'.
+        cutoff (float): Optional; maximum distance to search to. Defaults to None (whole graph).
+    
+    Example:
+    --------
+    >>> node_ids, distances, location_index, names = services.network_bands.nearest_location_arrays(graph = G, nearest_node_dict = libraries)
+    >>> position = np.searchsorted(node_ids, household_nodes)
+    """
+    node_ids, _, _, distances, location_index, names = _multi_source_reached(graph, nearest_node_dict, weight, cutoff)
+    order = np.argsort(node_ids, kind='stable')
+    return node_ids[order], distances[order], location_index[order], names
+
+
+@stage('od_matrix')
+def od_matrix(origins:gpd.GeoDataFrame, graph, nearest_node_dict:dict, weight:str = 'length', cutoff:float = None, k:int = None,
+              sparse:bool = False, routing_index = None, chunksize:int = 32):
+    """ Network distance from every origin (e.g. households or data zone centroids) to every location in `nearest_node_dict`
+    (e.g. libraries), or to only the `k` nearest locations of each origin. Origins are snapped to the graph in one call and one bounded
+    search is run per distinct node: from the origins' nodes, or backwards from the locations' nodes when there are fewer of those.
+    Searches run `chunksize` at a time and each chunk is reduced to the requested output straight away, so memory follows the size
+    of the output rather than origins x graph nodes.
+    
+    Returns:
+    --------
+    With k None: numpy array of shape (origins, locations), inf where a location is beyond the cutoff or unreachable. With `sparse`, 
+    a scipy.sparse COO matrix of the same shape holding only the pairs within the cutoff, zero distances stored explicitly.
+    With k: numpy arrays of shape (origins, k) of the column of each of the k nearest locations, nearest first (-1 where fewer
+    are reachable), and of their distances (inf where fewer are reachable). With `sparse`, a COO matrix holding only those pairs.
+    Columns follow the order of `nearest_node_dict`, rows the order of `origins`.
+    
+    Parameters:
+    -----------
+        origins (GeoDataFrame): Points to measure from, e.g. households, in the graph's CRS.
+        graph (networkx.Graph or CSRGraph): The graph representing the network.
+        nearest_node_dict (dict): Locations to measure to, an output from the `nearest_node_and_name` function.
+        weight (str): The edge attribute in the graph to use as a weight. Defaults to 'length'.
+        cutoff (float): Optional; maximum distance to search to. Defaults to None (whole graph).
+        k (int): Optional; only return the k nearest locations of each origin. Defaults to None (every location).
+        sparse (bool): If True, returns a COO matrix of only the pairs within the cutoff (or the k nearest). Defaults to False.
+        routing_index (ContractionHierarchy): Optional; a `contraction.build_contraction_hierarchy` index of the graph built with
+            `weight`, distances are then many-to-many index queries rather than searches. Defaults to None.
+        chunksize (int): Searches run at once. Each holds a distance for every graph node, so keep it small on large graphs.
+            Defaults to 32.
+    
+    Example:
+    --------
+    >>> libraries = services.network_bands.nearest_node_and_name(graph = G, locations = libraries_gdf, location_name = 'name')
+    >>> matrix = services.network_bands.od_matrix(data_zone_centroids, G, libraries, cutoff = 5000)
+    >>> columns, distances = services.network_bands.od_matrix(pointer, G, libraries, k = 3)
+    >>> pointer['second_nearest'] = np.array(list(libraries), dtype=object)[columns[:, 1]]
+    """
+    if routing_index is not None and routing_index.weight != weight:
+        raise ValueError(f"The routing index was built with weight '{routing_index.weight}', not '{weight}'")
+    echo(f'Calculating the nearest node on the network graph for {len(origins)} origins')
+    origin_nodes, _ = nearest_nodes_batch(graph, origins.geometry.x.values, origins.geometry.y.values, weight)
+    #origins sharing a node share its search, results are expanded back to every origin at the end.
+    unique_origins, origin_inverse = np.unique(origin_nodes, return_inverse=True)
+    destination_nodes = np.array([node_info['nearest_node'] for node_info in nearest_node_dict.values()])
+    n_destinations = len(destination_nodes)
+    if k is not None:
+        k = min(k, n_destinations)
+        best_distances = np.full((len(unique_origins), k), np.inf)
+        best_columns = np.full((len(unique_origins), k), -1, dtype=np.int64)
+    elif sparse:
+        pair_rows, pair_columns, pair_distances = [], [], []
+    else:
+        node_matrix = np.full((len(unique_origins), n_destinations), np.inf)
+    
+    echo(f'Calculating distances between {len(unique_origins)} origin nodes and {n_destinations} locations')
+    with stage('dijkstra', origins=len(unique_origins), destinations=n_destinations, k=k):
+        for rows, columns, block in _od_blocks(graph, unique_origins, destination_nodes, weight, cutoff, routing_index, chunksize):
+            if k is not None:
+                _merge_nearest(best_distances, best_columns, rows, columns, block)
+            elif sparse:
+                row, column = np.nonzero(np.isfinite(block))
+                pair_rows.append(rows[row])
+                pair_columns.append(columns[column])
+                pair_distances.append(block[row, column])
+            else:
+                node_matrix[np.ix_(rows, columns)] = block
+    
+    if k is not None:
+        best_columns[~np.isfinite(best_distances)] = -1
+        if not sparse:
+            return best_columns[origin_inverse], best_distances[origin_inverse]
+        row, position = np.nonzero(np.isfinite(best_distances))
+        pair_rows, pair_columns, pair_distances = [row], [best_columns[row, position]], [best_distances[row, position]]
+    elif not sparse:
+        return node_matrix[origin_inverse]
+    
+    #repeat each origin node's pairs for every origin snapped to it.
+    node_rows = np.concatenate(pair_rows) if pair_rows else np.empty(0, dtype=np.int64)
+    origin_order = np.argsort(origin_inverse, kind='stable')
+    origins_per_node = np.bincount(origin_inverse, minlength=len(unique_origins))
+    first_origin = np.cumsum(origins_per_node) - origins_per_node
+    repeats = origins_per_node[node_rows]
+    offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    origin_rows = origin_order[np.repeat(first_origin[node_rows], repeats) + offsets]
+    pair_columns = np.repeat(np.concatenate(pair_columns) if pair_columns else np.empty(0, dtype=np.int64), repeats)
+    pair_distances = np.repeat(np.concatenate(pair_distances) if pair_distances else np.empty(0), repeats)
+    return coo_matrix((pair_distances, (origin_rows, pair_columns)), shape=(len(origins), n_destinations))
+
+
+@stage('shortest_path_iterator')
+def shortest_path_iterator(start_locations:gpd.GeoDataFrame, destination_locations:gpd.GeoDataFrame, networkx_graph,
+                           destination_name:str = None, weight:str = 'length', routing_index = None):
+    """ Shortest distance to the closest destination using dijkstra's algorithm. Snaps the destinations to the graph, then 
+    uses `network_distance` to run a single multi-source search from all destinations at once and look up the closest 
+    destination of each start location by its nearest node. Returns the start locations with the distance and name of the 
+    closest destination.
     
     Paramters:
         start_locations (GeoDataFrame): geopandas DataFrame of start locations such as houses.
         destination_dataset (GeoDatFrame): geopandas DataFrame of end locations such as hospitals or supermarkets.
-        network_x_graph (MultiDiGraph): graph created using networkx. Default 'G'.
+        network_x_graph (MultiDiGraph or CSRGraph): graph created using networkx or graph_arrays. Default 'G'.
+        destination_name (str): Optional; column storing name of destination, if not specified destinations are named location_{index}.
+        weight (str): The edge attribute in the graph to use as a weight. Defaults to 'length'.
+        routing_index (ContractionHierarchy): Optional; a preprocessed routing index of the graph from `contraction.build_contraction_hierarchy`,
+            answering the distances with index queries instead of a graph search. Quicker for a few hundred start locations or fewer.
         
     Example:
     --------
     
     >>> shortest_path_iterator(start_locations = house_data, destination_locations = hospitals, networkx_graph = G)
+    >>>      geometry                   shortest_dist_to_dest  nearest_destination
+    >>> 0    POINT (-5.97089 54.61635)  1523.481               location_3
     """
-    #warning.
+    #Preload the nearest nodes to destination using nearest_node_and_name function into a dict
+    echo(f'Calculating the nearest node on the network graph for each destination location')
+    dest_node_ids = nearest_node_and_name(graph= networkx_graph, locations=destination_locations, 
+                                          location_name=destination_name, weight=weight)
     
-    if len(start_locations) >= 100 or len(destination_locations) >= 100:
-        warnings.warn('Your dataset is quite large, this may take an incredibly long time to process. ' 
-            'Consider using the service_areas function instead for more efficient computation.',
-            UserWarning)
-    else:
-        warnings.warn("Iterating over large datasets takes a very long time. To stop the process, interrupt with a keyboard command such as Ctrl+C.",
-            UserWarning)
+    start_locations = network_distance(start_locations, networkx_graph, dest_node_ids, weight=weight,
+                                       distance_column='shortest_dist_to_dest', location_column='nearest_destination',
+                                       routing_index=routing_index)
+    #start locations unable to reach any destination are infinitely far away
+    start_locations['shortest_dist_to_dest'] = start_locations['shortest_dist_to_dest'].fillna(float('inf'))
+        
+    return start_locations
+
+
+def _single_source_search(graph, source, cutoff:float, weight:str):
+    """ Dijkstra search from a single node. Returns node id, x, y and distance arrays of every node reachable within the cutoff."""
+    if isinstance(graph, CSRGraph):
+        distances = dijkstra(graph.matrix(weight), indices=graph.positions(source), limit=cutoff)
+        reached = np.flatnonzero(np.isfinite(distances))
+        return graph.node_ids[reached], graph.x[reached], graph.y[reached], distances[reached]
     
-    #Preload the nearest nodes to destination to reduce insane run times using nearest_node_and_name function into a nameless dict
-    print(f'Calculating the nearest node on the network graph for each start location')
-    dest_node_ids = nearest_node_and_name(graph= networkx_graph, locations=destination_locations)
+    lengths = nx.single_source_dijkstra_path_length(graph, source, cutoff=cutoff, weight=weight)
+    node_x = np.fromiter((graph.nodes[node]['x'] for node in lengths), dtype=float, count=len(lengths))
+    node_y = np.fromiter((graph.nodes[node]['y'] for node in lengths), dtype=float, count=len(lengths))
+    return np.array(list(lengths)), node_x, node_y, np.fromiter(lengths.values(), dtype=float, count=len(lengths))
+
+
+def _multi_source_search(graph, nearest_node_dict:dict, weight:str, cutoff:float = None, reverse:bool = True):
+    """ Multi-source Dijkstra over a CSRGraph using scipy. Returns an array of the distance from every node position to its
+    closest location (inf if unreached), an array of the index of that location in `names` (-1 if unreached) and the names."""
+    names = list(nearest_node_dict)
+    positions = graph.positions([node_info['nearest_node'] for node_info in nearest_node_dict.values()])
+    #where several locations share a node the first one listed wins, as in the networkx search.
+    source_positions, first_location = np.unique(positions, return_index=True)
     
-    start_locations['shortest_dist_to_dest'] = float('inf')
-    #iterate over each house, then library.
+    distances, _, sources = dijkstra(graph.matrix(weight, reverse=reverse), indices=source_positions, min_only=True,
+                                     return_predecessors=True, limit=np.inf if cutoff is None else cutoff)
+    location_of_position = np.full(graph.number_of_nodes(), -1, dtype=np.int64)
+    location_of_position[source_positions] = first_location
+    #unreached nodes have a negative source
+    location_index = np.where(sources >= 0, location_of_position[np.maximum(sources, 0)], -1)
+    return distances, location_index, names
 
-    for index, row in tqdm(start_locations.iterrows(), total=len(start_locations), desc=f"Calculating and identifying the shortest path between each start location and the nearest of the destination locations"):
-        orig_x = row['geometry'].x
-        orig_y = row['geometry'].y       
-        orig_node_id = ox.distance.nearest_nodes(networkx_graph, orig_x, orig_y)
-        
 
-        # iterate over destination node id dictionary for shortest distance out of all desitnations
-        shortest_distance = float('inf')
+def _nearest_location_lookup(graph, nearest_node_dict:dict, query_nodes, weight:str, cutoff:float = None, routing_index = None):
+    """ Distance to, and name of, the closest location in `nearest_node_dict` for each of `query_nodes`, from one multi-source search.
+    Returns a float array of distances (inf if unreachable) and a list of names (None if unreachable)."""
+    if routing_index is not None:
+        return _routing_index_lookup(routing_index, nearest_node_dict, query_nodes, weight, cutoff)
+    if isinstance(graph, CSRGraph):
+        distance_array, location_index, names = _multi_source_search(graph, nearest_node_dict, weight, cutoff)
+        query_positions = graph.positions(query_nodes)
+        query_index = location_index[query_positions]
+        return distance_array[query_positions], [names[i] if i >= 0 else None for i in query_index.tolist()]
+    
+    distances, nearest_location = multi_source_dijkstra(graph, nearest_node_dict, weight=weight, cutoff=cutoff)
+    query_nodes = list(query_nodes)
+    return (np.array([distances.get(node, np.inf) for node in query_nodes], dtype=float),
+            [nearest_location.get(node) for node in query_nodes])
+
 
-        for dest_name, dest_info in dest_node_ids.items():
-            dest_node_id = dest_info['nearest_node']  # gets the node ID
+def _routing_index_lookup(routing_index, nearest_node_dict:dict, query_nodes, weight:str, cutoff:float = None):
+    """ As `_nearest_location_lookup`, from one many-to-many query of a contraction hierarchy between the distinct query nodes and
+    the locations. Where several locations are equally close the first one listed wins, as in the searches."""
+    if routing_index.weight != weight:
+        raise ValueError(f"The routing index was built with weight '{routing_index.weight}', not '{weight}'")
+    names = list(nearest_node_dict)
+    unique_nodes, inverse = np.unique(np.asarray(list(query_nodes)), return_inverse=True)
+    matrix = routing_index.distance_matrix(unique_nodes, [node_info['nearest_node'] for node_info in nearest_node_dict.values()])
+    closest = np.argmin(matrix, axis=1)
+    distances = matrix[np.arange(len(unique_nodes)), closest]
+    if cutoff is not None:
+        distances[distances > cutoff] = np.inf
+    nearest = [names[i] if np.isfinite(distance) else None for i, distance in zip(closest.tolist(), distances.tolist())]
+    return distances[inverse], [nearest[i] for i in inverse.tolist()]
 
-            path_length = nx.shortest_path_length(networkx_graph, source=orig_node_id, target=dest_node_id, weight='length')
-            if path_length < shortest_distance:
-                shortest_distance = path_length
 
-        # Updates the shortest distance in the gdf
-        start_locations.at[index, 'shortest_dist_to_dest'] = shortest_distance
-        
-    return start_locations
-        
+def _od_blocks(graph, origin_nodes, destination_nodes, weight:str, cutoff:float = None, routing_index = None, chunksize:int = 32):
+    """ Distances from distinct origin nodes to the locations at `destination_nodes`, as blocks of (rows into `origin_nodes`,
+    location columns, distances), inf beyond the cutoff. Each distinct location node is searched once, as are the origins."""
+    limit = np.inf if cutoff is None else cutoff
+    unique_destinations, destination_inverse = np.unique(destination_nodes, return_inverse=True)
+    all_rows = np.arange(len(origin_nodes))
+    all_columns = np.arange(len(destination_nodes))
+    if routing_index is not None:
+        #the index's cost is per call, so query as many origins at once as fit a block of about 4 million distances.
+        step = max(chunksize, (1 << 22) // max(len(unique_destinations), 1))
+        for start in progress(range(0, len(origin_nodes), step), desc='Routing index queries'):
+            rows = all_rows[start:start + step]
+            block = routing_index.distance_matrix(origin_nodes[rows], unique_destinations)
+            block[block > limit] = np.inf
+            yield rows, all_columns, block[:, destination_inverse]
+    elif len(unique_destinations) < len(origin_nodes):
+        #fewer locations than origins, search backwards from the locations.
+        for start in progress(range(0, len(unique_destinations), chunksize), desc='Searching from locations'):
+            sources = unique_destinations[start:start + chunksize]
+            block = _search_block(graph, sources, origin_nodes, weight, limit, reverse=True).T
+            columns = all_columns[(destination_inverse >= start) & (destination_inverse < start + len(sources))]
+            yield all_rows, columns, block[:, destination_inverse[columns] - start]
+    else:
+        for start in progress(range(0, len(origin_nodes), chunksize), desc='Searching from origins'):
+            rows = all_rows[start:start + chunksize]
+            block = _search_block(graph, origin_nodes[rows], unique_destinations, weight, limit, reverse=False)
+            yield rows, all_columns, block[:, destination_inverse]
+
+
+def _search_block(graph, sources, targets, weight:str, limit:float, reverse:bool = False):
+    """ Distances from each of `sources` to each of `targets` (to each source from each target if `reverse`), one bounded search
+    per source. Returns an array of shape (sources, targets), inf beyond the limit."""
+    if isinstance(graph, CSRGraph):
+        distances = dijkstra(graph.matrix(weight, reverse=reverse), indices=graph.positions(sources), limit=limit)
+        return distances[:, graph.positions(targets)]
+    
+    search_graph = graph.reverse(copy=False) if reverse and graph.is_directed() else graph
+    targets = targets.tolist()
+    block = np.empty((len(sources), len(targets)))
+    for row, source in enumerate(sources.tolist()):
+        lengths = nx.single_source_dijkstra_path_length(search_graph, source, cutoff=limit, weight=weight)
+        block[row] = [lengths.get(target, np.inf) for target in targets]
+    return block
+
+
+def _merge_nearest(best_distances, best_columns, rows, columns, block):
+    """ Merges a block of distances into the k nearest locations found so far for `rows`, in place. Ties keep the lower column."""
+    k = best_distances.shape[1]
+    distances = np.concatenate((best_distances[rows], block), axis=1)
+    candidates = np.concatenate((best_columns[rows], np.broadcast_to(columns, block.shape)), axis=1)
+    order = np.lexsort((candidates, distances), axis=-1)[:, :k]
+    best_distances[rows] = np.take_along_axis(distances, order, axis=1)
+    best_columns[rows] = np.take_along_axis(candidates, order, axis=1)
+
+
+def _multi_source_reached(graph, nearest_node_dict:dict, weight:str, cutoff:float = None, reverse:bool = True):
+    """ Multi-source search over either graph type. Returns arrays of the id, x, y, distance and nearest location index of every 
+    node reached, along with the location names the indexes refer to."""
+    if isinstance(graph, CSRGraph):
+        distances, location_index, names = _multi_source_search(graph, nearest_node_dict, weight, cutoff, reverse)
+        reached = np.flatnonzero(location_index >= 0)
+        return (graph.node_ids[reached], graph.x[reached], graph.y[reached], distances[reached], location_index[reached], names)
+    
+    distances, nearest_location = multi_source_dijkstra(graph, nearest_node_dict, weight=weight, cutoff=cutoff, reverse=reverse)
+    names = list(nearest_node_dict)
+    name_index = {name: i for i, name in enumerate(names)}
+    node_x = np.fromiter((graph.nodes[node]['x'] for node in distances), dtype=float, count=len(distances))
+    node_y = np.fromiter((graph.nodes[node]['y'] for node in distances), dtype=float, count=len(distances))
+    location_index = np.fromiter((name_index[name] for name in nearest_location.values()), dtype=np.int64, count=len(distances))
+    return (np.array(list(distances)), node_x, node_y, np.fromiter(distances.values(), dtype=float, count=len(distances)),
+            location_index, names)
+
+
+def main(argv:list = None):
+    """ Command line entry point creating service bands around facilities from an OSM .pbf, for scheduled/batch runs without notebooks.
+    Run `python -m services.network_bands --help` from the root of the repository for every option.
+    
+    Example:
+    --------
+    >>> python -m services.network_bands testEnvironment/Data/belfast.osm.pbf testEnvironment/Data/libraries_belfast_2024.csv 
+    >>>     --crs 29902 --name-col "Static Library Name" --distances 1000 2000 3000 --output service_bands.gpkg --jobs 4 
+    >>>     --cache-dir network_cache --profile profile.json
+    """
+    parser = argparse.ArgumentParser(prog='python -m services.network_bands',
+                                     description='Create network service bands around facilities from an OSM .pbf file.')
+    parser.add_argument('pbf', help='OSM road data, a .pbf file.')
+    parser.add_argument('facilities', help='CSV of facilities with x and y coordinate columns.')
+    parser.add_argument('--crs', type=int, default=4326, help='EPSG code of the facility coordinates, e.g. 29902. Defaults to 4326.')
+    parser.add_argument('--x-col', default='X COORDINATE', help="Facility x coordinate column. Defaults to 'X COORDINATE'.")
+    parser.add_argument('--y-col', default='Y COORDINATE', help="Facility y coordinate column. Defaults to 'Y COORDINATE'.")
+    parser.add_argument('--name-col', help='Optional facility name column, otherwise facilities are named location_{index}.')
+    parser.add_argument('--distances', type=int, nargs='+', default=[1000, 2000, 3000], help='Search distances. Defaults to 1000 2000 3000.')
+    parser.add_argument('--weight', default='length', 
+                        help="Edge attribute to use as a weight, 'length' (metres) or 'travel_time' (seconds). Defaults to 'length'.")
+    parser.add_argument('--alpha', type=float, default=500, help='Alpha value of the service area hulls. Defaults to 500.')
+    parser.add_argument('--network-type', default='driving', help="Network to extract, e.g. driving, walking, cycling. Defaults to 'driving'.")
+    parser.add_argument('--graph-type', choices=['csr', 'networkx'], default='csr', help="Graph to route on. Defaults to 'csr'.")
+    parser.add_argument('--hull-method', choices=list(hulls.HULL_METHODS) + ['edges'], default='delaunay',
+                        help="How service areas are built, see service_areas(). Defaults to 'delaunay'.")
+    parser.add_argument('--bands', choices=['dissolve', 'partition'], default='dissolve',
+                        help="'dissolve' builds service areas per facility then dissolves them (service_bands), 'partition' uses one "
+                             "multi-source search (network_partition_bands). Defaults to 'dissolve'.")
+    parser.add_argument('--output', required=True, help='Output file for the bands, .parquet or any format geopandas can write, e.g. .gpkg.')
+    parser.add_argument('--jobs', type=int, default=1, help='Worker processes for service areas, -1 uses every CPU. Defaults to 1.')
+    parser.add_argument('--speeds', type=json.loads, 
+                        help='Optional JSON speed profile overrides for travel_time, e.g. \'{"driving": {"highway": {"residential": 25}}}\'.')
+    parser.add_argument('--clip', nargs='?', const=True, type=float, 
+                        help='Only load the network around the facilities, within the largest search distance plus 1000 m, or within '
+                             'the given number of metres. Give the metres when the weight is not a length.')
+    parser.add_argument('--cache-dir', help='Optional folder to cache the parsed network in, see load_osm_network().')
+    parser.add_argument('--profile', nargs='?', const=True, 
+                        help='Print the time and peak memory of each stage, and write every stage record as JSON if a path is given.')
+    parser.add_argument('--stages-jsonl', help='Optional JSON lines file to append a record of every stage to, see services/instrumentation.py.')
+    parser.add_argument('--quiet', action='store_true', help='Hide printed messages and progress bars, e.g. for scheduled runs.')
+    args = parser.parse_args(argv)
+    if args.clip is True and not args.weight.startswith('length'):
+        parser.error('--clip needs a distance in metres when the weight is not a length, e.g. --clip 5000')
+    
+    records = []
+    sinks = [records.append] if args.profile else []
+    if args.stages_jsonl:
+        sinks.append(instrumentation.json_lines_sink(args.stages_jsonl))
+    
+    with instrumentation.instrument(*sinks, verbose=False if args.quiet else None):
+        with stage('read_facilities'):
+            facilities = csv_to_gdf(pd.read_csv(args.facilities), x_col=args.x_col, y_col=args.y_col, input_crs=args.crs, 
+                                    crs_conversion=4326 if args.crs != 4326 else None)
+        bounding_box = None
+        if args.clip:
+            bounding_box = study_area_bbox(facilities, max(args.distances) + 1000 if args.clip is True else args.clip)
+        G, nodes, edges = load_osm_network(args.pbf, network_type=args.network_type, graph_type=args.graph_type, cache_dir=args.cache_dir,
+                                           speeds=args.speeds, bounding_box=bounding_box)
+        nearest_node_dict = nearest_node_and_name(G, facilities, location_name=args.name_col, weight=args.weight)
         
+        hull_options = {'hull_method': args.hull_method, 'edges': edges}
+        if args.bands == 'partition':
+            bands = network_partition_bands(nearest_node_dict, G, args.distances, args.alpha, args.weight, **hull_options)
+        else:
+            areas = service_areas(nearest_node_dict, G, args.distances, args.alpha, args.weight, n_jobs=args.jobs, **hull_options)
+            bands = service_bands(areas, dissolve_cat='distance')
         
+        with stage('save_output'):
+            if args.output.lower().endswith('.parquet'):
+                bands.to_parquet(args.output)
+            else:
+                bands.to_file(args.output)
+        echo(f'{len(bands)} service bands saved to {args.output}')
+    
+    if args.profile:
+        #nested stages, e.g. service_areas/hull, are totalled over their calls, across every worker process with --jobs.
+        profile = pd.DataFrame(records).groupby('stage', sort=False).agg(
+            calls=('seconds', 'size'), seconds=('seconds', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'))
+        print(profile.to_string(float_format=lambda value: f'{value:.3f}'))
+        if isinstance(args.profile, str):
+            with open(args.profile, 'w') as f:
+                json.dump({'arguments': vars(args), 'nodes': G.number_of_nodes(), 'edges': len(edges), 
+                           'stages': records}, f, indent=2, default=str)
+    return bands
+
+
+if __name__ == '__main__':
+    main()
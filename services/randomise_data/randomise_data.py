@@ -1,37 +1,88 @@
-import pandas as pd
+import argparse
 import geopandas as gpd
 import numpy as np
-from shapely.geometry import Point
-from shapely.affinity import translate
-import random
-import os
-# Load the dataset which is gitignored fyi.
-
-gdf = gpd.read_file(os.getcwd() + r'\testEnvironment\pointer\pointer.shp')
-
-# Uncomment this to drop random amounts of the data, although, don't think it's necessary if i shift the data about randomly
-# number_to_drop = len(gdf) // 10
-# features_to_drop = gdf.sample(n=number_to_drop).index
-# gdf_modified = gdf.drop(features_to_drop)
-
-# Random50% of data to shift about 
-#to_shift = gdf.sample(frac=0.50)
-
-# Max shift and define the tuple of randomly selected points to shift randomly select between a range of integers
-# Ranomise the max shift and then also again for EXTRA random I suppose. Currently will shift by 100 either direction maximum.
-max_shift = random.randint(0,100)
-shifts_x = np.random.uniform(-max_shift, max_shift, size=len(gdf))
-shifts_y = np.random.uniform(-max_shift, max_shift, size=len(gdf))
-
-#add them to the to_shift df
-gdf['shift_x'] = shifts_x
-gdf['shift_y'] = shifts_y
-
-# Loop through each row in to_shift to translate randomly
-for i, row in gdf.iterrows():
-    current_geometry = row['geometry']
-    new_geometry = translate(current_geometry, xoff=row['shift_x'], yoff=row['shift_y'])
-    gdf.at[i, 'geometry'] = new_geometry
-
-gdf.drop(columns=['shift_x', 'shift_y'], inplace=True)
-gdf.to_file(os.getcwd() +r'\testEnvironment\Data\pointer_randomised.shp')
+import shapely
+
+### Anonymise a point dataset (e.g. the pointer household addresses) by shifting every point a random distance.
+### Run from the root of the repository, the source dataset is gitignored fyi:
+###     python services/randomise_data/randomise_data.py testEnvironment/pointer/pointer.shp testEnvironment/Data/pointer_randomised.shp
+
+def randomise_points(gdf:gpd.GeoDataFrame, max_shift:float = 100, seed:int = None, zones:gpd.GeoDataFrame = None,
+                     max_attempts:int = 10):
+    """ Shifts every geometry by a random x and y offset of up to `max_shift` in either direction. All coordinates are moved
+    in one vectorised array operation rather than translating row by row.
+    If `zones` is given, points are kept inside the zone they started in (e.g. their data zone) so zone level counts are unchanged:
+    points shifted outside are redrawn with half the range on each attempt, checked with one bulk contains predicate per attempt.
+
+    Returns:
+    --------
+    GeoDataFrame (gpd.GeoDataFrame), a copy of gdf with the shifted geometries.
+
+    Parameters:
+    -----------
+        gdf (GeoDataFrame): The data to randomise, in a projected CRS so `max_shift` is in metres, e.g. 29902 (Irish Grid).
+        max_shift (float): Maximum shift in either direction along each axis, in units of the gdf's CRS. Defaults to 100.
+        seed (int): Optional; seed for the random number generator, the same seed and data always give the same output.
+        zones (GeoDataFrame): Optional; polygons each point must stay within, e.g. data zones. Points outside every zone are shifted freely.
+        max_attempts (int): Number of redraws for points shifted out of their zone, any still outside are left at their
+            original location. Defaults to 10.
+
+    Example:
+    --------
+    >>> pointer = gpd.read_file('testEnvironment/pointer/pointer.shp')
+    >>> zones = gpd.read_file('testEnvironment/Data/DZ2021.shp')
+    >>> pointer_randomised = randomise_points(pointer, max_shift = 100, seed = 42, zones = zones)
+    """
+    rng = np.random.default_rng(seed)
+    original = np.asarray(gdf.geometry.values)
+    shifts = rng.uniform(-max_shift, max_shift, size=(len(gdf), 2))
+    shifted = _shift(original, shifts)
+
+    if zones is not None:
+        zone_geometry = np.asarray(zones.to_crs(gdf.crs).geometry.values)
+        #zone each point starts in, -1 where it is in none.
+        point_index, zone_index = shapely.STRtree(zone_geometry).query(original, predicate='within')
+        start_zone = np.full(len(gdf), -1)
+        start_zone[point_index[::-1]] = zone_index[::-1]
+        constrained = np.flatnonzero(start_zone >= 0)
+
+        outside = constrained[~shapely.contains(zone_geometry[start_zone[constrained]], shifted[constrained])]
+        for attempt in range(1, max_attempts + 1):
+            if len(outside) == 0:
+                break
+            shift_range = max_shift / 2 ** attempt
+            shifted[outside] = _shift(original[outside], rng.uniform(-shift_range, shift_range, size=(len(outside), 2)))
+            outside = outside[~shapely.contains(zone_geometry[start_zone[outside]], shifted[outside])]
+        if len(outside):
+            shifted[outside] = original[outside]
+            print(f'{len(outside)} points could not be shifted within their zone and were left at their original location.')
+
+    randomised = gdf.copy()
+    randomised.geometry = gpd.GeoSeries(shifted, index=gdf.index, crs=gdf.crs)
+    return randomised
+
+
+def _shift(geometries, shifts):
+    """ Translates each geometry by its row of shifts (x, y), moving every coordinate of multi-part geometries together."""
+    _, index = shapely.get_coordinates(geometries, return_index=True)
+    return shapely.transform(geometries, lambda coords: coords + shifts[index])
+
+
+def main(argv:list = None):
+    parser = argparse.ArgumentParser(description='Anonymise a point dataset by shifting every point a random distance.')
+    parser.add_argument('input', help='Path of the dataset to randomise, any format geopandas can read.')
+    parser.add_argument('output', help='Path to write the randomised dataset to.')
+    parser.add_argument('--max-shift', type=float, default=100, help='Maximum shift along each axis, in CRS units. Defaults to 100.')
+    parser.add_argument('--seed', type=int, help='Optional seed for a reproducible output.')
+    parser.add_argument('--zones', help='Optional path of zone polygons (e.g. DZ2021.shp) each point must stay within.')
+    args = parser.parse_args(argv)
+
+    gdf = gpd.read_file(args.input)
+    zones = gpd.read_file(args.zones) if args.zones else None
+    randomised = randomise_points(gdf, max_shift=args.max_shift, seed=args.seed, zones=zones)
+    randomised.to_file(args.output)
+    print(f'{len(randomised)} points randomised and saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
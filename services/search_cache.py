@@ -0,0 +1,192 @@
+import collections
+import hashlib
+import os
+import weakref
+import numpy as np
+from services.graph_arrays import CSRGraph
+from services import network_bands
+from services.instrumentation import echo, stage
+
+### Memo of single source search results, so repeated searches from the same node (facilities snapping to one node, reruns of
+### service_areas with overlapping distance lists) are not recomputed. Results are keyed by a fingerprint of the graph and weight
+### and the source node; a result for a larger cutoff answers any smaller cutoff by filtering. Memory is bounded by entry count
+### and bytes with least recently used eviction, and results can also be kept on disk between sessions.
+
+# fingerprints of graphs already hashed, by graph then weight, so each graph is only hashed once.
+_fingerprints = weakref.WeakKeyDictionary()
+
+
+def graph_fingerprint(graph, weight:str):
+    """ sha256 hex digest of a graph's node ids, coordinates, edges and `weight` values. Cached per graph object, so a networkx
+    graph edited in place after its first search keeps its old fingerprint; build a new graph (or a new SearchCache) instead.
+
+    Example:
+    --------
+    >>> services.search_cache.graph_fingerprint(G, 'length')
+    >>> '5c2e...91ab'
+    """
+    by_weight = _fingerprints.setdefault(graph, {})
+    if weight not in by_weight:
+        with stage('graph_fingerprint', weight=weight):
+            digest = hashlib.sha256(f'{type(graph).__name__}|{weight}'.encode())
+            if isinstance(graph, CSRGraph):
+                arrays = [graph.node_ids, graph.x, graph.y, graph.indptr, graph.indices, graph.weights[weight]]
+            else:
+                nodes = list(graph.nodes)
+                edges = list(graph.edges(data=weight, default=np.nan))
+                arrays = [_hashable(nodes),
+                          np.fromiter((graph.nodes[node]['x'] for node in nodes), dtype=float, count=len(nodes)),
+                          np.fromiter((graph.nodes[node]['y'] for node in nodes), dtype=float, count=len(nodes)),
+                          _hashable([u for u, _, _ in edges]), _hashable([v for _, v, _ in edges]),
+                          np.fromiter((value for _, _, value in edges), dtype=float, count=len(edges))]
+            for array in arrays:
+                digest.update(np.ascontiguousarray(array).tobytes())
+        by_weight[weight] = digest.hexdigest()
+    return by_weight[weight]
+
+
+def _hashable(values:list):
+    """ Array of node ids which can be hashed by its bytes, the ids' reprs if they are not numbers."""
+    array = np.asarray(values)
+    if array.dtype == object:
+        array = np.frombuffer(repr(values).encode(), dtype=np.uint8)
+    return array
+
+
+class SearchCache:
+    """ Size-bounded memo of single source search results, keyed by graph fingerprint, weight, source node and cutoff.
+    Pass one to `network_bands.service_areas` or `service_area_cache.ServiceAreaCache` with `search_cache`.
+
+    A stored result answers any search from the same node with an equal or smaller cutoff, by filtering its distances; a search
+    with a larger cutoff reruns and replaces it. The least recently used results are evicted once there are more than
+    `max_entries` or they take more than `max_bytes`. With `cache_dir`, every result is also saved as .npz and read back when the
+    memory holds none for the node or only one with a smaller cutoff, so results outlive the session; the disk copy is not evicted, call `clear(disk = True)` to remove it.
+    With n_jobs > 1, worker processes get a copy of the cache, so only results saved to `cache_dir` are shared between them.
+
+    Parameters:
+    -----------
+        max_entries (int): Most results held in memory. Defaults to 1024, None for no limit.
+        max_bytes (int): Most bytes of result arrays held in memory. Defaults to None (no limit).
+        cache_dir (str): Optional; folder to save results in. Created if it does not exist.
+
+    Example:
+    --------
+    >>> memo = services.search_cache.SearchCache(max_entries = 500, max_bytes = 500_000_000, cache_dir = 'cache/searches')
+    >>> areas = services.network_bands.service_areas(node_dict, G, [1000, 2000], 500, 'length', search_cache = memo)
+    >>> areas = services.network_bands.service_areas(node_dict, G, [500, 1500], 500, 'length', search_cache = memo)
+    >>> memo.info()
+    >>> {'hits': 30, 'misses': 30, 'entries': 30, 'nbytes': 10245120}
+    """
+
+    def __init__(self, max_entries:int = 1024, max_bytes:int = None, cache_dir:str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        #(fingerprint, source) -> (cutoff, node_ids, x, y, distances), least recently used first.
+        self._entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        """ Hits, misses, number of results and bytes held in memory."""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'nbytes': self.nbytes}
+
+    def resize(self, max_entries:int = None, max_bytes:int = None):
+        """ Changes the memory limits, evicting results straight away if the cache is now over them."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self, disk:bool = False):
+        """ Empties the memory cache and, if `disk` is True, deletes the results saved in `cache_dir`."""
+        self._entries.clear()
+        self.nbytes = 0
+        if disk and self.cache_dir and os.path.isdir(self.cache_dir):
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.startswith('search_') and file_name.endswith('.npz'):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def search(self, graph, source, cutoff:float, weight:str):
+        """ Node id, x, y and distance arrays of every node reachable from `source` within `cutoff`, as returned by
+        `network_bands._single_source_search`, from the memo where a stored result covers the cutoff."""
+        key = (graph_fingerprint(graph, weight), source)
+        entry = self._entries.get(key)
+        if self.cache_dir and (entry is None or not _covers(entry[0], cutoff)):
+            #the disk copy may be from a larger search, e.g. by another worker or session, than the one held in memory.
+            saved = self._load(key)
+            if saved is not None and (entry is None or _covers(saved[0], cutoff)):
+                entry = saved
+                self._store(key, entry)
+        if entry is not None and _covers(entry[0], cutoff):
+            self.hits += 1
+            #a result larger than max_bytes is not held, but is still used.
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            _, node_ids, node_x, node_y, distances = entry
+            if cutoff is None or entry[0] == cutoff:
+                return node_ids, node_x, node_y, distances
+            within = distances <= cutoff
+            return node_ids[within], node_x[within], node_y[within], distances[within]
+
+        self.misses += 1
+        result = network_bands._single_source_search(graph, source, cutoff=cutoff, weight=weight)
+        entry = (cutoff, *result)
+        self._store(key, entry)
+        if self.cache_dir:
+            self._save(key, entry)
+        return result
+
+    def _store(self, key, entry):
+        """ Holds a result in memory as the most recently used, replacing any older one for the key, then evicts."""
+        if key in self._entries:
+            self.nbytes -= _entry_bytes(self._entries.pop(key))
+        self._entries[key] = entry
+        self.nbytes += _entry_bytes(entry)
+        self._evict()
+
+    def _evict(self):
+        """ Drops least recently used results until the cache is within its limits."""
+        while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries) or
+                                 (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            _, entry = self._entries.popitem(last=False)
+            self.nbytes -= _entry_bytes(entry)
+
+    def _path(self, key):
+        fingerprint, source = key
+        return os.path.join(self.cache_dir, f"search_{hashlib.sha256(f'{fingerprint}|{source!r}'.encode()).hexdigest()}.npz")
+
+    def _load(self, key):
+        """ Result saved in `cache_dir` for the key, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as saved:
+            cutoff = float(saved['cutoff'])
+            return (None if np.isnan(cutoff) else cutoff, saved['node_ids'], saved['x'], saved['y'], saved['distances'])
+
+    def _save(self, key, entry):
+        """ Saves a result to `cache_dir`, via a temporary file so parallel workers never read a partly written one."""
+        cutoff, node_ids, node_x, node_y, distances = entry
+        if node_ids.dtype == object:
+            #node ids numpy can only store as pickled objects are kept in memory only.
+            echo(f'Search from node {key[1]} not saved to {self.cache_dir}, its node ids are not numbers or strings')
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            np.savez(f, cutoff=np.nan if cutoff is None else cutoff, node_ids=node_ids, x=node_x, y=node_y, distances=distances)
+        os.replace(temporary_path, path)
+
+
+def _covers(stored_cutoff, cutoff):
+    """ True if a result searched out to `stored_cutoff` holds every node within `cutoff`, None being no cutoff."""
+    return stored_cutoff is None or (cutoff is not None and cutoff <= stored_cutoff)
+
+
+def _entry_bytes(entry):
+    return sum(array.nbytes for array in entry[1:])
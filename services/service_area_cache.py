@@ -0,0 +1,162 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from services import hulls, network_bands
+from services.instrumentation import echo, progress, stage
+
+### Incremental service areas and bands for what-if scenarios, e.g. opening, closing or moving one facility.
+### Each facility's search result (reached nodes and distances) and polygons are cached by name, so a change reruns only that
+### facility's search. Bands are cached per group of facilities whose polygons overlap; groups are disjoint, so a change only
+### redissolves the groups its old and new polygons touch.
+
+class ServiceAreaCache:
+    """ Service areas and bands of a set of facilities, updated incrementally as facilities are added, removed or moved.
+    The output of `service_areas` and `service_bands` matches `network_bands.service_areas` and `network_bands.service_bands`
+    run from scratch on the current facilities. With a `search_cache.SearchCache` as `search_cache`, moving a facility back to a
+    node it was at before reuses that search.
+
+    Attributes:
+    -----------
+        facilities (dict): name -> {'nearest_node', 'node_ids', 'distances', 'polygons', 'footprint'}, the reached nodes and
+            network distances of the facility's search and its polygon for each search distance.
+
+    Example:
+    --------
+    >>> cache = services.service_area_cache.ServiceAreaCache(G, [1000, 2000, 3000], alpha_value = 500, weight = 'length')
+    >>> cache.add(nearest_node_dict)
+    >>> closed = cache.copy()
+    >>> closed.remove(['Central Library'])
+    >>> bands = closed.service_bands()
+    """
+
+    def __init__(self, graph, search_distances:list, alpha_value:int, weight:str = 'length', hull_method = 'delaunay',
+                 edges:gpd.GeoDataFrame = None, buffer_distance:float = 50, search_cache = None):
+        self.graph = graph
+        self.search_distances = list(search_distances)
+        self.alpha_value = alpha_value
+        self.weight = weight
+        self.hull_method = hull_method
+        self.buffer_distance = buffer_distance
+        self.search_cache = search_cache
+        self.prepared_edges = None
+        if hull_method == 'edges':
+            self.prepared_edges = hulls.prepare_edges(edges, weight, graph)
+        self.facilities = {}
+        #disjoint groups of overlapping facilities, each a {'members': frozenset, 'unions': {distance: geometry}, 'footprint'}.
+        self._groups = []
+
+    def __len__(self):
+        return len(self.facilities)
+
+    def __contains__(self, name):
+        return name in self.facilities
+
+    def copy(self):
+        """ Independent copy sharing the cached searches and polygons, for trying out a scenario without changing this cache.
+        Entries are replaced rather than modified on update, so sharing them is safe."""
+        other = object.__new__(ServiceAreaCache)
+        other.__dict__.update(self.__dict__)
+        other.facilities = dict(self.facilities)
+        other._groups = list(self._groups)
+        return other
+
+    def add(self, nearest_node_dict:dict):
+        """ Adds facilities, or moves existing ones when their nearest node has changed. Facilities already cached at the same
+        node are not searched again.
+
+        Parameters:
+        -----------
+            nearest_node_dict (dict): Output of `network_bands.nearest_node_and_name`, names -> {'nearest_node': node}.
+        """
+        changed = {name: node_info['nearest_node'] for name, node_info in nearest_node_dict.items()
+                   if name not in self.facilities or self.facilities[name]['nearest_node'] != node_info['nearest_node']}
+        if not changed:
+            return
+        old_footprints = [self.facilities[name]['footprint'] for name in changed if name in self.facilities]
+        for name, nearest_node in progress(changed.items(), total=len(changed), desc='Processing nodes'):
+            self.facilities[name] = self._search(name, nearest_node)
+        self._update_groups(set(changed), old_footprints)
+
+    def move(self, name, nearest_node):
+        """ Moves a facility to a new nearest node, rerunning only its search.
+
+        Example:
+        --------
+        >>> nodes, snap_dist = services.network_bands.nearest_nodes_batch(G, [-5.93], [54.6])
+        >>> cache.move('Central Library', nodes[0])
+        """
+        if name not in self.facilities:
+            raise KeyError(f"No facility named '{name}' in the cache")
+        self.add({name: {'nearest_node': nearest_node}})
+
+    def remove(self, names:list):
+        """ Removes facilities from the cache. No searches are run, only the bands they overlapped are redissolved."""
+        missing = [name for name in names if name not in self.facilities]
+        if missing:
+            raise KeyError(f'No facilities named {missing} in the cache')
+        old_footprints = [self.facilities.pop(name)['footprint'] for name in names]
+        self._update_groups(set(names), old_footprints)
+
+    def service_areas(self):
+        """ Polygons of every facility and search distance, as returned by `network_bands.service_areas`."""
+        rows = [{'name': name, 'distance': distance, 'geometry': facility['polygons'][distance]}
+                for name, facility in self.facilities.items() for distance in self.search_distances]
+        return gpd.GeoDataFrame(rows, columns=['name', 'distance', 'geometry'], geometry='geometry', crs=4326)
+
+    def service_bands(self):
+        """ Differenced service bands of all facilities, largest distance first, as returned by `network_bands.service_bands`
+        with dissolve_cat 'distance'. Built from the cached group unions, which are disjoint, so no dissolving is rerun."""
+        distances = sorted(self.search_distances, reverse=True)
+        unions = [shapely.union_all([group['unions'][distance] for group in self._groups]) for distance in distances]
+        bands = [unions[index].difference(unions[index + 1]) for index in range(len(distances) - 1)] + [unions[-1]]
+        return gpd.GeoDataFrame({'geometry': bands, 'distance': distances}, crs=4326)
+
+    def _search(self, name, nearest_node):
+        """ Search and polygons of one facility."""
+        with stage('dijkstra', location=name) as record:
+            search = self.search_cache.search if self.search_cache is not None else network_bands._single_source_search
+            node_ids, node_x, node_y, node_distances = search(self.graph, nearest_node, cutoff=max(self.search_distances),
+                                                              weight=self.weight)
+            record['nodes'] = len(node_ids)
+        polygons = network_bands._service_area_polygons(name, node_ids, node_x, node_y, node_distances, self.search_distances,
+                                                        self.alpha_value, self.hull_method, self.prepared_edges, self.buffer_distance)
+        polygons = dict(zip(self.search_distances, polygons))
+        return {'nearest_node': nearest_node, 'node_ids': node_ids, 'distances': node_distances, 'polygons': polygons,
+                'footprint': shapely.union_all(list(polygons.values()))}
+
+    def _update_groups(self, changed:set, old_footprints:list):
+        """ Regroups and redissolves only the groups holding the changed (added, moved or removed) facilities or touched by their
+        old and new footprints."""
+        footprints = old_footprints + [self.facilities[name]['footprint'] for name in changed if name in self.facilities]
+        affected = [group for group in self._groups if group['members'] & changed or
+                    any(shapely.intersects(footprint, group['footprint']) for footprint in footprints)]
+        members = set(changed)
+        for group in affected:
+            members |= group['members']
+        #keep the cache's order so groups are built the same way each run.
+        members = [name for name in self.facilities if name in members]
+        kept = [group for group in self._groups if not any(group is other for other in affected)]
+        with stage('regroup', facilities=len(members), groups=len(affected)):
+            self._groups = kept + self._group(members)
+        echo(f'{len(members)} facilities in {len(self._groups) - len(kept)} regrouped service bands, '
+             f'{len(kept)} groups unchanged')
+
+    def _group(self, names:list):
+        """ Splits facilities into connected groups of overlapping footprints and dissolves each group's polygons per distance."""
+        if not names:
+            return []
+        footprints = np.array([self.facilities[name]['footprint'] for name in names], dtype=object)
+        left, right = shapely.STRtree(footprints).query(footprints, predicate='intersects')
+        adjacency = coo_matrix((np.ones(len(left), dtype=bool), (left, right)), shape=(len(names), len(names)))
+        n_groups, labels = connected_components(adjacency, directed=False)
+        groups = []
+        for label in range(n_groups):
+            members = [names[index] for index in np.flatnonzero(labels == label)]
+            with stage('dissolve', facilities=len(members)):
+                unions = {distance: shapely.union_all([self.facilities[name]['polygons'][distance] for name in members])
+                          for distance in self.search_distances}
+            groups.append({'members': frozenset(members), 'unions': unions,
+                           'footprint': shapely.union_all(list(unions.values()))})
+        return groups
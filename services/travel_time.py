@@ -0,0 +1,115 @@
+import copy
+import numpy as np
+import pandas as pd
+
+### Travel time edge weights from OSM maxspeed and highway tags. Each mode of transport has a speed profile: a default speed,
+### speeds by highway type and whether posted maxspeed tags are used. Speeds are in km/h, travel times in seconds.
+
+MPH_TO_KMH = 1.609344
+
+# named maxspeed values used in the UK and Ireland, in km/h.
+NAMED_MAXSPEEDS = {'gb:nsl_single': 60 * MPH_TO_KMH, 'gb:nsl_dual': 70 * MPH_TO_KMH, 'gb:motorway': 70 * MPH_TO_KMH,
+                   'uk:nsl_single': 60 * MPH_TO_KMH, 'uk:nsl_dual': 70 * MPH_TO_KMH, 'uk:motorway': 70 * MPH_TO_KMH,
+                   'national': 60 * MPH_TO_KMH, 'ie:urban': 50, 'ie:rural': 80, 'ie:national': 100, 'ie:motorway': 120,
+                   'walk': 5, 'living_street': 16}
+
+# default speed profiles. Driving speeds are UK limits for roads without a maxspeed tag, walking and cycling are typical speeds.
+SPEED_PROFILES = {
+    'driving': {'default': 48, 'use_maxspeed': True,
+                'highway': {'motorway': 112, 'motorway_link': 64, 'trunk': 96, 'trunk_link': 64, 'primary': 80, 'primary_link': 48,
+                            'secondary': 64, 'secondary_link': 48, 'tertiary': 48, 'tertiary_link': 40, 'unclassified': 48,
+                            'residential': 32, 'living_street': 16, 'service': 16, 'road': 48, 'track': 16}},
+    'walking': {'default': 4.8, 'use_maxspeed': False, 'highway': {'steps': 2.4}},
+    'cycling': {'default': 16, 'use_maxspeed': False,
+                'highway': {'steps': 2.4, 'footway': 8, 'pedestrian': 8, 'track': 12, 'path': 12, 'bridleway': 12}},
+}
+
+
+def speed_profile(network_type:str, speeds:dict = None):
+    """ Speed profile of a mode of transport, the default from `SPEED_PROFILES` updated with any of `speeds`.
+
+    Returns:
+    --------
+    Dictionary (dict) with 'default' speed, 'highway' speeds by highway type and 'use_maxspeed'.
+
+    Parameters:
+    -----------
+        network_type (str): Type of transport, e.g. driving, walking, cycling.
+        speeds (dict): Optional; overrides keyed by network type, e.g. {'driving': {'highway': {'residential': 25}}}.
+
+    Example:
+    --------
+    >>> services.travel_time.speed_profile('walking', {'walking': {'default': 4}})
+    >>> {'default': 4, 'use_maxspeed': False, 'highway': {'steps': 2.4}}
+    """
+    #pyrosm's 'driving+service' network is driven at driving speeds.
+    base_type = network_type.split('+')[0]
+    if base_type not in SPEED_PROFILES:
+        raise ValueError(f"No speed profile for network type '{network_type}', available types: {list(SPEED_PROFILES)}")
+    profile = copy.deepcopy(SPEED_PROFILES[base_type])
+    overrides = (speeds or {}).get(network_type, {})
+    profile['highway'].update(overrides.get('highway', {}))
+    profile.update({key: value for key, value in overrides.items() if key != 'highway'})
+    return profile
+
+
+def parse_maxspeed(maxspeed):
+    """ Converts OSM maxspeed tag values to km/h. Handles plain numbers (km/h), 'mph' and 'knots' units, UK and Irish named
+    limits such as 'GB:nsl_single' and lists such as '30;40', where the first value is used.
+
+    Returns:
+    --------
+    numpy array of speeds in km/h, NaN where a value is missing or cannot be read (e.g. 'none', 'signals').
+
+    Example:
+    --------
+    >>> services.travel_time.parse_maxspeed(['30 mph', '50', 'GB:nsl_single', None])
+    >>> array([48.28, 50., 96.56, nan])
+    """
+    maxspeed = pd.Series(maxspeed, dtype=object)
+    tagged = maxspeed.dropna().astype(str)
+    #few distinct values occur, so parse each once and map back.
+    values = pd.Series(tagged.unique(), dtype=object)
+    first = values.str.split(r'[;|]').str[0].str.strip().str.lower()
+    parts = first.str.extract(r'^(?P<number>\d+(?:\.\d+)?)\s*(?P<unit>mph|knots|km/h|kmh|kph)?$')
+    speeds = parts['number'].astype(float)
+    speeds = speeds.where(parts['unit'] != 'mph', speeds * MPH_TO_KMH)
+    speeds = speeds.where(parts['unit'] != 'knots', speeds * 1.852)
+    speeds = speeds.fillna(first.map(NAMED_MAXSPEEDS))
+    speeds = speeds.where(speeds > 0)
+    return tagged.map(dict(zip(values, speeds))).reindex(maxspeed.index).to_numpy(dtype=float)
+
+
+def edge_speeds(edges:pd.DataFrame, network_type:str, speeds:dict = None):
+    """ Speed in km/h of every edge for a mode of transport: the posted maxspeed where the profile uses it and the tag can be read,
+    otherwise the profile's speed for the edge's highway type, otherwise the profile's default speed.
+
+    Parameters:
+    -----------
+        edges (DataFrame): Network edges from pyrosm, with 'highway' and, for driving, 'maxspeed' columns.
+        network_type (str): Type of transport, e.g. driving, walking, cycling.
+        speeds (dict): Optional; speed profile overrides, see `speed_profile`.
+
+    Example:
+    --------
+    >>> edges['speed_kmh'] = services.travel_time.edge_speeds(edges, 'driving')
+    """
+    profile = speed_profile(network_type, speeds)
+    result = np.full(len(edges), float(profile['default']))
+    if 'highway' in edges.columns:
+        by_highway = edges['highway'].map(profile['highway']).to_numpy(dtype=float)
+        result = np.where(np.isnan(by_highway), result, by_highway)
+    if profile['use_maxspeed'] and 'maxspeed' in edges.columns:
+        posted = parse_maxspeed(edges['maxspeed'].to_numpy())
+        result = np.where(np.isnan(posted), result, posted)
+    return result
+
+
+def travel_times(edges:pd.DataFrame, network_type:str, speeds:dict = None):
+    """ Time in seconds to travel every edge, its 'length' in metres at the speed from `edge_speeds`.
+
+    Example:
+    --------
+    >>> edges['travel_time'] = services.travel_time.travel_times(edges, 'driving', speeds = {'driving': {'default': 40}})
+    """
+    return edges['length'].to_numpy(dtype=float) / (edge_speeds(edges, network_type, speeds) / 3.6)
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from services.instrumentation import echo
+
+### Assign points (e.g. households) to the zone and service band they fall in with STRtree bulk queries.
+### Zones rarely change, so zone assignments can be cached on disk keyed by a hash of both datasets;
+### only the band assignment then needs redoing when the service bands change.
+
+def dataset_hash(gdf:gpd.GeoDataFrame, columns:list = None):
+    """ sha256 hex digest of a GeoDataFrame's CRS, index, geometries and any `columns`, so edits to the data give a new hash.
+
+    Example:
+    --------
+    >>> services.zone_assign.dataset_hash(belfast_zones, columns = ['DZ2021_cd'])
+    >>> '8b1d...04fe'
+    """
+    columns = [] if columns is None else list(columns)
+    digest = hashlib.sha256(str(gdf.crs).encode())
+    digest.update(pd.util.hash_pandas_object(gdf.index).to_numpy().tobytes())
+    #hashing the coordinate arrays is much faster than serialising every geometry to WKB.
+    geometry = np.asarray(gdf.geometry.values)
+    digest.update(shapely.get_type_id(geometry).tobytes())
+    digest.update(shapely.get_num_coordinates(geometry).tobytes())
+    digest.update(shapely.get_coordinates(geometry).tobytes())
+    if columns:
+        digest.update(pd.util.hash_pandas_object(gdf[columns], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def assign_zones(points:gpd.GeoDataFrame, zones:gpd.GeoDataFrame, zone_column:str, predicate:str = 'intersects',
+                 cache_dir:str = None):
+    """ Finds the zone each point falls in with a single STRtree bulk query. Unlike a spatial join, every point gets at most one zone,
+    the first in `zones` order, so points on a shared boundary are not counted twice.
+    With `cache_dir`, the assignment is saved as Parquet keyed by a hash of both datasets and reloaded on later runs with the same data.
+
+    Returns:
+    --------
+    Series (pd.Series) of the `zone_column` value for each point, aligned to the points' index, missing where a point is in no zone.
+
+    Parameters:
+    -----------
+        points (GeoDataFrame): The points to assign, e.g. households.
+        zones (GeoDataFrame): The zone polygons, e.g. data zones. Reprojected to the points' CRS if needed.
+        zone_column (str): Column of `zones` identifying each zone, e.g. 'DZ2021_cd'.
+        predicate (str): Spatial predicate a point must satisfy against its zone, 'intersects' (default) or 'within'.
+        cache_dir (str): Optional; folder to cache assignments in. Created if it does not exist.
+
+    Example:
+    --------
+    >>> pointer['DZ2021_cd'] = services.zone_assign.assign_zones(pointer, belfast_zones, 'DZ2021_cd', cache_dir = 'testEnvironment/Data/cache')
+    """
+    zones = zones.to_crs(points.crs)
+    if cache_dir:
+        key = hashlib.sha256(f'{dataset_hash(points)}|{dataset_hash(zones, [zone_column])}|{zone_column}|{predicate}'.encode()).hexdigest()
+        cache_path = os.path.join(cache_dir, f'zones_{key}.parquet')
+        if os.path.exists(cache_path):
+            echo(f'Zone assignment loaded from cache: {cache_path}')
+            return pd.read_parquet(cache_path)[zone_column]
+
+    assigned = _first_match(points, zones, zone_column, predicate)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        assigned.to_frame().to_parquet(cache_path)
+    return assigned
+
+
+def assign_bands(points:gpd.GeoDataFrame, service_bands:gpd.GeoDataFrame, band_column:str = 'distance', predicate:str = 'within'):
+    """ Finds the service band each point falls in with a single STRtree bulk query. Cheap enough to rerun whenever the
+    service bands change, e.g. after changing the search distances.
+
+    Returns:
+    --------
+    Series (pd.Series) of the `band_column` value for each point, aligned to the points' index, missing where a point is in no band.
+
+    Parameters:
+    -----------
+        points (GeoDataFrame): The points to assign, e.g. households.
+        service_bands (GeoDataFrame): Output of `service_bands` or `network_partition_bands`. Reprojected to the points' CRS if needed.
+        band_column (str): Column of `service_bands` identifying each band. Defaults to 'distance'.
+        predicate (str): Spatial predicate a point must satisfy against its band. Defaults to 'within'.
+
+    Example:
+    --------
+    >>> pointer['distance'] = services.zone_assign.assign_bands(pointer, service_bands, 'distance')
+    """
+    return _first_match(points, service_bands.to_crs(points.crs), band_column, predicate)
+
+
+def _first_match(points:gpd.GeoDataFrame, polygons:gpd.GeoDataFrame, column:str, predicate:str):
+    """ `column` value of the first polygon matching each point under `predicate`, from one STRtree bulk query."""
+    point_index, polygon_index = shapely.STRtree(np.asarray(polygons.geometry.values)).query(
+        np.asarray(points.geometry.values), predicate=predicate)
+    #sort by point then polygon so each point's first match is the lowest polygon position.
+    order = np.lexsort((polygon_index, point_index))
+    point_index = point_index[order]
+    polygon_index = polygon_index[order]
+    first = np.r_[True, point_index[1:] != point_index[:-1]][:len(point_index)]
+
+    #reindex by position fills points in no polygon with missing values, then restores the points' own index.
+    assigned = pd.Series(polygons[column].to_numpy()[polygon_index[first]], index=point_index[first], name=column)
+    assigned = assigned.reindex(np.arange(len(points)))
+    assigned.index = points.index
+    return assigned
@@ -0,0 +1,25 @@
+import pyrosm
+import pytest
+from services import network_bands
+
+
+@pytest.fixture(scope='session')
+def test_pbf():
+    """ The small OSM extract shipped with pyrosm."""
+    return pyrosm.get_data('test_pbf')
+
+
+@pytest.fixture(scope='session')
+def driving_networkx(test_pbf):
+    return network_bands.load_osm_network(test_pbf, 'driving', 'networkx')
+
+
+@pytest.fixture(scope='session')
+def driving_csr(test_pbf):
+    return network_bands.load_osm_network(test_pbf, 'driving', 'csr')
+
+
+@pytest.fixture(scope='session')
+def helsinki_osm():
+    """ A larger extract with cycling contraflow ('oneway:bicycle') tags."""
+    return pyrosm.OSM(pyrosm.get_data('helsinki_pbf'))
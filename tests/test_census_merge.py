@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+from services import census_merge
+
+
+def _tables():
+    return {'population': pd.DataFrame({'name': ['A', 'B', 'C'], 'code': ['a', 'b', 'c'], 'people': [10, 20, 30]}),
+            'households': pd.DataFrame({'code': ['b', 'a', 'd'], 'name': ['B', 'A', 'D'], 'homes': [5, 4, 6]})}
+
+
+@pytest.mark.parametrize('join_type', ['left', 'right', 'inner', 'outer'])
+def test_matches_a_pairwise_merge(join_type):
+    tables = _tables()
+    kept = census_merge.join_census_csv(tables, 'code', drop=False, join_type=join_type)
+    expected = tables['population'].merge(tables['households'], on='code', how=join_type)
+    pd.testing.assert_frame_equal(kept.sort_values('code', ignore_index=True), expected.sort_values('code', ignore_index=True),
+                                  check_like=True)
+    dropped = census_merge.join_census_csv(tables, 'code', drop=True, join_type=join_type)
+    assert dropped.columns.tolist() == ['name', 'code', 'people', 'homes']
+
+
+def test_duplicate_keys_raise():
+    tables = _tables()
+    tables['households'] = pd.concat([tables['households'], tables['households'].iloc[:1]])
+    with pytest.raises(ValueError, match='found duplicates in') as error:
+        census_merge.join_census_csv(tables, 'code', drop=True)
+    assert "'households'" in str(error.value) and "'population'" not in str(error.value)
+
+
+def test_unknown_join_type_raises():
+    with pytest.raises(ValueError, match='join_type'):
+        census_merge.join_census_csv(_tables(), 'code', drop=True, join_type='cross')
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from services import contraction, graph_arrays
+
+
+@pytest.fixture(scope='module')
+def one_way_graph():
+    """ A one-way loop 1 -> 2 -> 3 -> 1 with a two-way spur 3 - 4, and a separate two-way edge 5 - 6."""
+    nodes = pd.DataFrame({'id': [1, 2, 3, 4, 5, 6], 'lon': [0.0, 0.01, 0.02, 0.03, 1.0, 1.01], 'lat': [0.0] * 6})
+    edges = pd.DataFrame({'u': [1, 2, 3, 3, 5], 'v': [2, 3, 1, 4, 6], 'length': [100.0, 200.0, 400.0, 50.0, 70.0],
+                          'oneway': ['yes', 'yes', 'yes', 'no', 'no']})
+    return graph_arrays.csr_graph_from_frames(nodes, edges, 'driving')
+
+
+def test_query_and_distance_matrix_match_dijkstra(one_way_graph):
+    G = one_way_graph
+    ch = contraction.build_contraction_hierarchy(G, 'length')
+    expected = dijkstra(G.matrix('length'))
+    assert np.isinf(expected).any()
+    np.testing.assert_array_equal(ch.distance_matrix(G.node_ids, G.node_ids), expected)
+    for i, source in enumerate(G.node_ids):
+        for j, target in enumerate(G.node_ids):
+            assert ch.query(source, target) == expected[i, j]
+
+
+def test_distance_matrix_matches_dijkstra_on_a_road_network(driving_csr, tmp_path):
+    G, _, _ = driving_csr
+    ch = contraction.build_contraction_hierarchy(G, 'length')
+    ch.save(tmp_path / 'driving_length.npz')
+    loaded = contraction.ContractionHierarchy.load(tmp_path / 'driving_length.npz')
+    rng = np.random.default_rng(0)
+    sources, targets = rng.choice(G.node_ids, 40), rng.choice(G.node_ids, 70)
+    expected = dijkstra(G.matrix('length'), indices=G.positions(sources))[:, G.positions(targets)]
+    assert np.isinf(expected).any()
+    np.testing.assert_allclose(loaded.distance_matrix(sources, targets, chunksize=16), expected)
+    np.testing.assert_allclose([loaded.query(s, t) for s, t in zip(sources, targets)], expected[np.arange(40), np.arange(40)])
+    assert loaded.weight == 'length'
+
+
+def test_unknown_node_raises(one_way_graph):
+    ch = contraction.build_contraction_hierarchy(one_way_graph, 'length')
+    with pytest.raises(KeyError):
+        ch.query(1, 99)
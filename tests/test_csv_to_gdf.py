@@ -0,0 +1,16 @@
+import pandas as pd
+from services import network_bands
+
+
+def test_hash_ids_differ_for_rows_at_the_same_coordinates():
+    df = pd.DataFrame({'name': ['flat 1', 'flat 2', 'flat 2'], 'X': [331131, 331131, 331131], 'Y': [376131, 376131, 376131]})
+    gdf = network_bands.csv_to_gdf(df, 'X', 'Y', input_crs=29902, id_type='hash')
+    assert gdf['id'].is_unique
+
+
+def test_hash_ids_are_stable_across_runs_and_chunk_sizes():
+    df = pd.DataFrame({'name': ['a', 'b', 'c', 'd'], 'X': [331131, 331131, 331200, 331300], 'Y': [376131, 376131, 376200, 376300]})
+    whole = network_bands.csv_to_gdf(df, 'X', 'Y', input_crs=29902, id_type='hash')
+    again = network_bands.csv_to_gdf(df, 'X', 'Y', input_crs=29902, id_type='hash')
+    chunked = pd.concat(network_bands.csv_to_gdf(df, 'X', 'Y', input_crs=29902, id_type='hash', chunksize=3))
+    assert whole['id'].tolist() == again['id'].tolist() == chunked['id'].tolist()
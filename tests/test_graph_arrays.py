@@ -0,0 +1,73 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from services import graph_arrays
+
+
+@pytest.mark.parametrize('network_type', ['driving', 'driving+service', 'walking', 'cycling', 'all', 'all_public'])
+def test_frames_match_pyrosm_directed_graph(helsinki_osm, network_type):
+    nodes, edges = helsinki_osm.get_network(network_type=network_type, nodes=True)
+    C = graph_arrays.csr_graph_from_frames(nodes, edges, network_type)
+    G = helsinki_osm.to_graph(nodes, edges, graph_type='networkx', network_type=network_type, retain_all=True, simplify=False)
+    N = graph_arrays.csr_graph_from_networkx(G)
+    assert np.array_equal(C.node_ids, N.node_ids)
+    assert C.number_of_edges() == N.number_of_edges()
+    sources = np.linspace(0, len(C.node_ids) - 1, 10).astype(int)
+    np.testing.assert_allclose(dijkstra(C.matrix('length'), indices=sources), dijkstra(N.matrix('length'), indices=sources))
+
+
+def _contraflow_street():
+    """ A one-way street, 1 -> 2, that cyclists may ride both ways."""
+    nodes = pd.DataFrame({'id': [1, 2], 'lon': [24.94, 24.95], 'lat': [60.17, 60.17]})
+    edges = pd.DataFrame({'u': [1], 'v': [2], 'length': [500.0], 'oneway': ['yes'], 'oneway:bicycle': ['no']})
+    return nodes, edges
+
+
+def test_modes_honour_cycling_contraflow():
+    nodes, edges = _contraflow_street()
+    G = graph_arrays.csr_graph_from_modes({'driving': (nodes, edges), 'cycling': (nodes, edges)})
+    driving = dijkstra(G.matrix('length_driving'))
+    cycling = dijkstra(G.matrix('length_cycling'))
+    assert driving[0, 1] == 500 and np.isinf(driving[1, 0])
+    assert cycling[0, 1] == cycling[1, 0] == 500
+
+
+def test_parallel_edges_keep_the_shortest_of_each_weight():
+    nodes = pd.DataFrame({'id': [10, 20, 30], 'lon': [0.0, 0.01, 0.02], 'lat': [0.0] * 3})
+    #two parallel 10 -> 20 edges, one shorter and one quicker, and an edge to a node missing from the node table.
+    edges = pd.DataFrame({'u': [10, 10, 20, 20], 'v': [20, 20, 30, 99], 'length': [100.0, 300.0, 50.0, 10.0],
+                          'travel_time': [60.0, 20.0, 5.0, 1.0], 'oneway': ['yes'] * 4})
+    G = graph_arrays.csr_graph_from_frames(nodes, edges, 'driving', weights=['length', 'travel_time'])
+    assert G.number_of_edges() == 2
+    assert G.matrix('length')[0, 1] == 100 and G.matrix('travel_time')[0, 1] == 20
+    assert G.matrix('length', reverse=True)[1, 0] == 100 and G.matrix('length', reverse=True)[0, 1] == 0
+    with pytest.raises(KeyError, match='99'):
+        G.positions([10, 99])
+    with pytest.raises(KeyError, match='speed'):
+        G.edge_mask('speed')
+
+
+def test_closed_edges_are_left_out_of_the_matrix():
+    G = graph_arrays.csr_graph_from_modes({'driving': _contraflow_street(), 'walking': _contraflow_street()})
+    assert G.edge_mask('length_driving').sum() == 1 and G.edge_mask('length_walking').sum() == 2
+    assert G.matrix('length_driving').nnz == 1 and G.matrix('length_walking').nnz == 2
+
+
+def test_networkx_conversion_and_subgraph_match_networkx(driving_networkx):
+    G, _, _ = driving_networkx
+    C = graph_arrays.csr_graph_from_networkx(G)
+    assert C.number_of_nodes() == G.number_of_nodes()
+    source = max(G.nodes, key=G.degree)
+    expected = nx.single_source_dijkstra_path_length(G, source, weight='length')
+    distances = dijkstra(C.matrix('length'), indices=C.positions([source])[0])
+    assert dict(zip(C.node_ids.tolist(), distances.tolist())) == pytest.approx(
+        {node: expected.get(node, np.inf) for node in C.node_ids.tolist()})
+
+    keep = C.x < np.median(C.x)
+    inside = G.subgraph(C.node_ids[keep].tolist())
+    sub = C.subgraph(keep)
+    assert sub.number_of_nodes() == inside.number_of_nodes()
+    assert sub.number_of_edges() == graph_arrays.csr_graph_from_networkx(inside).number_of_edges()
+    np.testing.assert_allclose(dijkstra(sub.matrix('length')), dijkstra(graph_arrays.csr_graph_from_networkx(inside).matrix('length')))
@@ -0,0 +1,51 @@
+import shutil
+import numpy as np
+import pytest
+from services import graph_cache, network_bands
+
+
+def _parsing_fails(monkeypatch):
+    """ Makes any parse of a .pbf fail, so a load can only come from the cache."""
+    def fail(*args, **kwargs):
+        raise AssertionError('the .pbf was parsed again')
+    monkeypatch.setattr(network_bands, 'OSM', fail)
+
+
+def test_csr_network_round_trips_through_the_cache(test_pbf, tmp_path, monkeypatch):
+    G, nodes, edges = network_bands.load_osm_network(test_pbf, 'driving', 'csr', cache_dir=tmp_path)
+    _parsing_fails(monkeypatch)
+    cached_G, cached_nodes, cached_edges = network_bands.load_osm_network(test_pbf, 'driving', 'csr', cache_dir=tmp_path)
+    for name in ['node_ids', 'x', 'y', 'indptr', 'indices']:
+        np.testing.assert_array_equal(getattr(cached_G, name), getattr(G, name))
+    assert isinstance(cached_G.indices, np.memmap)
+    assert list(cached_G.weights) == list(G.weights) == ['length', 'travel_time']
+    for weight in G.weights:
+        np.testing.assert_array_equal(cached_G.weights[weight], G.weights[weight])
+    assert cached_nodes.equals(nodes) and cached_edges.equals(edges)
+
+
+def test_networkx_network_round_trips_through_the_cache(test_pbf, tmp_path, monkeypatch):
+    G, _, _ = network_bands.load_osm_network(test_pbf, 'driving', 'networkx', cache_dir=tmp_path)
+    _parsing_fails(monkeypatch)
+    cached_G, _, _ = network_bands.load_osm_network(test_pbf, 'driving', 'networkx', cache_dir=tmp_path)
+    assert sorted(cached_G.edges(data='length')) == sorted(G.edges(data='length'))
+
+
+def test_key_changes_with_the_file_and_the_options(test_pbf, tmp_path):
+    key = graph_cache.cache_key(test_pbf, network_type='driving', graph_type='csr')
+    assert key == graph_cache.cache_key(test_pbf, graph_type='csr', network_type='driving')
+    assert key != graph_cache.cache_key(test_pbf, network_type='walking', graph_type='csr')
+    edited = tmp_path / 'edited.osm.pbf'
+    shutil.copy(test_pbf, edited)
+    with open(edited, 'ab') as f:
+        f.write(b'\0')
+    assert key != graph_cache.cache_key(str(edited), network_type='driving', graph_type='csr')
+    assert graph_cache.load_network(tmp_path, key) is None
+
+
+def test_changed_options_are_not_read_from_the_cache(test_pbf, tmp_path):
+    network_bands.load_osm_network(test_pbf, 'driving', 'csr', cache_dir=tmp_path)
+    G, _, _ = network_bands.load_osm_network(test_pbf, 'driving', 'csr', cache_dir=tmp_path,
+                                             speeds={'driving': {'default': 10, 'use_maxspeed': False, 'highway': {}}})
+    assert len(list(tmp_path.iterdir())) == 2
+    assert not isinstance(G.indices, np.memmap)
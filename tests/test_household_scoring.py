@@ -0,0 +1,14 @@
+import numpy as np
+import pandas as pd
+from services.household_scoring import aggregate_zones
+
+
+def test_households_outside_every_zone_are_kept():
+    chunks = [pd.DataFrame({'zone': ['a', None, 'a'], 'network_distance': [100, 200, np.nan]}),
+              pd.DataFrame({'zone': [None, 'b'], 'network_distance': [3000, 50]})]
+    summary = aggregate_zones(chunks, 'zone', bands=[1000, 5000]).set_index('zone')
+    assert summary['households'].sum() == 5
+    outside = summary.loc[summary.index.isna()].iloc[0]
+    assert outside['households'] == 2 and outside['max_network_distance'] == 3000
+    assert outside['households_1000'] == 1 and outside['households_5000'] == 1
+    assert summary.loc['a', 'households_reached'] == 1 and summary.loc['a', 'mean_network_distance'] == 100
@@ -0,0 +1,29 @@
+from services import instrumentation, network_bands
+
+
+def _stages(driving_csr, n_jobs:int):
+    G, _, _ = driving_csr
+    node_dict = {f'location_{i}': {'nearest_node': node} for i, node in enumerate(G.node_ids[:4])}
+    records = []
+    with instrumentation.instrument(records.append, verbose=False):
+        network_bands.service_areas(node_dict, G, [300, 600], 500, 'length', n_jobs=n_jobs)
+    return sorted(record['stage'] for record in records)
+
+
+def test_worker_stages_reach_the_parent_sinks(driving_csr):
+    stages = _stages(driving_csr, n_jobs=2)
+    assert stages == _stages(driving_csr, n_jobs=1)
+    assert stages.count('service_areas/dijkstra') == 4 and stages.count('service_areas/hull') == 8
+
+
+def test_capture_keeps_records_from_the_sinks():
+    records = []
+    with instrumentation.instrument(records.append):
+        with instrumentation.capture() as captured:
+            with instrumentation.stage('hull'):
+                pass
+        with instrumentation.stage('service_areas'):
+            for record in captured:
+                instrumentation.emit(record)
+    assert [record['stage'] for record in captured] == ['hull']
+    assert [record['stage'] for record in records] == ['service_areas/hull', 'service_areas']
@@ -0,0 +1,55 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from pyproj import Geod
+from services import graph_arrays, network_bands
+
+
+def _two_mode_graph():
+    """ Nodes 1 - 2 - 3 on a road open to driving, with a footpath 3 - 4 only walking can use."""
+    nodes = pd.DataFrame({'id': [1, 2, 3, 4], 'lon': [0.0, 0.01, 0.02, 0.03], 'lat': [0.0] * 4})
+    roads = pd.DataFrame({'u': [1, 2], 'v': [2, 3], 'length': [1000.0, 1000.0]})
+    paths = pd.DataFrame({'u': [1, 2, 3], 'v': [2, 3, 4], 'length': [1000.0, 1000.0, 1000.0]})
+    return graph_arrays.csr_graph_from_modes({'driving': (nodes, roads), 'walking': (nodes, paths)})
+
+
+def test_node_index_only_holds_nodes_open_to_the_weight(monkeypatch):
+    G = _two_mode_graph()
+    nodes, _ = network_bands.nearest_nodes_batch(G, [0.03], [0.0], weight='length_driving')
+    assert nodes.tolist() == [3]
+    nodes, _ = network_bands.nearest_nodes_batch(G, [0.03], [0.0], weight='length_walking')
+    assert nodes.tolist() == [4]
+    #later lookups come from the cache without checking the graph's edges again.
+    calls = []
+    edge_mask = G.edge_mask
+    monkeypatch.setattr(G, 'edge_mask', lambda weight: calls.append(weight) or edge_mask(weight))
+    for weight in ['length_driving', 'length_walking']:
+        tree, node_ids, geographic = network_bands.build_node_index(G, weight)
+        assert geographic and len(node_ids) == (3 if weight == 'length_driving' else 4)
+    assert calls == []
+
+
+def test_study_area_bbox_holds_every_point_within_the_buffer():
+    locations = gpd.GeoDataFrame(geometry=gpd.points_from_xy([-5.93, -5.80], [54.60, 54.65]), crs=4326).to_crs(29902)
+    min_lon, min_lat, max_lon, max_lat = network_bands.study_area_bbox(locations, 2000)
+    #points 1990m from each location in every direction, a network search of 2000m can reach no further.
+    lon, lat, _ = Geod(ellps='WGS84').fwd(np.repeat([-5.93, -5.80], 36), np.repeat([54.60, 54.65], 36),
+                                          np.tile(np.arange(0, 360, 10), 2), np.full(72, 1990))
+    assert ((lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)).all()
+    assert max_lon - min_lon < 0.21 and max_lat - min_lat < 0.1
+
+
+@pytest.mark.parametrize('fixture', ['driving_csr', 'driving_networkx'])
+def test_clipped_network_gives_the_same_searches(request, fixture):
+    G, nodes, edges = request.getfixturevalue(fixture)
+    C = G if isinstance(G, graph_arrays.CSRGraph) else graph_arrays.csr_graph_from_networkx(G)
+    source = C.node_ids[np.argmax(np.diff(C.indptr))]
+    position = C.positions([source])[0]
+    location = gpd.GeoDataFrame(geometry=gpd.points_from_xy([C.x[position]], [C.y[position]]), crs=4326)
+    clipped, clipped_nodes, clipped_edges = network_bands.clip_network(G, nodes, edges, network_bands.study_area_bbox(location, 600))
+    assert 0 < clipped.number_of_nodes() < G.number_of_nodes()
+    assert clipped_edges['u'].isin(clipped_nodes['id']).all() and clipped_edges['v'].isin(clipped_nodes['id']).all()
+    full = network_bands._single_source_search(G, source, cutoff=600, weight='length')
+    clip = network_bands._single_source_search(clipped, source, cutoff=600, weight='length')
+    assert dict(zip(full[0].tolist(), full[3].tolist())) == pytest.approx(dict(zip(clip[0].tolist(), clip[3].tolist())))
@@ -0,0 +1,77 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from scipy.sparse.csgraph import dijkstra
+from services import contraction, graph_arrays, network_bands
+
+
+def _od_case(graph, n_origins:int, n_locations:int, seed:int = 0):
+    """ Origins and locations placed on random graph nodes, some sharing a node, with the brute force distance matrix."""
+    C = graph if isinstance(graph, graph_arrays.CSRGraph) else graph_arrays.csr_graph_from_networkx(graph)
+    rng = np.random.default_rng(seed)
+    origin_positions = rng.choice(len(C.node_ids), n_origins)
+    origin_positions[1] = origin_positions[0]
+    origins = gpd.GeoDataFrame(geometry=gpd.points_from_xy(C.x[origin_positions], C.y[origin_positions]), crs=4326)
+    location_nodes = C.node_ids[rng.choice(len(C.node_ids), n_locations)]
+    location_nodes[1] = location_nodes[0]
+    locations = {f'location_{i}': {'nearest_node': node} for i, node in enumerate(location_nodes)}
+    origin_nodes, _ = network_bands.nearest_nodes_batch(graph, origins.geometry.x.values, origins.geometry.y.values)
+    expected = dijkstra(C.matrix('length'), indices=C.positions(origin_nodes))[:, C.positions(location_nodes)]
+    return origins, locations, expected
+
+
+def _dense(coo, shape):
+    matrix = np.full(shape, np.inf)
+    matrix[coo.row, coo.col] = coo.data
+    return matrix
+
+
+#more origins than locations searches backwards from the locations, fewer searches forwards from the origins.
+@pytest.mark.parametrize('n_origins, n_locations', [(60, 7), (5, 40)])
+@pytest.mark.parametrize('cutoff', [None, 1500])
+def test_dense_and_sparse_match_brute_force(driving_csr, n_origins, n_locations, cutoff):
+    G, _, _ = driving_csr
+    origins, locations, expected = _od_case(G, n_origins, n_locations)
+    #the CSR graph keeps every component, so some pairs are unreachable even without a cutoff.
+    assert np.isinf(expected).any()
+    if cutoff is not None:
+        expected[expected > cutoff] = np.inf
+    dense = network_bands.od_matrix(origins, G, locations, cutoff=cutoff, chunksize=4)
+    np.testing.assert_allclose(dense, expected)
+    sparse = network_bands.od_matrix(origins, G, locations, cutoff=cutoff, sparse=True, chunksize=4)
+    assert sparse.nnz == np.isfinite(expected).sum()
+    np.testing.assert_allclose(_dense(sparse, expected.shape), expected)
+
+
+def test_networkx_graph_matches_brute_force(driving_networkx):
+    G, _, _ = driving_networkx
+    origins, locations, expected = _od_case(G, 20, 6)
+    np.testing.assert_allclose(network_bands.od_matrix(origins, G, locations, chunksize=4), expected)
+
+
+@pytest.mark.parametrize('n_origins, n_locations', [(60, 7), (5, 40)])
+def test_k_nearest_match_brute_force(driving_csr, n_origins, n_locations):
+    G, _, _ = driving_csr
+    origins, locations, expected = _od_case(G, n_origins, n_locations)
+    expected[expected > 800] = np.inf
+    columns, distances = network_bands.od_matrix(origins, G, locations, cutoff=800, k=3, chunksize=4)
+    np.testing.assert_allclose(distances, np.sort(expected, axis=1)[:, :3])
+    found = columns >= 0
+    assert np.array_equal(found, np.isfinite(distances))
+    rows = np.nonzero(found)[0]
+    np.testing.assert_allclose(expected[rows, columns[found]], distances[found])
+    assert (~found).any()
+    sparse = network_bands.od_matrix(origins, G, locations, cutoff=800, k=3, sparse=True, chunksize=4)
+    assert sparse.nnz == found.sum()
+    np.testing.assert_allclose(_dense(sparse, expected.shape)[rows, columns[found]], distances[found])
+
+
+def test_routing_index_matches_brute_force(driving_csr):
+    G, _, _ = driving_csr
+    ch = contraction.build_contraction_hierarchy(G, 'length')
+    origins, locations, expected = _od_case(G, 30, 12)
+    np.testing.assert_allclose(network_bands.od_matrix(origins, G, locations, routing_index=ch), expected)
+    expected[expected > 1000] = np.inf
+    np.testing.assert_allclose(network_bands.od_matrix(origins, G, locations, cutoff=1000, routing_index=ch), expected)
+    with pytest.raises(ValueError, match='built with weight'):
+        network_bands.od_matrix(origins, G, locations, weight='travel_time', routing_index=ch)
@@ -0,0 +1,68 @@
+import numpy as np
+from services import network_bands
+from services.search_cache import SearchCache
+
+
+def _sources(graph, n:int):
+    return graph.node_ids[np.linspace(0, len(graph.node_ids) - 1, n).astype(int)]
+
+
+def _sorted(result):
+    node_ids, node_x, node_y, distances = result
+    order = np.argsort(node_ids)
+    return node_ids[order], distances[order]
+
+
+def test_larger_cutoff_answers_smaller_ones(driving_csr):
+    G, _, _ = driving_csr
+    source = _sources(G, 1)[0]
+    memo = SearchCache()
+    memo.search(G, source, 2000, 'length')
+    for cutoff in [500, 2000]:
+        cached = _sorted(memo.search(G, source, cutoff, 'length'))
+        fresh = _sorted(network_bands._single_source_search(G, source, cutoff=cutoff, weight='length'))
+        np.testing.assert_array_equal(cached[0], fresh[0])
+        np.testing.assert_allclose(cached[1], fresh[1])
+    assert memo.info()['hits'] == 2
+    memo.search(G, source, 3000, 'length')
+    assert memo.info()['misses'] == 2 and len(memo) == 1
+
+
+def test_least_recently_used_evicted_by_count(driving_csr):
+    G, _, _ = driving_csr
+    a, b, c = _sources(G, 3)
+    memo = SearchCache(max_entries=2)
+    for source in [a, b, a, c]:
+        memo.search(G, source, 1000, 'length')
+    assert memo.info()['hits'] == 1 and len(memo) == 2
+    memo.search(G, a, 1000, 'length')
+    memo.search(G, b, 1000, 'length')
+    assert memo.info()['hits'] == 2 and memo.info()['misses'] == 4
+
+
+def test_least_recently_used_evicted_by_bytes(driving_csr):
+    G, _, _ = driving_csr
+    a, b = _sources(G, 2)
+    memo = SearchCache(max_entries=None)
+    memo.search(G, a, 5000, 'length')
+    memo.search(G, b, 5000, 'length')
+    both = memo.nbytes
+    memo.resize(max_entries=None, max_bytes=both - 1)
+    assert len(memo) == 1 and 0 < memo.nbytes < both
+    memo.search(G, b, 5000, 'length')
+    assert memo.info()['hits'] == 1
+
+
+def test_disk_result_covering_a_larger_cutoff_is_used(driving_csr, tmp_path):
+    G, _, _ = driving_csr
+    source = _sources(G, 1)[0]
+    small, large = SearchCache(cache_dir=tmp_path), SearchCache(cache_dir=tmp_path)
+    small.search(G, source, 500, 'length')
+    large.search(G, source, 2000, 'length')
+    #the memory of `small` only covers 500, the disk copy saved by `large` covers 1500.
+    cached = _sorted(small.search(G, source, 1500, 'length'))
+    fresh = _sorted(network_bands._single_source_search(G, source, cutoff=1500, weight='length'))
+    assert small.info()['hits'] == 1 and small.info()['misses'] == 1
+    np.testing.assert_array_equal(cached[0], fresh[0])
+    small.clear(disk=True)
+    assert len(small) == 0 and not list(tmp_path.iterdir())
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from services import network_bands
+from services.search_cache import SearchCache
+from services.service_area_cache import ServiceAreaCache
+
+DISTANCES = [500, 1000]
+
+
+def _facilities(graph, n:int):
+    busiest = np.argsort(np.diff(graph.indptr))[::-1][:n]
+    return {f'facility_{i}': {'nearest_node': graph.node_ids[position]} for i, position in enumerate(busiest)}
+
+
+def _assert_matches_from_scratch(cache, graph, facilities):
+    expected = network_bands.service_areas(facilities, graph, DISTANCES, 500, 'length')
+    areas = cache.service_areas()
+    assert areas['name'].tolist() == expected['name'].tolist()
+    assert areas['distance'].tolist() == expected['distance'].tolist()
+    assert areas.geom_equals_exact(expected, tolerance=1e-9).all()
+    expected_bands = network_bands.service_bands(expected, 'distance')
+    bands = cache.service_bands().set_index('distance').loc[expected_bands['distance']]
+    utm = expected.estimate_utm_crs()
+    difference = bands.to_crs(utm).symmetric_difference(expected_bands.set_index('distance').to_crs(utm), align=True).area
+    assert difference.max() == pytest.approx(0, abs=1)
+
+
+@pytest.mark.parametrize('search_cache', [None, SearchCache()])
+def test_add_move_remove_match_from_scratch(driving_csr, search_cache):
+    G, _, _ = driving_csr
+    facilities = _facilities(G, 4)
+    cache = ServiceAreaCache(G, DISTANCES, 500, 'length', search_cache=search_cache)
+    cache.add(dict(list(facilities.items())[:3]))
+    _assert_matches_from_scratch(cache, G, dict(list(facilities.items())[:3]))
+
+    cache.add(facilities)
+    _assert_matches_from_scratch(cache, G, facilities)
+
+    moved = dict(facilities, facility_1={'nearest_node': G.node_ids[len(G.node_ids) // 2]})
+    scenario = cache.copy()
+    scenario.move('facility_1', moved['facility_1']['nearest_node'])
+    _assert_matches_from_scratch(scenario, G, moved)
+    _assert_matches_from_scratch(cache, G, facilities)
+
+    scenario.remove(['facility_0'])
+    del moved['facility_0']
+    _assert_matches_from_scratch(scenario, G, moved)
+
+
+def test_unknown_facilities_raise(driving_csr):
+    G, _, _ = driving_csr
+    cache = ServiceAreaCache(G, DISTANCES, 500, 'length')
+    cache.add(_facilities(G, 1))
+    with pytest.raises(KeyError):
+        cache.move('missing', G.node_ids[0])
+    with pytest.raises(KeyError):
+        cache.remove(['missing'])
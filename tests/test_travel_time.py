@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+from services import travel_time
+
+
+def test_parse_maxspeed_units_named_limits_and_lists():
+    speeds = travel_time.parse_maxspeed(['30 mph', '50', 'GB:nsl_single', '30;40', '10 knots', '20 km/h', 'IE:rural',
+                                         None, 'none', 'signals', '0'])
+    expected = [30 * travel_time.MPH_TO_KMH, 50, 60 * travel_time.MPH_TO_KMH, 30, 18.52, 20, 80] + [np.nan] * 4
+    np.testing.assert_allclose(speeds, expected)
+
+
+def test_edge_speeds_prefer_maxspeed_then_highway_then_default():
+    edges = pd.DataFrame({'highway': ['residential', 'residential', 'unknown', 'steps'],
+                          'maxspeed': ['20 mph', None, None, '30'], 'length': [1000.0] * 4})
+    driving = travel_time.edge_speeds(edges, 'driving')
+    np.testing.assert_allclose(driving, [20 * travel_time.MPH_TO_KMH, 32, 48, 30])
+    #walking ignores maxspeed tags.
+    np.testing.assert_allclose(travel_time.edge_speeds(edges, 'walking'), [4.8, 4.8, 4.8, 2.4])
+    overridden = travel_time.edge_speeds(edges, 'driving+service', {'driving+service': {'highway': {'residential': 25},
+                                                                                          'default': 40}})
+    np.testing.assert_allclose(overridden, [20 * travel_time.MPH_TO_KMH, 25, 40, 30])
+    np.testing.assert_allclose(travel_time.travel_times(edges, 'walking'), 1000 / (np.array([4.8, 4.8, 4.8, 2.4]) / 3.6))
+
+
+def test_unknown_network_type_raises():
+    with pytest.raises(ValueError, match='No speed profile'):
+        travel_time.speed_profile('all')
@@ -0,0 +1,9 @@
+import geopandas as gpd
+from services import zone_assign
+
+
+def test_dataset_hash_columns():
+    gdf = gpd.GeoDataFrame({'code': ['a', 'b']}, geometry=gpd.points_from_xy([0, 1], [0, 1]), crs=4326)
+    renamed = gdf.assign(code=['a', 'c'])
+    assert zone_assign.dataset_hash(gdf) == zone_assign.dataset_hash(gdf, []) == zone_assign.dataset_hash(renamed)
+    assert zone_assign.dataset_hash(gdf, ['code']) != zone_assign.dataset_hash(renamed, ['code'])